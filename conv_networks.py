@@ -2,6 +2,7 @@ import tensorflow as tf
 
 from custom_layers import Conv2DExt, DenseExt, MaxPool2DExt, FlattenExt
 from custom_layers import MaskedDense, MaskedConv2D
+from custom_layers import benchmark_dense_vs_sparse
 
 class Conv2(tf.keras.Model):
 
@@ -37,7 +38,7 @@ class Conv2(tf.keras.Model):
         return tf.keras.activations.elu(x, alpha=self.alpha)
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv_in(inputs)
         x = self.activation(x)
@@ -103,7 +104,7 @@ class Conv4(tf.keras.Model):
         return tf.keras.activations.elu(x, alpha=self.alpha)
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv_in(inputs)
         x = self.activation(x)
@@ -190,7 +191,7 @@ class Conv6(tf.keras.Model):
         return tf.keras.activations.elu(x, alpha=self.alpha)
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv_in(inputs)
         x = self.activation(x)
@@ -293,7 +294,7 @@ class Conv8(tf.keras.Model):
         return tf.keras.activations.elu(x, alpha=self.alpha)
 
 
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv_in(inputs)
         x = self.activation(x)
@@ -347,7 +348,8 @@ class Conv2_Mask(tf.keras.Model):
                  k_cnn=0.4,
                  k_dense=0.3,
                  width_multiplier=1,
-                 masking_method="fixed"):
+                 masking_method="fixed",
+                 replicas=None):
 
         super(Conv2_Mask, self).__init__()
 
@@ -357,6 +359,7 @@ class Conv2_Mask(tf.keras.Model):
                                     input_shape=input_shape,
                                     dynamic_scaling=dynamic_scaling_cnn,
                                     masking_method=masking_method,
+                                    replicas=replicas,
                                     k=k_cnn,
                                     name="conv_in")
 
@@ -368,6 +371,7 @@ class Conv2_Mask(tf.keras.Model):
                                         input_shape = conv_in_out_shape,
                                         dynamic_scaling=dynamic_scaling_cnn,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         k=k_cnn,
                                         name="conv_second")
 
@@ -379,12 +383,13 @@ class Conv2_Mask(tf.keras.Model):
 
         pooling_out_shape= self.pooling.out_shape
 
-        self.flatten = FlattenExt()
+        self.flatten = FlattenExt(replicas=replicas)
 
         self.linear_first = MaskedDense(input_dim=int(tf.math.reduce_prod(pooling_out_shape[1:]).numpy()),
                                         units=int(256*width_multiplier),
                                         dynamic_scaling=dynamic_scaling_dense,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         k=k_dense,
                                         name="linear_first")
 
@@ -392,6 +397,7 @@ class Conv2_Mask(tf.keras.Model):
                                          units=int(256*width_multiplier),
                                          dynamic_scaling=dynamic_scaling_dense,
                                          masking_method=masking_method,
+                                         replicas=replicas,
                                          k=k_dense,
                                          name="linear_second")
 
@@ -399,6 +405,7 @@ class Conv2_Mask(tf.keras.Model):
                                       units=10,
                                       dynamic_scaling=dynamic_scaling_dense,
                                       masking_method=masking_method,
+                                      replicas=replicas,
                                       k=k_dense,
                                       name="linear_out")
 
@@ -442,7 +449,7 @@ class Conv2_Mask(tf.keras.Model):
         return x,layerwise_output
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
 
         x = self.conv_in(inputs)
@@ -480,7 +487,8 @@ class Conv4_Mask(tf.keras.Model):
                  k_dense=0.3,
                  dynamic_scaling_dense=False,
                  width_multiplier=1,
-                 masking_method="fixed"):
+                 masking_method="fixed",
+                 replicas=None):
 
         super(Conv4_Mask, self).__init__()
 
@@ -490,6 +498,7 @@ class Conv4_Mask(tf.keras.Model):
                                     k=k_cnn,
                                     dynamic_scaling=dynamic_scaling_cnn,
                                     masking_method=masking_method,
+                                    replicas=replicas,
                                     name="conv_in")
 
         conv_in_out_shape = self.conv_in.out_shape
@@ -501,6 +510,7 @@ class Conv4_Mask(tf.keras.Model):
                                         k=k_cnn,
                                         dynamic_scaling=dynamic_scaling_cnn,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         name="conv_second")
 
         conv_second_out_shape = self.conv_second.out_shape
@@ -517,6 +527,7 @@ class Conv4_Mask(tf.keras.Model):
                                        k=k_cnn,
                                        dynamic_scaling=dynamic_scaling_cnn,
                                        masking_method=masking_method,
+                                       replicas=replicas,
                                        name="conv_third")
 
         conv_third_out_shape = self.conv_third.out_shape
@@ -527,6 +538,7 @@ class Conv4_Mask(tf.keras.Model):
                                         k=k_cnn,
                                         dynamic_scaling=dynamic_scaling_cnn,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         name="conv_fourth")
 
         conv_fourth_out_shape = self.conv_fourth.out_shape
@@ -536,11 +548,12 @@ class Conv4_Mask(tf.keras.Model):
                                            strides=(2,2))
         pooling_second_out_shape = self.pooling_second.out_shape
 
-        self.flatten = FlattenExt()
+        self.flatten = FlattenExt(replicas=replicas)
 
         self.linear_first = MaskedDense(input_dim=int(tf.math.reduce_prod(pooling_second_out_shape[1:]).numpy()),
                                         units=int(256*width_multiplier),
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         k=k_dense,
                                         dynamic_scaling=dynamic_scaling_dense,
                                         name="linear_first")
@@ -548,6 +561,7 @@ class Conv4_Mask(tf.keras.Model):
         self.linear_second = MaskedDense(input_dim=int(256*width_multiplier),
                                          units=int(256*width_multiplier),
                                          masking_method=masking_method,
+                                         replicas=replicas,
                                          k=k_dense,
                                          dynamic_scaling=dynamic_scaling_dense,
                                          name="linear_second")
@@ -555,6 +569,7 @@ class Conv4_Mask(tf.keras.Model):
         self.linear_out = MaskedDense(input_dim=int(256*width_multiplier),
                                       units=10,
                                       masking_method=masking_method,
+                                      replicas=replicas,
                                       k=k_dense,
                                       dynamic_scaling=dynamic_scaling_dense,
                                       name="linear_out")
@@ -614,7 +629,7 @@ class Conv4_Mask(tf.keras.Model):
 
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv_in(inputs)
         x = self.activation(x)
@@ -653,7 +668,8 @@ class Conv6_Mask(tf.keras.Model):
                  k_dense=0.3,
                  dynamic_scaling_dense=False,
                  width_multiplier=1,
-                 masking_method="fixed"):
+                 masking_method="fixed",
+                 replicas=None):
 
         super(Conv6_Mask, self).__init__()
 
@@ -663,6 +679,7 @@ class Conv6_Mask(tf.keras.Model):
                                     k=k_cnn,
                                     dynamic_scaling=dynamic_scaling_cnn,
                                     masking_method=masking_method,
+                                    replicas=replicas,
                                     name="conv_in")
 
         conv_in_out_shape = self.conv_in.out_shape
@@ -674,6 +691,7 @@ class Conv6_Mask(tf.keras.Model):
                                         k=k_cnn,
                                         dynamic_scaling=dynamic_scaling_cnn,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         name="conv_second")
 
         conv_second_out_shape = self.conv_second.out_shape
@@ -690,6 +708,7 @@ class Conv6_Mask(tf.keras.Model):
                                        k=k_cnn,
                                        dynamic_scaling=dynamic_scaling_cnn,
                                        masking_method=masking_method,
+                                       replicas=replicas,
                                        name="conv_third")
 
         conv_third_out_shape = self.conv_third.out_shape
@@ -700,6 +719,7 @@ class Conv6_Mask(tf.keras.Model):
                                         k=k_cnn,
                                         dynamic_scaling=dynamic_scaling_cnn,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         name="conv_fourth")
 
         conv_fourth_out_shape = self.conv_fourth.out_shape
@@ -715,6 +735,7 @@ class Conv6_Mask(tf.keras.Model):
                                        k=k_cnn,
                                        dynamic_scaling=dynamic_scaling_cnn,
                                        masking_method=masking_method,
+                                       replicas=replicas,
                                        name="conv_fifth")
 
         conv_fifth_out_shape = self.conv_fifth.out_shape
@@ -725,6 +746,7 @@ class Conv6_Mask(tf.keras.Model):
                                        k=k_cnn,
                                        dynamic_scaling=dynamic_scaling_cnn,
                                        masking_method=masking_method,
+                                       replicas=replicas,
                                        name="conv_sixth")
 
         conv_sixth_out_shape = self.conv_sixth.out_shape
@@ -735,11 +757,12 @@ class Conv6_Mask(tf.keras.Model):
 
         pooling_third_out_shape = self.pooling_third.out_shape
 
-        self.flatten = FlattenExt()
+        self.flatten = FlattenExt(replicas=replicas)
 
         self.linear_first = MaskedDense(input_dim=int(tf.math.reduce_prod(pooling_third_out_shape[1:]).numpy()),
                                         units=int(256*width_multiplier),
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         k=k_dense,
                                         dynamic_scaling=dynamic_scaling_dense,
                                         name="linear_first")
@@ -747,6 +770,7 @@ class Conv6_Mask(tf.keras.Model):
         self.linear_second = MaskedDense(input_dim=int(256*width_multiplier),
                                          units=int(256*width_multiplier),
                                          masking_method=masking_method,
+                                         replicas=replicas,
                                          k=k_dense,
                                          dynamic_scaling=dynamic_scaling_dense,
                                          name="linear_second")
@@ -754,6 +778,7 @@ class Conv6_Mask(tf.keras.Model):
         self.linear_out = MaskedDense(input_dim=int(256*width_multiplier),
                                       units=10,
                                       masking_method=masking_method,
+                                      replicas=replicas,
                                       k=k_dense,
                                       dynamic_scaling=dynamic_scaling_dense,
                                       name="linear_out")
@@ -813,7 +838,7 @@ class Conv6_Mask(tf.keras.Model):
 
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv_in(inputs)
         x = self.activation(x)
@@ -862,7 +887,8 @@ class Conv8_Mask(tf.keras.Model):
                  k_dense=0.3,
                  dynamic_scaling_dense=True,
                  width_multiplier=1,
-                 masking_method="fixed"):
+                 masking_method="fixed",
+                 replicas=None):
 
         super(Conv8_Mask, self).__init__()
 
@@ -873,6 +899,7 @@ class Conv8_Mask(tf.keras.Model):
                                     k=k_cnn,
                                     dynamic_scaling=dynamic_scaling_cnn,
                                     masking_method=masking_method,
+                                    replicas=replicas,
                                     name="conv_in")
         conv_in_out_shape = self.conv_in.out_shape
 
@@ -882,6 +909,7 @@ class Conv8_Mask(tf.keras.Model):
                                         k=k_cnn,
                                         dynamic_scaling=dynamic_scaling_cnn,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         name="conv_second")
         conv_second_out_shape = self.conv_second.out_shape
 
@@ -896,6 +924,7 @@ class Conv8_Mask(tf.keras.Model):
                                        k=k_cnn,
                                        dynamic_scaling=dynamic_scaling_cnn,
                                        masking_method=masking_method,
+                                       replicas=replicas,
                                        name="conv_third")
         conv_third_out_shape = self.conv_third.out_shape
 
@@ -905,6 +934,7 @@ class Conv8_Mask(tf.keras.Model):
                                         k=k_cnn,
                                         dynamic_scaling=dynamic_scaling_cnn,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         name="conv_fourth")
 
         conv_fourth_out_shape = self.conv_fourth.out_shape
@@ -921,6 +951,7 @@ class Conv8_Mask(tf.keras.Model):
                                        k=k_cnn,
                                        dynamic_scaling=dynamic_scaling_cnn,
                                        masking_method=masking_method,
+                                       replicas=replicas,
                                        name="conv_fifth")
 
         conv_fifth_out_shape = self.conv_fifth.out_shape
@@ -931,6 +962,7 @@ class Conv8_Mask(tf.keras.Model):
                                        k=k_cnn,
                                        dynamic_scaling=dynamic_scaling_cnn,
                                        masking_method=masking_method,
+                                       replicas=replicas,
                                        name="conv_sixth")
 
         conv_sixth_out_shape = self.conv_sixth.out_shape
@@ -947,6 +979,7 @@ class Conv8_Mask(tf.keras.Model):
                                          k=k_cnn,
                                          dynamic_scaling=dynamic_scaling_cnn,
                                          masking_method=masking_method,
+                                         replicas=replicas,
                                          name="conv_seventh")
 
         conv_seventh_out_shape = self.conv_seventh.out_shape
@@ -957,6 +990,7 @@ class Conv8_Mask(tf.keras.Model):
                                         k=k_cnn,
                                         dynamic_scaling=dynamic_scaling_cnn,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         name="conv_eighth")
 
         conv_eighth_out_shape = self.conv_eighth.out_shape
@@ -967,11 +1001,12 @@ class Conv8_Mask(tf.keras.Model):
 
         pooling_fourth_out_shape = self.pooling_fourth.out_shape
 
-        self.flatten = FlattenExt()
+        self.flatten = FlattenExt(replicas=replicas)
 
         self.linear_first = MaskedDense(input_dim=int(tf.math.reduce_prod(pooling_fourth_out_shape[1:]).numpy()),
                                         units=256,
                                         masking_method=masking_method,
+                                        replicas=replicas,
                                         k=k_dense,
                                         dynamic_scaling=dynamic_scaling_dense,
                                         name="linear_first")
@@ -979,6 +1014,7 @@ class Conv8_Mask(tf.keras.Model):
         self.linear_second = MaskedDense(input_dim=256,
                                          units=256,
                                          masking_method=masking_method,
+                                         replicas=replicas,
                                          k=k_dense,
                                          dynamic_scaling=dynamic_scaling_dense,
                                          name="linear_second")
@@ -986,6 +1022,7 @@ class Conv8_Mask(tf.keras.Model):
         self.linear_out = MaskedDense(input_dim=256,
                                       units=10,
                                       masking_method=masking_method,
+                                      replicas=replicas,
                                       k=k_dense,
                                       dynamic_scaling=dynamic_scaling_dense,
                                       name="linear_out")
@@ -1055,7 +1092,7 @@ class Conv8_Mask(tf.keras.Model):
         return x, layerwise_output
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv_in(inputs)
         x = self.activation(x)
@@ -1097,3 +1134,41 @@ class Conv8_Mask(tf.keras.Model):
         x = tf.nn.softmax(x)
 
         return x
+
+
+def benchmark_sparse_inference(batch_size=128,
+                               sparsity=.98,
+                               repetitions=20,
+                               compact=False):
+    """Compares the dense and the frozen sparse inference latency (see MaskedConv2D.freeze_sparse) of all signed
+    Supermask CNNs on CIFAR-10 shaped inputs
+
+    Args:
+        batch_size (int, optional): batch size of the input. Defaults to 128.
+        sparsity (float, optional): ratio of pruned weights. Defaults to .98.
+        repetitions (int, optional): number of timed forward passes. Defaults to 20.
+        compact (bool, optional): if True, the sparse model uses compact signed constant layers and the multiply-free
+                                  ternary kernel (see MaskedDense.compact_weights). Defaults to False.
+
+    Returns:
+        dict: latencies and speedup per architecture
+    """
+    input_shape = (batch_size, 32, 32, 3)
+
+    architectures = {"Conv2": Conv2_Mask,
+                     "Conv4": Conv4_Mask,
+                     "Conv6": Conv6_Mask,
+                     "Conv8": Conv8_Mask}
+
+    results = {}
+
+    for name, architecture in architectures.items():
+        results[name] = benchmark_dense_vs_sparse(lambda: architecture(input_shape=input_shape),
+                                                  input_shape=input_shape,
+                                                  sparsity=sparsity,
+                                                  repetitions=repetitions,
+                                                  compact=compact)
+
+        print(f"{name}: dense = {results[name]['dense']*1000:.3f}ms --- sparse = {results[name]['sparse']*1000:.3f}ms --- speedup = {results[name]['speedup']:.2f}")
+
+    return results
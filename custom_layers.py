@@ -1,5 +1,7 @@
 import tensorflow as tf
 import functools
+import time
+from collections import namedtuple
 #import tensorflow_probability as tfp
 from tensorflow.keras import layers
 import numpy as np
@@ -10,6 +12,175 @@ np.random.seed(seed)
 tf.random.set_seed(seed)
 
 
+def ternary_to_sparse(weights_masked):
+    """Converts an effective (masked) weight matrix of shape (fan_in, fan_out) into a transposed sparse tensor, i.e.
+    a CSR-like representation with one row per output unit. Only the non-zero entries are stored.
+
+    Args:
+        weights_masked (tf.Tensor): effective weight matrix, i.e. w * signed Supermask
+
+    Returns:
+        tf.sparse.SparseTensor: sparse representation of weights_masked with shape (fan_out, fan_in)
+    """
+    return tf.sparse.reorder(tf.sparse.from_dense(tf.transpose(weights_masked)))
+
+
+# frozen effective weights of a compact signed constant layer: scale * ternary matrix, stored as the (input, output)
+# index pairs of the positive and of the negative entries of the ternary matrix
+TernaryWeights = namedtuple("TernaryWeights", ["positive", "negative", "units", "scale"])
+
+
+def ternary_to_segments(ternary, scale):
+    """Converts a ternary matrix of shape (fan_in, fan_out) with values in {-1, 0, 1} into the index pairs of its
+    positive and negative entries, sorted by output unit
+
+    Args:
+        ternary (tf.Tensor): ternary matrix, i.e. sign(w) * signed Supermask
+        scale (float): magnitude c of the signed constant weights
+
+    Returns:
+        TernaryWeights: frozen weights for ternary_matmul
+    """
+    ternary = tf.transpose(ternary)
+
+    # tf.where returns the (output, input) indices in row-major order, i.e. sorted by output unit
+    positive = tf.reverse(tf.where(ternary > 0), axis=[1])
+    negative = tf.reverse(tf.where(ternary < 0), axis=[1])
+
+    return TernaryWeights(positive, negative, ternary.shape[0], scale)
+
+
+def ternary_matmul(inputs, ternary_weights):
+    """Multiply-free calculation of inputs @ (c * T) for a ternary matrix T: for every output unit, the inputs of its
+    positive entries are summed up and the inputs of its negative entries are subtracted. Only the result is scaled by c.
+
+    Args:
+        inputs (tf.Tensor): dense input of shape (batch, fan_in)
+        ternary_weights (TernaryWeights): frozen weights as returned by ternary_to_segments
+
+    Returns:
+        tf.Tensor: output of shape (batch, fan_out)
+    """
+    inputs_t = tf.transpose(inputs)
+
+    positive_sums = tf.math.unsorted_segment_sum(tf.gather(inputs_t, ternary_weights.positive[:, 0]),
+                                                 ternary_weights.positive[:, 1],
+                                                 num_segments=ternary_weights.units)
+    negative_sums = tf.math.unsorted_segment_sum(tf.gather(inputs_t, ternary_weights.negative[:, 0]),
+                                                 ternary_weights.negative[:, 1],
+                                                 num_segments=ternary_weights.units)
+
+    return ternary_weights.scale * tf.transpose(positive_sums - negative_sums)
+
+
+def sparse_matmul(inputs, sparse_weights):
+    """Calculates inputs @ W for a sparse, transposed weight matrix W^T as returned by ternary_to_sparse, or for the
+    ternary weights of a compact signed constant layer as returned by ternary_to_segments
+
+    Args:
+        inputs (tf.Tensor): dense input of shape (batch, fan_in)
+        sparse_weights (tf.sparse.SparseTensor or TernaryWeights): sparse weights of shape (fan_out, fan_in)
+
+    Returns:
+        tf.Tensor: output of shape (batch, fan_out)
+    """
+    if isinstance(sparse_weights, TernaryWeights):
+        return tf.cast(ternary_matmul(tf.cast(inputs, tf.float32), sparse_weights), inputs.dtype)
+
+    # the sparse weights are kept in float32, hence low precision inputs (mixed precision) are computed in float32
+    outputs = tf.sparse.sparse_dense_matmul(sparse_weights, tf.cast(inputs, sparse_weights.dtype), adjoint_b=True)
+
+    return tf.cast(tf.transpose(outputs), inputs.dtype)
+
+
+def signed_supermask_weights(w, mask, tanh_th):
+    """Fused masking of the weights with the signed Supermask, i.e. w * sign(mask) wherever |mask| > tanh_th and 0
+    elsewhere. The gradient w.r.t. mask is the one of the straight through estimator (see MaskedDense.signed_supermask),
+    upstream * w, which is computed directly instead of differentiating through the estimator's intermediate tensors.
+    No gradient is computed for the frozen weights w.
+
+    Args:
+        w (tf.Variable): frozen weights
+        mask (tf.Variable): real-valued mask of the same shape as w
+        tanh_th (float or np.ndarray): threshold of the step function (one per replica if replicas are stacked)
+
+    Returns:
+        tf.Tensor: effective weights
+    """
+    w = tf.convert_to_tensor(w)
+
+    @tf.custom_gradient
+    def masked_weights(mask):
+        # the difference of both comparisons is the ternary mask (+1, 0, -1), cheaper than where/sign on CPU
+        weights_masked = w * (tf.cast(mask > tanh_th, w.dtype) - tf.cast(mask < -tanh_th, w.dtype))
+
+        def grad(upstream):
+            return upstream * w
+
+        return weights_masked, grad
+
+    return masked_weights(tf.convert_to_tensor(mask))
+
+
+def signed_supermask_signs(w_sign, mask, tanh_th):
+    """Signs of the effective weights of a compact layer (see MaskedDense.compact_weights), i.e. the product of the
+    weight signs and the ternary signed Supermask, computed in int8
+
+    Args:
+        w_sign (tf.Variable): signs of the frozen weights (int8)
+        mask (tf.Variable): real-valued mask of the same shape as w_sign
+        tanh_th (float or np.ndarray): threshold of the step function (one per replica if replicas are stacked)
+
+    Returns:
+        tf.Tensor: signs of the effective weights (int8)
+    """
+    return w_sign * (tf.cast(mask > tanh_th, tf.int8) - tf.cast(mask < -tanh_th, tf.int8))
+
+
+def signed_supermask_compact_weights(w_sign, w_scale, mask, tanh_th):
+    """Fused masking of compact weights w = w_scale * w_sign with the signed Supermask (see signed_supermask_weights).
+    The signs of weights and mask are combined in int8 and only the product is scaled, hence the full-precision weights
+    are neither materialised in the forward pass nor held for the backward pass.
+
+    Args:
+        w_sign (tf.Variable): signs of the frozen weights (int8)
+        w_scale (tf.Variable): magnitude of the frozen weights (one per replica if replicas are stacked)
+        mask (tf.Variable): real-valued mask of the same shape as w_sign
+        tanh_th (float or np.ndarray): threshold of the step function (one per replica if replicas are stacked)
+
+    Returns:
+        tf.Tensor: effective weights
+    """
+    w_sign = tf.convert_to_tensor(w_sign)
+    w_scale = tf.convert_to_tensor(w_scale)
+
+    @tf.custom_gradient
+    def masked_weights(mask):
+        weights_masked = w_scale * tf.cast(signed_supermask_signs(w_sign, mask, tanh_th), tf.float32)
+
+        def grad(upstream):
+            return upstream * (w_scale * tf.cast(w_sign, upstream.dtype))
+
+        return weights_masked, grad
+
+    return masked_weights(tf.convert_to_tensor(mask))
+
+
+class WeightsCache:
+    """Effective weights of a masked layer materialised for evaluation (see MaskedDense.cache_weights) together with
+    the flag telling the layer's call to use them. The weights have no fixed shape and are empty unless the cache is in
+    use, hence the cache only takes memory during evaluation. The cache is a plain object and not a tf.Module, hence
+    its variables are not tracked by the layer: they are neither part of model.variables nor written to checkpoints.
+
+    Arguments:
+        dtype (tf.DType): dtype of the cached weights. Defaults to tf.float32.
+    """
+
+    def __init__(self, dtype=tf.float32):
+        self.weights = tf.Variable(tf.zeros([0], dtype=dtype), shape=tf.TensorShape(None), trainable=False,
+                                   name="weights_cache")
+        self.active = tf.Variable(False, trainable=False, name="use_cache")
+
 class MaxPool2DExt(tf.keras.layers.MaxPool2D):
     """Extends tf.keras.MaxPool2D class with a type variable which is used in the initialization phase.
     Furthermore, we add a variable which contains the output shape of the layer.
@@ -51,11 +222,27 @@ class BatchNormExt(tf.keras.layers.BatchNormalization):
         super(BatchNormExt, self).__init__(trainable=trainable)
         self.type="batchnorm"
 class FlattenExt(tf.keras.layers.Flatten):
-    """Extends tf.keras.Flatten class with a type variable which is used in the initialization phase"""
-    def __init__(self):
+    """Extends tf.keras.Flatten class with a type variable which is used in the initialization phase.
+    If replicas is set, the input holds the feature maps of several replicas stacked along the channel axis. These are
+    then flattened separately and stacked along a new leading axis, i.e. (batch, rows, cols, replicas*channels) -->
+    (replicas, batch, rows*cols*channels).
+    """
+    def __init__(self, replicas=None):
         super(FlattenExt, self).__init__()
         self.type = "flat"
 
+        self.replicas = replicas
+
+    def call(self, inputs):
+        if self.replicas is None:
+            return super(FlattenExt, self).call(inputs)
+
+        shape = tf.shape(inputs)
+        x = tf.reshape(inputs, [shape[0], shape[1], shape[2], self.replicas, -1])
+        x = tf.transpose(x, [3, 0, 1, 2, 4])
+
+        return tf.reshape(x, [self.replicas, shape[0], -1])
+
 class Conv2DExt(tf.keras.layers.Conv2D):
     """Extends tf.keras.Conv2D class with a type variable which is used in the initialization phase"""
     def __init__(self,
@@ -102,7 +289,8 @@ class MaskedDense(layers.Layer):
                  name=None,
                  dynamic_scaling=False,
                  k=0.5,
-                 tanh_th=0.01):
+                 tanh_th=0.01,
+                 replicas=None):
 
         super(MaskedDense,self).__init__()
 
@@ -121,10 +309,14 @@ class MaskedDense(layers.Layer):
 
         self.size = input_dim*units
 
+        # several independent replicas of the layer can be stacked along a leading axis
+        self.replicas = replicas
+        variable_shape = self.shape if replicas is None else (replicas,) + self.shape
+
         init_mask = tf.ones_initializer()
         init_w = tf.random_normal_initializer()
 
-        self.mask = tf.Variable(initial_value=init_mask(shape=(input_dim, units), dtype="float32"), trainable=True,
+        self.mask = tf.Variable(initial_value=init_mask(shape=variable_shape, dtype="float32"), trainable=True,
                                 name="mask")
 
         # self.threshold = 0.5
@@ -134,7 +326,7 @@ class MaskedDense(layers.Layer):
 
 
         #self.w = tf.Variable(initial_value=tf.cast(np.sqrt(6/input_dim), tf.float32), trainable=False, name="w")
-        self.w = tf.Variable(init_w(shape=(input_dim, units),dtype='float32'), trainable=False, name="w")
+        self.w = tf.Variable(init_w(shape=variable_shape,dtype='float32'), trainable=False, name="w")
 
         self.k = k
         self.k_idx =  tf.cast(tf.cast(tf.reshape(self.mask, [-1]).get_shape()[0], tf.float32)*k, tf.int32)
@@ -145,6 +337,15 @@ class MaskedDense(layers.Layer):
 
         # print("Masking Method: ", self.masking_method)
 
+        self.sparse_weights = None
+
+        # compact representation of signed constant weights (see compact_weights)
+        self.w_sign = None
+        self.w_scale = None
+
+        # effective weights materialised for evaluation (see cache_weights), not tracked by the layer
+        self.cache = WeightsCache()
+
 
     def update_tanh_th(self, new_th=-1, percentage=0.75):
         """Updates the threshold for the mask step function. In case of a fixed threshold masking, this function is not used during training
@@ -157,7 +358,11 @@ class MaskedDense(layers.Layer):
             self.tanh_th = new_th
         else:
             tanh_mask = self.mask_activation()
-            mask_max = tf.math.reduce_max(tf.math.abs(tanh_mask))
+            if self.replicas is None:
+                mask_max = tf.math.reduce_max(tf.math.abs(tanh_mask))
+            else:
+                # one threshold per replica
+                mask_max = tf.math.reduce_max(tf.math.abs(tanh_mask), axis=list(range(1, len(tanh_mask.shape))), keepdims=True)
 
             self.tanh_th = mask_max * percentage
 
@@ -177,6 +382,7 @@ class MaskedDense(layers.Layer):
         """
         self.mask = tf.Variable(tf.cast(mask, "float32"), trainable=True, name="mask")
         self.trainable_weights.append(self.mask)
+        self.cache.active.assign(False)
 
     def get_mask(self, as_logit=False):
         """ONLY USED WITH BINARY MASKING - NOT IN USE FOR SIGNED SUPERMASKS
@@ -304,13 +510,48 @@ class MaskedDense(layers.Layer):
         return tf.stop_gradient(effective_mask) + self.mask - tf.stop_gradient(self.mask)
 
     def get_normal_weights(self):
-        """Returns the weights of the layer"""
+        """Returns the weights of the layer (decompressed if the layer is compact, see compact_weights)"""
+        if self.w_sign is not None:
+            return self.w_scale * tf.cast(self.w_sign, tf.float32)
 
         return self.w
 
     def set_normal_weights(self, w):
         """Sets the weights of the layer"""
         self.w = tf.Variable(w.astype("float32"), trainable=False, name="w")
+        self.cache.active.assign(False)
+
+        self.w_sign = None
+        self.w_scale = None
+
+    def masked_weights(self):
+        """Returns the weights masked with the signed Supermask (see signed_supermask_weights), compact layers combine
+        the signs in int8 without decompressing the weights (see signed_supermask_compact_weights)
+        """
+        if self.w_sign is not None:
+            return signed_supermask_compact_weights(self.w_sign, self.w_scale, self.mask, self.tanh_th)
+
+        return signed_supermask_weights(self.w, self.mask, self.tanh_th)
+
+    def compact_weights(self):
+        """Replaces signed constant weights (all entries +-c, see initializer.initialize_weights) by their signs as int8
+        and the scalar c (one per replica), which reduces the memory of the frozen weights by a factor of 4. The
+        effective weights are computed from the signs on the fly (see masked_weights). As the layer's call is traced
+        once, compact the layer before it is called for the first time.
+        """
+        w = self.w.numpy()
+        axis = None if self.replicas is None else tuple(range(1, w.ndim))
+        scale = np.max(np.abs(w), axis=axis, keepdims=self.replicas is not None)
+
+        if not np.allclose(np.abs(w), scale):
+            raise ValueError("Only signed constant weights can be stored in the compact representation")
+
+        self.w_sign = tf.Variable(np.sign(w).astype("int8"), trainable=False, name="w_sign")
+        self.w_scale = tf.Variable(np.asarray(scale, dtype="float32"), trainable=False, name="w_scale")
+        self.w = None
+
+        # the cached effective weights are +-c or 0 as well, hence the cache only holds the ternary pattern
+        self.cache = WeightsCache(dtype=tf.int8)
 
     # def reset_mask(self):
     #     self.mask = tf.Variable(np.ones((self.input_dim,self.units), dtype="float32"))
@@ -322,7 +563,7 @@ class MaskedDense(layers.Layer):
             tf.Variable: reverse-masked weights
         """
         flipped_mask = tf.cast(tf.not_equal(self.bernoulli_mask, 1), tf.float32)
-        return tf.multiply(self.w, flipped_mask)
+        return tf.multiply(self.get_normal_weights(), flipped_mask)
 
     def get_masked_weights(self):
         """Get effective weight matrix
@@ -330,7 +571,7 @@ class MaskedDense(layers.Layer):
         Returns:
             tf.Variable: effective weight matrix
         """
-        return tf.multiply(self.w, self.bernoulli_mask)
+        return tf.multiply(self.get_normal_weights(), self.bernoulli_mask)
 
     def get_nonzero_weights(self):
         """Returns those weights that are not affected by pruning (only used with binary Supermask)
@@ -338,21 +579,81 @@ class MaskedDense(layers.Layer):
         Returns:
             tf.Variable: weights not affected by pruning
         """
-        weights_masked = tf.boolean_mask(self.w, self.bernoulli_mask)
+        weights_masked = tf.boolean_mask(self.get_normal_weights(), self.bernoulli_mask)
         return weights_masked
 
+    def cache_weights(self):
+        """Materialises the effective weights w * signed Supermask, such that subsequent forward passes skip the masking
+        and only run the matmul/conv. The cache is only valid as long as the mask does not change, hence it has to be
+        released (see release_cache) before the mask is trained further. set_mask and set_normal_weights release it.
+        Training steps (training=True) never read the cache.
+        """
+        if self.w_sign is not None:
+            weights_masked = signed_supermask_signs(self.w_sign, self.mask, self.tanh_th)
+        else:
+            weights_masked = signed_supermask_weights(self.w, self.mask, self.tanh_th)
+
+        self.cache.weights.assign(weights_masked)
+        self.cache.active.assign(True)
+
+    def cached_weights(self):
+        """Returns the effective weights materialised by cache_weights"""
+        weights_cache = tf.reshape(self.cache.weights, self.mask.shape)
+
+        if self.w_sign is not None:
+            return self.w_scale * tf.cast(weights_cache, tf.float32)
+
+        return weights_cache
+
+    def release_cache(self):
+        """Forward passes compute the effective weights from the mask again, the memory of the cache is released"""
+        self.cache.active.assign(False)
+        self.cache.weights.assign(tf.zeros([0], dtype=self.cache.weights.dtype))
+
+    def freeze_sparse(self):
+        """Freezes the layer for inference: the effective weights w * signed Supermask are stored in a sparse
+        representation and all subsequent forward passes use a sparse matmul. As the model's call is traced once,
+        freeze the layers before the model is called for the first time (e.g. on a freshly built model which received
+        the trained masks via set_mask).
+        """
+        if self.replicas is not None:
+            raise ValueError("Sparse inference is not supported for stacked replicas")
+
+        effective_mask = tf.stop_gradient(self.signed_supermask())
+
+        if self.w_sign is not None:
+            # compact layer: multiply-free kernel on the ternary matrix sign(w) * signed Supermask
+            self.sparse_weights = ternary_to_segments(tf.cast(self.w_sign, tf.float32) * effective_mask, self.w_scale)
+        else:
+            self.sparse_weights = ternary_to_sparse(tf.multiply(self.w, effective_mask))
+
+    def sparse_call(self, inputs):
+        """Forward pass of a frozen layer with sparse weights
+
+        Args:
+            inputs (tf.Variable): input to the layer
+
+        Returns:
+            tf.Variable: output of the layer
+        """
+        return sparse_matmul(inputs, self.sparse_weights)
+
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
         """Extends the call function of a normal layer by applying the (signed) Supermask before calculating the output
 
         Args:
             inputs (tf.Variable): input to the layer
+            training (bool, optional): set by keras from the model's call. Training steps are traced separately and
+                                       always compute the effective weights from the mask. Defaults to None.
 
         Returns:
             tf.Variable: output of the layer
         """
         # inputs = tf.cast(inputs, tf.float32)
 
+        if self.sparse_weights is not None:
+            return self.sparse_call(inputs)
 
         # if self.masking_method == "fixed":
         # effective_mask = self.signed_supermask()
@@ -360,7 +661,17 @@ class MaskedDense(layers.Layer):
         #     effective_mask = self.binary_supermask()
         #else:
         #    sig_mask = self.signed_supermask_score()
-        weights_masked = tf.multiply(self.w, self.signed_supermask()) #effective_mask)
+        if training:
+            weights_masked = self.masked_weights() #effective_mask)
+        else:
+            # the cached effective weights are only used during evaluation (see cache_weights)
+            weights_masked = tf.cond(self.cache.active,
+                                     lambda: self.cached_weights(),
+                                     lambda: self.masked_weights())
+
+        # masks and weights are float32 master copies, with a mixed precision policy the effective weights (+-c or 0)
+        # are cast to the layer's compute dtype
+        weights_masked = tf.cast(weights_masked, self.compute_dtype)
         # if self.dynamic_scaling is True:
             # self.no_ones = tf.reduce_sum(weights_masked)
             # self.multiplier =  tf.math.divide(tf.size(sig_mask, out_type=tf.float32), self.no_ones) #* (1./self.sigmoid_multiplier)
@@ -368,6 +679,8 @@ class MaskedDense(layers.Layer):
             #print("Multiplier in ", self.name, ": ", self.multiplier)
             # weights_masked = tf.math.divide(weights_masked , tf.math.reduce_sum(weights_masked))#tf.multiply(tf.stop_gradient( self.multiplier ), weights_masked)
 
+        # with replicas, weights_masked has shape (replicas, input_dim, units) and inputs is either the shared input
+        # (batch, input_dim) or the stacked output of the previous replicated layer (replicas, batch, input_dim)
         return tf.matmul(inputs, weights_masked)
 
 
@@ -383,6 +696,7 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
                 #  tanh_th=0.01,
                  padding="same",
                  strides=(1,1),
+                 replicas=None,
                  *args, **kwargs):
 
         super(MaskedConv2D, self).__init__(filters, kernel_size, padding=padding, strides=strides, use_bias=False, *args, **kwargs)
@@ -396,8 +710,12 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
         self.weight_shape = (kernel_size, kernel_size, input_shape[-1], filters)
         self.size = kernel_size * kernel_size * input_shape[-1] * filters
 
+        # several independent replicas of the layer can be stacked along a leading axis
+        self.replicas = replicas
+        variable_shape = self.weight_shape if replicas is None else (replicas,) + self.weight_shape
+
         init_mask = tf.ones_initializer()
-        self.mask = tf.Variable(initial_value=init_mask(shape=self.weight_shape, dtype="float32"),name="mask", trainable=True)
+        self.mask = tf.Variable(initial_value=init_mask(shape=variable_shape, dtype="float32"),name="mask", trainable=True)
 
         self.total_mask_params= tf.cast(tf.size(self.mask), tf.float32)
 
@@ -414,7 +732,7 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
         self.out_shape = (input_shape[0],new_rows,new_cols ,filters)
 
         init_kernel = tf.random_normal_initializer()
-        self.w = tf.Variable(initial_value = init_kernel(shape=self.weight_shape, dtype="float32"), name="weights", trainable=False)
+        self.w = tf.Variable(initial_value = init_kernel(shape=variable_shape, dtype="float32"), name="weights", trainable=False)
 
         self.dynamic_scaling = dynamic_scaling
 
@@ -428,6 +746,14 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
         self.masking_method = masking_method
         # self.masking = self.signed_supermask if masking_method is "fixed" else self.signed_supermask_score
 
+        self.sparse_weights = None
+
+        # compact representation of signed constant weights (see compact_weights)
+        self.w_sign = None
+        self.w_scale = None
+
+        # effective weights materialised for evaluation (see cache_weights), not tracked by the layer
+        self.cache = WeightsCache()
 
     def update_tanh_th(self, new_th=-1, percentage=0.75):
         """Updates the threshold for the mask step function. This function is only called once after initialization
@@ -439,7 +765,11 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
             self.tanh_th = new_th
         else:
             tanh_mask = self.mask_activation()
-            mask_max = tf.math.reduce_max(tf.math.abs(tanh_mask))
+            if self.replicas is None:
+                mask_max = tf.math.reduce_max(tf.math.abs(tanh_mask))
+            else:
+                # one threshold per replica
+                mask_max = tf.math.reduce_max(tf.math.abs(tanh_mask), axis=list(range(1, len(tanh_mask.shape))), keepdims=True)
 
             self.tanh_th = mask_max * percentage
 
@@ -458,6 +788,7 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
             mask (np.ndarray): mask values as array
         """
         self.mask = tf.Variable(tf.cast(mask, "float32"), name="mask")
+        self.cache.active.assign(False)
 
     def get_mask(self, as_logit=False):
         """ONLY USED WITH BINARY MASKING - NOT IN USE FOR SIGNED SUPERMASKS
@@ -483,12 +814,48 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
         return self.bernoulli_mask
 
     def get_normal_weights(self):
-        """Returns the weights of the layer"""
+        """Returns the weights of the layer (decompressed if the layer is compact, see compact_weights)"""
+        if self.w_sign is not None:
+            return self.w_scale * tf.cast(self.w_sign, tf.float32)
+
         return self.w
 
     def set_normal_weights(self, w):
         """Sets the weights of the layer"""
         self.w = tf.Variable(w.astype("float32"), trainable=False, name="weights")
+        self.cache.active.assign(False)
+
+        self.w_sign = None
+        self.w_scale = None
+
+    def masked_weights(self):
+        """Returns the weights masked with the signed Supermask (see signed_supermask_weights), compact layers combine
+        the signs in int8 without decompressing the weights (see signed_supermask_compact_weights)
+        """
+        if self.w_sign is not None:
+            return signed_supermask_compact_weights(self.w_sign, self.w_scale, self.mask, self.tanh_th)
+
+        return signed_supermask_weights(self.w, self.mask, self.tanh_th)
+
+    def compact_weights(self):
+        """Replaces signed constant weights (all entries +-c, see initializer.initialize_weights) by their signs as int8
+        and the scalar c (one per replica), which reduces the memory of the frozen weights by a factor of 4. The
+        effective weights are computed from the signs on the fly (see masked_weights). As the layer's call is traced
+        once, compact the layer before it is called for the first time.
+        """
+        w = self.w.numpy()
+        axis = None if self.replicas is None else tuple(range(1, w.ndim))
+        scale = np.max(np.abs(w), axis=axis, keepdims=self.replicas is not None)
+
+        if not np.allclose(np.abs(w), scale):
+            raise ValueError("Only signed constant weights can be stored in the compact representation")
+
+        self.w_sign = tf.Variable(np.sign(w).astype("int8"), trainable=False, name="w_sign")
+        self.w_scale = tf.Variable(np.asarray(scale, dtype="float32"), trainable=False, name="w_scale")
+        self.w = None
+
+        # the cached effective weights are +-c or 0 as well, hence the cache only holds the ternary pattern
+        self.cache = WeightsCache(dtype=tf.int8)
 
     # def reset_mask(self):
     #     self.mask = tf.Variable(np.ones((self.input_dim,self.units), dtype="float32"))
@@ -500,7 +867,7 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
             tf.Variable: reverse-masked weights
         """
         flipped_mask = tf.cast(tf.not_equal(self.bernoulli_mask, 1), tf.float32)
-        return tf.multiply(self.w, flipped_mask)
+        return tf.multiply(self.get_normal_weights(), flipped_mask)
 
     def get_masked_weights(self):
         """Get effective weight matrix
@@ -508,7 +875,7 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
         Returns:
             tf.Variable: effective weight matrix
         """
-        return tf.multiply(self.w, self.bernoulli_mask)
+        return tf.multiply(self.get_normal_weights(), self.bernoulli_mask)
 
     def get_nonzero_weights(self):
         """Returns those weights that are not affected by pruning (only used with binary Supermask)
@@ -516,7 +883,7 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
         Returns:
             tf.Variable: weights not affected by pruning
         """
-        weights_masked = tf.boolean_mask(self.w, self.bernoulli_mask)
+        weights_masked = tf.boolean_mask(self.get_normal_weights(), self.bernoulli_mask)
         return weights_masked
 
 
@@ -631,12 +998,78 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
 
         return tf.stop_gradient(effective_mask) + self.mask - tf.stop_gradient(self.mask)
 
+    def cache_weights(self):
+        """Materialises the effective weights w * signed Supermask, such that subsequent forward passes skip the masking
+        and only run the matmul/conv. The cache is only valid as long as the mask does not change, hence it has to be
+        released (see release_cache) before the mask is trained further. set_mask and set_normal_weights release it.
+        Training steps (training=True) never read the cache.
+        """
+        if self.w_sign is not None:
+            weights_masked = signed_supermask_signs(self.w_sign, self.mask, self.tanh_th)
+        else:
+            weights_masked = signed_supermask_weights(self.w, self.mask, self.tanh_th)
+
+        self.cache.weights.assign(weights_masked)
+        self.cache.active.assign(True)
+
+    def cached_weights(self):
+        """Returns the effective weights materialised by cache_weights"""
+        weights_cache = tf.reshape(self.cache.weights, self.mask.shape)
+
+        if self.w_sign is not None:
+            return self.w_scale * tf.cast(weights_cache, tf.float32)
+
+        return weights_cache
+
+    def release_cache(self):
+        """Forward passes compute the effective weights from the mask again, the memory of the cache is released"""
+        self.cache.active.assign(False)
+        self.cache.weights.assign(tf.zeros([0], dtype=self.cache.weights.dtype))
+
+    def freeze_sparse(self):
+        """Freezes the layer for inference: the effective kernel w * signed Supermask is reshaped to a
+        (kernel_size * kernel_size * in_channels, filters) matrix and stored in a sparse representation. The convolution
+        is then computed as a sparse matmul on the extracted image patches. As the model's call is traced once,
+        freeze the layers before the model is called for the first time.
+        """
+        if self.replicas is not None:
+            raise ValueError("Sparse inference is not supported for stacked replicas")
+
+        effective_mask = self.signed_supermask()
+
+        # the multiply-free kernel of compact dense layers (ternary_matmul) would gather one copy of every image
+        # patch per non-zero weight, hence compact layers use the sparse matmul of their decompressed weights as well
+        weights_masked = tf.multiply(self.get_normal_weights(), tf.stop_gradient(effective_mask))
+        self.sparse_weights = ternary_to_sparse(tf.reshape(weights_masked, (-1, self.weight_shape[-1])))
+
+    def sparse_call(self, inputs):
+        """Forward pass of a frozen layer with sparse weights (im2col + sparse matmul)
+
+        Args:
+            inputs (tf.Variable): input to the layer
+
+        Returns:
+            tf.Variable: output of the layer
+        """
+        patches = tf.image.extract_patches(inputs,
+                                           sizes=[1, self.kernel_size[0], self.kernel_size[1], 1],
+                                           strides=[1, self.strides[0], self.strides[1], 1],
+                                           rates=[1, 1, 1, 1],
+                                           padding=self.padding.upper())
+        patches_shape = tf.shape(patches)
+
+        outputs = sparse_matmul(tf.reshape(patches, (-1, patches_shape[-1])), self.sparse_weights)
+
+        return tf.reshape(outputs, tf.concat([patches_shape[:-1], [self.filters]], axis=0))
+
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
         """Extends the call function of a normal layer by applying the (signed) Supermask before calculating the output
 
         Args:
             inputs (tf.Variable): input to the layer
+            training (bool, optional): set by keras from the model's call. Training steps are traced separately and
+                                       always compute the effective weights from the mask. Defaults to None.
 
         Returns:
             tf.Variable: output of the layer
@@ -644,6 +1077,8 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
 
         # inputs = tf.cast(inputs, tf.float32)
 
+        if self.sparse_weights is not None:
+            return self.sparse_call(inputs)
         # if self.masking_method == "fixed":
         # effective_mask = self.signed_supermask()
         # elif self.masking_method == "binary":
@@ -651,7 +1086,17 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
         #else:
         #    sig_mask = self.signed_supermask_score()
 
-        weights_masked = tf.multiply(self.w, self.signed_supermask()) #, effective_mask)
+        if training:
+            weights_masked = self.masked_weights() #, effective_mask)
+        else:
+            # the cached effective weights are only used during evaluation (see cache_weights)
+            weights_masked = tf.cond(self.cache.active,
+                                     lambda: self.cached_weights(),
+                                     lambda: self.masked_weights())
+
+        # masks and weights are float32 master copies, with a mixed precision policy the effective weights (+-c or 0)
+        # are cast to the layer's compute dtype
+        weights_masked = tf.cast(weights_masked, self.compute_dtype)
 
         # if self.dynamic_scaling:
             # single_filter_size = tf.reduce_prod(sig_mask.shape[:-1])
@@ -669,6 +1114,132 @@ class MaskedConv2D(tf.keras.layers.Conv2D):
             # weights_masked = tf.multiply(self.multiplier, weights_masked)
 
 
+        if self.replicas is not None:
+            return self.replicated_convolution(inputs, weights_masked)
+
         return self.convolution_op(inputs, weights_masked)
 
+    def replicated_convolution(self, inputs, weights_masked):
+        """Convolution of stacked replicas. The feature maps of all replicas are stacked along the channel axis, i.e.
+        the inputs are either the shared input (batch, rows, cols, channels) or (batch, rows, cols, replicas*channels).
+        This amounts to a grouped convolution which is computed group-wise since grouped convolutions are not
+        supported on every device.
+
+        Args:
+            inputs (tf.Variable): input to the layer
+            weights_masked (tf.Variable): effective weights of shape (replicas, kernel_size, kernel_size, channels, filters)
+
+        Returns:
+            tf.Variable: output of the layer of shape (batch, rows, cols, replicas*filters)
+        """
+        if inputs.shape[-1] == self.weight_shape[2]:
+            replica_inputs = [inputs] * self.replicas
+        else:
+            replica_inputs = tf.split(inputs, self.replicas, axis=-1)
+
+        outputs = [self.convolution_op(replica_inputs[r], weights_masked[r]) for r in range(self.replicas)]
+
+        return tf.concat(outputs, axis=-1)
+
+
+def iterate_masked_layers(model):
+    """Iterates over all masked layers (i.e. MaskedDense and MaskedConv2D) of a model, including nested models
+
+    Args:
+        model (tf.keras.Model): model to iterate over
+
+    Yields:
+        [tf.keras.layers]: single masked layer of model
+    """
+    for l in model.layers:
+        if isinstance(l, tf.keras.Model):
+            yield from iterate_masked_layers(l)
+        elif getattr(l, "type", None) == "fefo" or getattr(l, "type", None) == "conv":
+            yield l
+
+def freeze_sparse_model(model):
+    """Freezes all masked layers of a model for sparse inference (see MaskedDense.freeze_sparse)
+
+    Args:
+        model (tf.keras.Model): signed Supermask model
+
+    Returns:
+        tf.keras.Model: model whose masked layers use sparse kernels
+    """
+    for layer in iterate_masked_layers(model):
+        layer.freeze_sparse()
+
+    return model
+
+def time_inference(model, inputs, repetitions=20):
+    """Measures the mean latency of a forward pass
+
+    Args:
+        model (tf.keras.Model): model to be benchmarked
+        inputs (tf.Tensor): batch of inputs
+        repetitions (int, optional): number of timed forward passes. Defaults to 20.
+
+    Returns:
+        float: mean latency in seconds
+    """
+    # warm-up, i.e. tracing
+    model(inputs).numpy()
+
+    time0 = time.time()
+    for _ in range(repetitions):
+        model(inputs).numpy()
+    time1 = time.time()
+
+    return (time1 - time0) / repetitions
+
+def benchmark_dense_vs_sparse(build_model,
+                              input_shape,
+                              sparsity=.98,
+                              repetitions=20,
+                              seed=7531,
+                              compact=False):
+    """Compares the inference latency of the dense and the frozen sparse forward pass of a signed Supermask model.
+    Both models receive the same signed constant weights and a random signed Supermask with the given sparsity.
+
+    Args:
+        build_model (callable): function without arguments that returns a new signed Supermask model
+        input_shape (tuple): shape of the input batch
+        sparsity (float, optional): ratio of pruned weights. Defaults to .98.
+        repetitions (int, optional): number of timed forward passes. Defaults to 20.
+        seed (int, optional): seed for weights, masks and inputs. Defaults to 7531.
+        compact (bool, optional): if True, the layers of the sparse model are compacted (see MaskedDense.compact_weights)
+                                  before freezing, i.e. the multiply-free ternary kernel is used. Defaults to False.
+
+    Returns:
+        dict: mean latency of the dense and sparse model in seconds as well as the speedup
+    """
+    rng = np.random.RandomState(seed)
+
+    dense_model = build_model()
+    sparse_model = build_model()
+
+    for dense_layer, sparse_layer in zip(iterate_masked_layers(dense_model), iterate_masked_layers(sparse_model)):
+        shape = dense_layer.w.shape
+        c = np.sqrt(2 / np.prod(shape[:-1]))
+
+        w = c * np.sign(rng.randn(*shape))
+        mask = rng.choice([-1., 0., 1.], size=shape, p=[(1-sparsity)/2, sparsity, (1-sparsity)/2])
+
+        for layer in [dense_layer, sparse_layer]:
+            layer.set_normal_weights(w)
+            layer.set_mask(mask)
+            layer.update_tanh_th(new_th=.5)
+
+        if compact:
+            sparse_layer.compact_weights()
+
+    freeze_sparse_model(sparse_model)
+
+    inputs = tf.constant(rng.randn(*input_shape).astype("float32"))
+
+    dense_time = time_inference(dense_model, inputs, repetitions=repetitions)
+    sparse_time = time_inference(sparse_model, inputs, repetitions=repetitions)
 
+    return {"dense": dense_time,
+            "sparse": sparse_time,
+            "speedup": dense_time / sparse_time}
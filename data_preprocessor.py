@@ -1,3 +1,8 @@
+import hashlib
+import json
+import os
+import shutil
+
 import tensorflow as tf
 from tensorflow.python.ops.gen_batch_ops import batch
 import tensorflow_datasets as tfds
@@ -5,6 +10,29 @@ import numpy as np
 
 TF_AUTOTUNE = tf.data.experimental.AUTOTUNE
 
+# datasets that fit into a preprocessed on-disk cache (see build_preprocessed_cache)
+CACHEABLE_DATASETS = ["mnist", "cifar", "cifar100"]
+
+# datasets small enough to be held in device memory (see TensorDataset)
+IN_MEMORY_DATASETS = ["mnist", "cifar", "cifar100"]
+
+# synthetic stand-ins: name of the real dataset, shape of an (input) image and default number of train/test examples
+SYNTHETIC_DATASETS = {"synthetic-mnist": ("mnist", (784,), (60000, 10000)),
+                      "synthetic-cifar": ("cifar", (32, 32, 3), (50000, 10000)),
+                      "synthetic-cifar100": ("cifar100", (32, 32, 3), (50000, 10000))}
+
+# streaming ImageNet pipeline (see imagenet_datasets): features of a record, crop sizes and reader settings
+IMAGENET_FEATURES = {"image/encoded": tf.io.FixedLenFeature([], tf.string),
+                     "image/class/label": tf.io.FixedLenFeature([], tf.int64)}
+IMAGENET_IMAGE_SIZE = 224
+IMAGENET_RESIZE_SIZE = 256
+IMAGENET_READERS = 16
+IMAGENET_READ_BUFFER = 8 * 1024 * 1024
+IMAGENET_SHUFFLE_BUFFER = 1024
+
+# increase whenever the cached preprocessing (standardize_image) changes, such that stale caches are not reused
+CACHE_VERSION = 1
+
 def data_loader(dataset:str):
     """Loads the specified dataset
 
@@ -91,6 +119,50 @@ def normalize_cifar100_train(image, label):
     return image, label
 
 
+def random_crop_flip(images, padding=4):
+    """Vectorised augmentation of a batch of images: every image is zero padded, randomly flipped and randomly cropped
+    to its original size (as in normalize_cifar100_train), with its own crop offsets and flip. The crop and the flip
+    are a single gather along the rows and one along the columns.
+
+    Args:
+        images (tf.Tensor): batch of images
+        padding (int, optional): padding on every side, i.e. the maximum shift. Defaults to 4.
+
+    Returns:
+        tf.Tensor: augmented batch
+    """
+    batch_size = tf.shape(images)[0]
+    height, width = images.shape[1], images.shape[2]
+
+    images = tf.pad(images, [[0,0], [padding,padding], [padding,padding], [0,0]])
+
+    offsets_y = tf.random.uniform([batch_size, 1], maxval=2*padding+1, dtype=tf.int32)
+    offsets_x = tf.random.uniform([batch_size, 1], maxval=2*padding+1, dtype=tf.int32)
+    flip = tf.random.uniform([batch_size, 1]) < .5
+
+    rows = offsets_y + tf.range(height)[None, :]
+    columns = offsets_x + tf.where(flip, tf.range(width - 1, -1, -1)[None, :], tf.range(width)[None, :])
+
+    images = tf.gather(images, rows, axis=1, batch_dims=1)
+
+    return tf.gather(images, columns, axis=2, batch_dims=1)
+
+def augment_standardized_cifar100(images):
+    """Augments a batch of standardized CIFAR-100 training images and standardizes them again, as normalize_cifar100
+    follows normalize_cifar100_train in prep_data"""
+    return tf.image.per_image_standardization(random_crop_flip(images))
+
+def normalize_cifar100_batch(images, labels):
+    """Batched version of normalize_cifar100"""
+    images = tf.cast(images, tf.float32)
+    images = tf.image.per_image_standardization(images)
+    return images, labels
+
+def augment_cifar100_batch(images, labels):
+    """Batched, vectorised version of normalize_cifar100_train followed by normalize_cifar100"""
+    images, labels = normalize_cifar100_batch(images, labels)
+    return augment_standardized_cifar100(images), labels
+
 def normalize_mnist(image, label):
     """Normalizes images: `uint8` -> `float32`."""
     image = tf.cast(image, tf.float32)
@@ -145,7 +217,7 @@ def normalize_imagenet_test(image, label):
     #image = tf.image.resize(image, [224, 224])
     # image = tf.image.random_flip_up_down(image)
     image = resize_image_keep_aspect(image, 224)
-    image = tf.image.random_crop(image, [224, 224, 3])
+    image = tf.image.resize_with_crop_or_pad(image, 224, 224)
     # image = tf.image.random_flip_left_right(image)
     image = tf.image.per_image_standardization(image)
     return image, label #tf.one_hot(label,1000)
@@ -178,10 +250,9 @@ def prep_data(ds, ds_info, batch_size, testset=False):
         ds = ds.cache()
         if testset == False: 
             ds = ds.shuffle(ds_info.splits["train"].num_examples).repeat(7)
-            ds = ds.map(normalize_cifar100_train, num_parallel_calls = tf.data.experimental.AUTOTUNE)
         else:
             ds = ds.shuffle(ds_info.splits["test"].num_examples)#.repeat()
-        ds = ds.map(normalize_cifar100, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        # standardization and augmentation are applied to whole batches, see below
         
         
     elif ds_info.name == "imagenet2012" and testset == False:
@@ -197,6 +268,11 @@ def prep_data(ds, ds_info, batch_size, testset=False):
     #ds = ds.cache()
     #ds = ds.shuffle(ds_info.splits['train'].num_examples)
     ds = ds.batch(batch_size)
+
+    if ds_info.name == "cifar100":
+        ds = ds.map(normalize_cifar100_batch if testset else augment_cifar100_batch,
+                    num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
     ds = ds.prefetch(tf.data.experimental.AUTOTUNE)
     
     return ds
@@ -211,15 +287,602 @@ def prep_imagenet_test(ds, batch_size):
     ds = ds.apply(tf.data.experimental.ignore_errors())
     return ds.batch(batch_size).prefetch(TF_AUTOTUNE)
 
-def data_handler(dataset: str, batch_size=128):
+def parse_imagenet_record(serialized):
+    """Parses a serialized ImageNet example (see write_imagenet_shards) without decoding the JPEG"""
+    features = tf.io.parse_single_example(serialized, IMAGENET_FEATURES)
+    return features["image/encoded"], features["image/class/label"]
+
+def imagenet_crop_window(encoded, random: bool):
+    """Returns the crop window [offset_height, offset_width, size, size] within the encoded JPEG that corresponds to a
+    224x224 crop of the image after its shorter side was resized to 256 pixels, hence the image can be decoded and
+    cropped in one step
+
+    Args:
+        encoded (tf.Tensor): JPEG encoded image
+        random (bool): if True the crop is placed randomly, otherwise centered
+
+    Returns:
+        tf.Tensor: crop window
+    """
+    shape = tf.image.extract_jpeg_shape(encoded)
+    height, width = shape[0], shape[1]
+
+    size = tf.cast(tf.cast(tf.minimum(height, width), tf.float32) * IMAGENET_IMAGE_SIZE / IMAGENET_RESIZE_SIZE,
+                   tf.int32)
+    size = tf.maximum(size, 1)
+
+    if random:
+        offset_height = tf.random.uniform([], 0, height - size + 1, dtype=tf.int32)
+        offset_width = tf.random.uniform([], 0, width - size + 1, dtype=tf.int32)
+    else:
+        offset_height = (height - size) // 2
+        offset_width = (width - size) // 2
+
+    return tf.stack([offset_height, offset_width, size, size])
+
+def decode_imagenet(encoded, label, random: bool):
+    """Decodes only the crop window of a JPEG (see imagenet_crop_window) and resizes it to 224x224. Pixel values
+    remain in [0, 255]."""
+    image = tf.image.decode_and_crop_jpeg(encoded, imagenet_crop_window(encoded, random), channels=3)
+    image = tf.image.resize(image, [IMAGENET_IMAGE_SIZE, IMAGENET_IMAGE_SIZE])
+    return image, label
+
+def decode_imagenet_train(encoded, label):
+    return decode_imagenet(encoded, label, random=True)
+
+def decode_imagenet_test(encoded, label):
+    return decode_imagenet(encoded, label, random=False)
+
+def augment_imagenet_batch(images, labels):
+    """Flips a random half of a batch of decoded crops horizontally (a single gather along the columns, as in
+    random_crop_flip) and standardizes every image"""
+    flip = tf.random.uniform([tf.shape(images)[0], 1]) < .5
+    columns = tf.where(flip, tf.range(IMAGENET_IMAGE_SIZE - 1, -1, -1)[None, :], tf.range(IMAGENET_IMAGE_SIZE)[None, :])
+
+    images = tf.gather(images, columns, axis=2, batch_dims=1)
+
+    return tf.image.per_image_standardization(images), labels
+
+def normalize_imagenet_batch(images, labels):
+    return tf.image.per_image_standardization(images), labels
+
+def imagenet_examples(data_dir=None, testset=False, seed=None):
+    """Dataset of (JPEG encoded image, label) pairs. The record files are read by IMAGENET_READERS parallel
+    interleaved readers, training files in a shuffled order.
+
+    Args:
+        data_dir (str, optional): directory holding "train-*" and "validation-*" TFRecord shards, e.g. written with
+        write_imagenet_shards. Defaults to None, i.e. the imagenet2012 records prepared by tfds are read.
+        testset (bool, optional): if True, the validation split is read. Defaults to False.
+        seed (int, optional): seed of the file order. Defaults to None.
+
+    Returns:
+        tf.data.Dataset: encoded images and labels
+    """
+    if data_dir is None:
+        read_config = tfds.ReadConfig(interleave_cycle_length=IMAGENET_READERS,
+                                      num_parallel_calls_for_interleave_files=TF_AUTOTUNE,
+                                      shuffle_seed=seed)
+
+        # the images are decoded (and cropped) by decode_imagenet instead of tfds
+        return tfds.load("imagenet2012",
+                         split="validation[:70%]" if testset else "train[:70%]",
+                         data_dir="./data/tfds_data",
+                         download=True,
+                         shuffle_files=not testset,
+                         as_supervised=True,
+                         read_config=read_config,
+                         decoders={"image": tfds.decode.SkipDecoding()},
+                         download_and_prepare_kwargs={"download_dir": "./data/imagenet_raw"})
+
+    files = tf.data.Dataset.list_files(os.path.join(data_dir, ("validation" if testset else "train") + "-*"),
+                                       shuffle=not testset,
+                                       seed=seed)
+
+    ds = files.interleave(lambda path: tf.data.TFRecordDataset(path, buffer_size=IMAGENET_READ_BUFFER),
+                          cycle_length=IMAGENET_READERS,
+                          num_parallel_calls=TF_AUTOTUNE,
+                          deterministic=testset)
+
+    return ds.map(parse_imagenet_record, num_parallel_calls=TF_AUTOTUNE)
+
+def imagenet_datasets(batch_size=128, data_dir=None, seed=None):
+    """Streaming ImageNet pipeline: parallel interleaved reads (see imagenet_examples), decoding fused with the crop
+    (random crop for training, center crop for evaluation, see imagenet_crop_window) and flip and standardization
+    applied to whole batches. Examples whose JPEG cannot be decoded are skipped. Labels are sparse.
+
+    Args:
+        batch_size (int, optional): batch size. Defaults to 128.
+        data_dir (str, optional): directory of local TFRecord shards, see imagenet_examples. Defaults to None.
+        seed (int, optional): seed of the file order and shuffling. Defaults to None.
+
+    Returns:
+        Tuple[tf.data.Dataset, tf.data.Dataset]: training and test set
+    """
+    ds_train = imagenet_examples(data_dir, seed=seed).shuffle(IMAGENET_SHUFFLE_BUFFER, seed=seed)
+    ds_train = ds_train.map(decode_imagenet_train, num_parallel_calls=TF_AUTOTUNE, deterministic=False)
+    ds_train = ds_train.apply(tf.data.experimental.ignore_errors())
+    ds_train = ds_train.batch(batch_size, drop_remainder=True, num_parallel_calls=TF_AUTOTUNE, deterministic=False)
+    ds_train = ds_train.map(augment_imagenet_batch, num_parallel_calls=TF_AUTOTUNE)
+
+    ds_test = imagenet_examples(data_dir, testset=True)
+    ds_test = ds_test.map(decode_imagenet_test, num_parallel_calls=TF_AUTOTUNE)
+    ds_test = ds_test.apply(tf.data.experimental.ignore_errors())
+    ds_test = ds_test.batch(batch_size, num_parallel_calls=TF_AUTOTUNE)
+    ds_test = ds_test.map(normalize_imagenet_batch, num_parallel_calls=TF_AUTOTUNE)
+
+    return ds_train.prefetch(TF_AUTOTUNE), ds_test.prefetch(TF_AUTOTUNE)
+
+def write_imagenet_shards(directory: str,
+                          examples=(2048, 512),
+                          shards=(8, 2),
+                          classes=1000,
+                          image_sizes=(160, 480),
+                          seed=0) -> str:
+    """Writes a small ImageNet stand-in of random JPEG images of random sizes, in the TFRecord layout read by
+    imagenet_datasets ("train-00000-of-00008", ..., "validation-00000-of-00002"). Meant to test and benchmark the
+    input pipeline without the real dataset.
+
+    Args:
+        directory (str): directory of the shards
+        examples (tuple, optional): number of training and validation images. Defaults to (2048, 512).
+        shards (tuple, optional): number of training and validation shards. Defaults to (8, 2).
+        classes (int, optional): number of classes. Defaults to 1000.
+        image_sizes (tuple, optional): range of the image heights and widths. Defaults to (160, 480).
+        seed (int, optional): seed of the generated images. Defaults to 0.
+
+    Returns:
+        str: directory of the shards
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+
+    for split, size, number_of_shards in zip(["train", "validation"], examples, shards):
+        for shard, indices in enumerate(np.array_split(np.arange(size), number_of_shards)):
+            path = os.path.join(directory, f"{split}-{shard:05d}-of-{number_of_shards:05d}")
+
+            with tf.io.TFRecordWriter(path) as writer:
+                for _ in indices:
+                    height, width = rng.integers(image_sizes[0], image_sizes[1] + 1, 2)
+                    # smooth random images, such that the JPEGs have realistic sizes
+                    coarse = rng.integers(0, 256, (height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+                    image = np.repeat(np.repeat(coarse, 16, axis=0), 16, axis=1)[:height, :width]
+
+                    features = {"image/encoded": tf.train.Feature(bytes_list=tf.train.BytesList(
+                                    value=[tf.io.encode_jpeg(image).numpy()])),
+                                "image/class/label": tf.train.Feature(int64_list=tf.train.Int64List(
+                                    value=[int(rng.integers(0, classes))]))}
+
+                    writer.write(tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString())
+
+    return directory
+
+def standardize_image(image, label):
+    """Casts an image to float and standardizes it, i.e. the deterministic part of the normalize functions above"""
+    image = tf.cast(image, tf.float32)
+    image = tf.image.per_image_standardization(image)
+    return image, label
+
+def cache_fingerprint(dataset: str, dtype: str) -> str:
+    """Returns the fingerprint of the preprocessing of a cached dataset"""
+    description = {"dataset": dataset,
+                   "dtype": dtype,
+                   "preprocessing": "per_image_standardization",
+                   "version": CACHE_VERSION}
+
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
+
+def preprocess_arrays(dataset: str,
+                      dtype="float32"):
+    """Loads and standardizes a dataset into numpy arrays (images and integer labels per split)
+
+    Args:
+        dataset (str): name of the dataset, one of CACHEABLE_DATASETS
+        dtype (str, optional): dtype of the images. Defaults to "float32".
+
+    Returns:
+        Tuple[str, dict]: name of the dataset (as in ds_info) and the images and labels of the "train" and "test" split
+    """
+    ds_train, ds_test, ds_info = data_loader(dataset)
+
+    arrays = {}
+
+    for split, ds in [("train", ds_train), ("test", ds_test)]:
+        images = []
+        labels = []
+
+        for image_batch, label_batch in tfds.as_numpy(ds.map(standardize_image, num_parallel_calls=TF_AUTOTUNE).batch(1024)):
+            images.append(image_batch.astype(dtype))
+            labels.append(label_batch.astype("int64"))
+
+        images = np.concatenate(images)
+
+        if ds_info.name == "mnist":
+            images = images.reshape(len(images), -1)
+
+        arrays[split] = (images, np.concatenate(labels))
+
+    return ds_info.name, arrays
+
+def build_preprocessed_cache(dataset: str,
+                             cache_dir: str,
+                             dtype="float32") -> str:
+    """Loads, standardizes and stores a dataset as .npy arrays (images and integer labels per split) in a directory
+    named after the fingerprint of the preprocessing. An existing cache with the same fingerprint is reused, hence
+    the dataset is decoded only once for all processes and runs. The cache is written to a temporary directory that
+    is renamed once complete, such that concurrent processes never read a partial cache.
+
+    Args:
+        dataset (str): name of the dataset, one of CACHEABLE_DATASETS
+        cache_dir (str): directory holding the caches
+        dtype (str, optional): dtype of the cached images, float16 halves the size. Defaults to "float32".
+
+    Returns:
+        str: directory of the cache
+    """
+    path = os.path.join(cache_dir, dataset + "_" + cache_fingerprint(dataset, dtype))
+
+    if os.path.exists(os.path.join(path, "info.json")):
+        return path
+
+    print("Building preprocessed cache", path, "...")
+
+    name, arrays = preprocess_arrays(dataset, dtype=dtype)
+
+    temp_path = path + ".tmp" + str(os.getpid())
+    os.makedirs(temp_path, exist_ok=True)
+
+    info = {"dataset": dataset, "name": name, "dtype": dtype}
+
+    for split, (images, labels) in arrays.items():
+        np.save(os.path.join(temp_path, split + "_images.npy"), images)
+        np.save(os.path.join(temp_path, split + "_labels.npy"), labels)
+
+    with open(os.path.join(temp_path, "info.json"), "w") as handle:
+        json.dump(info, handle)
+
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # another process finished the same cache first
+        shutil.rmtree(temp_path)
+
+    return path
+
+def cached_arrays(path: str,
+                  mmap_mode=None):
+    """Reads the arrays of a cache built with build_preprocessed_cache
+
+    Args:
+        path (str): directory of the cache
+        mmap_mode (str, optional): passed to np.load, "r" memory-maps the arrays. Defaults to None.
+
+    Returns:
+        Tuple[str, dict]: name of the dataset (as in ds_info) and the images and labels of the "train" and "test" split
+    """
+    with open(os.path.join(path, "info.json"), "r") as handle:
+        info = json.load(handle)
+
+    arrays = {split: (np.load(os.path.join(path, split + "_images.npy"), mmap_mode=mmap_mode),
+                      np.load(os.path.join(path, split + "_labels.npy"), mmap_mode=mmap_mode))
+              for split in ["train", "test"]}
+
+    return info["name"], arrays
+
+def gather_batches(ds, images, labels, name: str, testset=False):
+    """Maps a dataset of index batches to batches of the given (possibly memory-mapped) arrays. Every batch is gathered
+    at once. Labels are encoded and CIFAR-100 training batches are augmented as in prep_data.
+
+    Args:
+        ds (tf.dataset): batches of indices
+        images (np.ndarray): standardized images
+        labels (np.ndarray): integer labels
+        name (str): name of the dataset (as in ds_info)
+        testset (bool, optional): if True, the batches are not augmented. Defaults to False.
+
+    Returns:
+        tf.dataset: the standardized and batched dataset
+    """
+    def gather(indices):
+        # sorted indices read memory-mapped arrays sequentially, the order within a batch does not matter
+        indices = np.sort(indices)
+        return images[indices].astype(np.float32), labels[indices].astype(np.int64)
+
+    def gather_batch(indices):
+        image_batch, label_batch = tf.numpy_function(gather, [indices], (tf.float32, tf.int64))
+        image_batch.set_shape((None,) + images.shape[1:])
+        label_batch.set_shape((None,))
+
+        if name == "cifar100":
+            return image_batch, label_batch
+
+        return image_batch, tf.one_hot(label_batch, 10)
+
+    ds = ds.map(gather_batch, num_parallel_calls=TF_AUTOTUNE)
+
+    if name == "cifar100" and testset == False:
+        ds = ds.map(lambda image_batch, label_batch: (augment_standardized_cifar100(image_batch), label_batch),
+                    num_parallel_calls=TF_AUTOTUNE)
+
+    return ds.prefetch(TF_AUTOTUNE)
+
+def cached_dataset(path: str,
+                   batch_size: int,
+                   testset=False):
+    """Reads a split of a cache built with build_preprocessed_cache. The arrays are memory-mapped, hence processes
+    sharing a cache share one copy via the OS cache. Every batch is gathered from the arrays at once by its (shuffled)
+    indices (see gather_batches).
+
+    Args:
+        path (str): directory of the cache
+        batch_size (int): batch size
+        testset (bool, optional): if True, the test split is read, otherwise the training split. Defaults to False.
+
+    Returns:
+        tf.dataset: the standardized and batched dataset
+    """
+    name, arrays = cached_arrays(path, mmap_mode="r")
+
+    images, labels = arrays["test" if testset else "train"]
+
+    ds = tf.data.Dataset.range(len(labels))
+    ds = ds.shuffle(len(labels))
+
+    if name == "cifar100" and testset == False:
+        ds = ds.repeat(7)
+
+    ds = ds.batch(batch_size)
+
+    return gather_batches(ds, images, labels, name, testset=testset)
+
+def sharded_datasets(dataset: str,
+                     batch_size: int,
+                     num_shards: int,
+                     shard_index: int,
+                     seed=0,
+                     cache_dir=None,
+                     cache_dtype="float32",
+                     synthetic_examples=None):
+    """Training and test set of one of several data-parallel workers (see ModelTrainer, strategy). In every epoch, all
+    workers draw the same seeded permutation of the training set and split it into global batches of batch_size
+    examples, of which every worker takes its own part of batch_size // num_shards examples. Hence, the workers
+    together train on exactly the batches of a single process with the same seed and all workers run the same number
+    of steps (an incomplete last global batch is dropped). The test set is not sharded.
+
+    Args:
+        dataset (str): name of the dataset, one of CACHEABLE_DATASETS or SYNTHETIC_DATASETS
+        batch_size (int): global batch size, has to be divisible by num_shards
+        num_shards (int): number of workers
+        shard_index (int): index of this worker
+        seed (int, optional): seed of the permutations. Defaults to 0.
+        cache_dir (str, optional): if given, the memory-mapped on-disk cache is used (see build_preprocessed_cache).
+        Defaults to None.
+        cache_dtype (str, optional): dtype of the cached images. Defaults to "float32".
+        synthetic_examples (list, optional): see synthetic_datasets. Defaults to None.
+
+    Returns:
+        Tuple[tf.dataset, tf.dataset]: training set of this worker (batches of batch_size // num_shards) and test set
+    """
+    if batch_size % num_shards != 0:
+        raise ValueError(f"The batch size {batch_size} is not divisible by the number of workers {num_shards}")
+
+    shard_size = batch_size // num_shards
+
+    if dataset in SYNTHETIC_DATASETS:
+        name, arrays = synthetic_arrays(dataset, examples=synthetic_examples)
+    elif cache_dir is not None:
+        name, arrays = cached_arrays(build_preprocessed_cache(dataset, cache_dir, dtype=cache_dtype), mmap_mode="r")
+    else:
+        name, arrays = preprocess_arrays(dataset, dtype=cache_dtype)
+
+    train_images, train_labels = arrays["train"]
+    test_images, test_labels = arrays["test"]
+
+    ds_train = tf.data.Dataset.range(len(train_labels))
+    ds_train = ds_train.shuffle(len(train_labels), seed=seed, reshuffle_each_iteration=True)
+
+    if name == "cifar100":
+        ds_train = ds_train.repeat(7)
+
+    ds_train = ds_train.batch(batch_size, drop_remainder=True)
+    ds_train = ds_train.map(lambda indices: indices[shard_index * shard_size:(shard_index + 1) * shard_size])
+
+    ds_test = tf.data.Dataset.range(len(test_labels)).batch(batch_size)
+
+    return (gather_batches(ds_train, train_images, train_labels, name),
+            gather_batches(ds_test, test_images, test_labels, name, testset=True))
+
+class TensorDataset:
+    """Holds a whole standardized split as tensors in device memory. Batches are gathered by a random permutation of
+    the indices, which works inside a compiled training loop (see ModelTrainer.train_tensor_steps), hence no tf.data
+    pipeline is involved. Iterating over it yields the batches like a batched tf.data.Dataset.
+
+    Arguments:
+        images (np.ndarray): standardized images (flattened for MNIST)
+        labels (np.ndarray): labels, encoded as they are fed to the model
+        batch_size (int): batch size, the last batch may be smaller
+        shuffle (bool): if True, every permutation is random, otherwise batches are drawn in order. Defaults to True.
+        augment (callable): if set, applied to every gathered batch of images (inside the training graph). Defaults
+                            to None.
+        repeat (int): number of passes over the split per epoch (as ds.repeat before batching). Defaults to 1.
+    """
+
+    def __init__(self, images, labels, batch_size: int, shuffle=True, augment=None, repeat=1):
+        self.images = tf.convert_to_tensor(images)
+        self.labels = tf.convert_to_tensor(labels)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.augment = augment
+        self.repeat = repeat
+
+        self.size = int(self.labels.shape[0])
+        self.num_batches = -(-self.size * repeat // batch_size)
+
+    def cardinality(self) -> tf.Tensor:
+        """Returns the number of batches, as tf.data.Dataset.cardinality"""
+        return tf.constant(self.num_batches, dtype=tf.int64)
+
+    def permutation(self) -> tf.Tensor:
+        """Returns the order in which the examples are drawn in an epoch"""
+        if self.shuffle:
+            return tf.concat([tf.random.shuffle(tf.range(self.size)) for _ in range(self.repeat)], axis=0)
+
+        return tf.tile(tf.range(self.size), [self.repeat])
+
+    def gather_batch(self, permutation, step):
+        """Gathers a batch of an epoch
+
+        Args:
+            permutation (tf.Tensor): order of the examples in the epoch (see permutation)
+            step (tf.Tensor): index of the batch in the epoch
+
+        Returns:
+            Tuple[tf.Tensor, tf.Tensor]: images and labels of the batch
+        """
+        indices = permutation[step * self.batch_size:(step + 1) * self.batch_size]
+
+        images = tf.cast(tf.gather(self.images, indices), tf.float32)
+
+        if self.augment is not None:
+            images = self.augment(images)
+
+        return images, tf.gather(self.labels, indices)
+
+    def __iter__(self):
+        permutation = self.permutation()
+
+        for step in range(self.num_batches):
+            yield self.gather_batch(permutation, step)
+
+def tensor_datasets(dataset: str, batch_size=128, cache_dir=None, cache_dtype="float32"):
+    """Loads the standardized dataset into device memory (see TensorDataset). Labels are encoded and CIFAR-100 training
+    batches are augmented (inside the training graph) as in prep_data.
+
+    Args:
+        dataset (str): name of the dataset, one of IN_MEMORY_DATASETS
+        batch_size (int, optional): batch size. Defaults to 128.
+        cache_dir (str, optional): if given, the arrays are read from the on-disk cache (see build_preprocessed_cache)
+        instead of being preprocessed. Defaults to None.
+        cache_dtype (str, optional): dtype of the images, float16 halves the device memory. Defaults to "float32".
+
+    Returns:
+        Tuple[TensorDataset, TensorDataset]: training and test set
+    """
+    if cache_dir is not None:
+        _, arrays = cached_arrays(build_preprocessed_cache(dataset, cache_dir, dtype=cache_dtype))
+    else:
+        _, arrays = preprocess_arrays(dataset, dtype=cache_dtype)
+
+    train_images, train_labels = arrays["train"]
+    test_images, test_labels = arrays["test"]
+
+    if dataset == "cifar100":
+        return (TensorDataset(train_images, train_labels, batch_size, augment=augment_standardized_cifar100, repeat=7),
+                TensorDataset(test_images, test_labels, batch_size, shuffle=False))
+
+    return (TensorDataset(train_images, np.eye(10, dtype="float32")[train_labels], batch_size),
+            TensorDataset(test_images, np.eye(10, dtype="float32")[test_labels], batch_size, shuffle=False))
+
+def base_dataset(dataset: str) -> str:
+    """Returns the name of the real dataset a synthetic dataset stands in for, or the given name otherwise"""
+    if dataset in SYNTHETIC_DATASETS:
+        return SYNTHETIC_DATASETS[dataset][0]
+
+    return dataset
+
+def synthetic_arrays(dataset: str, examples=None, seed=0):
+    """Generates random (standardized) images and random integer labels with the input shape of the dataset a
+    synthetic dataset stands in for
+
+    Args:
+        dataset (str): one of SYNTHETIC_DATASETS
+        examples (list, optional): number of training and test examples. Defaults to None, i.e. the sizes of the
+        real dataset.
+        seed (int, optional): seed of the generated data. Defaults to 0.
+
+    Returns:
+        Tuple[str, dict]: name of the real dataset and the images and labels of the "train" and "test" split
+    """
+    name, shape, default_examples = SYNTHETIC_DATASETS[dataset]
+
+    rng = np.random.default_rng(seed)
+
+    arrays = {}
+
+    for split, size in zip(["train", "test"], examples or default_examples):
+        arrays[split] = (rng.standard_normal((size,) + shape, dtype=np.float32),
+                         rng.integers(0, 100 if name == "cifar100" else 10, size))
+
+    return name, arrays
+
+def synthetic_datasets(dataset: str, batch_size=128, examples=None, in_memory=False, seed=0):
+    """Serves synthetic data (see synthetic_arrays) with the label encoding of the real dataset (one-hot labels, sparse
+    labels for CIFAR-100). Neither tfds, the disk nor the network is involved, hence the throughput of model and
+    trainer can be measured in isolation.
+
+    Args:
+        dataset (str): one of SYNTHETIC_DATASETS
+        batch_size (int, optional): batch size. Defaults to 128.
+        examples (list, optional): number of training and test examples. Defaults to None, i.e. the sizes of the
+        real dataset.
+        in_memory (bool, optional): if True, TensorDatasets are returned, otherwise batched tf.data datasets.
+        Defaults to False.
+        seed (int, optional): seed of the generated data. Defaults to 0.
+
+    Returns:
+        Tuple: training and test set
+    """
+    name, arrays = synthetic_arrays(dataset, examples=examples, seed=seed)
+
+    splits = []
+
+    for split in ["train", "test"]:
+        images, labels = arrays[split]
+
+        if name != "cifar100":
+            labels = np.eye(10, dtype="float32")[labels]
+
+        splits.append((images, labels))
+
+    if in_memory:
+        return TensorDataset(*splits[0], batch_size), TensorDataset(*splits[1], batch_size, shuffle=False)
+
+    return tuple(tf.data.Dataset.from_tensor_slices(split).batch(batch_size).prefetch(TF_AUTOTUNE) for split in splits)
+
+def data_handler(dataset: str, batch_size=128, cache_dir=None, cache_dtype="float32", in_memory=False,
+                 synthetic_examples=None, imagenet_dir=None):
     """Pipeline that loads and prepares the dataset
 
     Args:
-        dataset (str): name of the dataset, either "mnist" or "cifar"
+        dataset (str): name of the dataset, "mnist", "cifar", "cifar100", "imagenet" or one of SYNTHETIC_DATASETS
+        cache_dir (str, optional): if given, the preprocessed dataset is read from (and if necessary written to) an
+        on-disk cache in this directory, see build_preprocessed_cache. Defaults to None.
+        cache_dtype (str, optional): dtype of the cached images. Defaults to "float32".
+        in_memory (bool, optional): if True, MNIST and CIFAR are held in device memory and batches are gathered (and
+        augmented) inside the training loop, see TensorDataset. Defaults to False.
+        synthetic_examples (list, optional): number of training and test examples of a synthetic dataset, see
+        synthetic_datasets. Defaults to None.
+        imagenet_dir (str, optional): directory of local ImageNet TFRecord shards, see imagenet_datasets. Defaults to
+        None, i.e. ImageNet is read from tfds.
 
     Returns:
         tf.dataset: standardized and batched dataset
     """
+    if dataset in SYNTHETIC_DATASETS:
+        return synthetic_datasets(dataset, batch_size, examples=synthetic_examples, in_memory=in_memory)
+
+    if dataset == "imagenet":
+        return imagenet_datasets(batch_size, data_dir=imagenet_dir)
+
+    if in_memory and dataset in IN_MEMORY_DATASETS:
+        return tensor_datasets(dataset, batch_size, cache_dir=cache_dir, cache_dtype=cache_dtype)
+
+    if cache_dir is not None and dataset in CACHEABLE_DATASETS:
+        path = build_preprocessed_cache(dataset, cache_dir, dtype=cache_dtype)
+
+        return cached_dataset(path, batch_size), cached_dataset(path, batch_size, testset=True)
+
     ds_train, ds_test, ds_info = data_loader(dataset)
 
     ds_train = prep_data(ds=ds_train, 
@@ -233,21 +896,5 @@ def data_handler(dataset: str, batch_size=128):
 
     return ds_train, ds_test
 
-def data_handler_imagenet(batch_size=128):
-    
-    BASEDIR = "./data/tfds_data"
-    DOWNLOADIR = "./data/imagenet_raw"
-
-    (ds_train, ds_test) = tfds.load("imagenet2012", 
-                                    split=['train[:70%]', 'validation[:70%]'],
-                                    data_dir=BASEDIR, 
-                                    download=True, 
-                                    shuffle_files=True,
-                                    as_supervised=True, 
-                                    with_info=False, 
-                                    download_and_prepare_kwargs= {'download_dir':DOWNLOADIR})
-    
-    ds_train = prep_imagenet(ds_train, batch_size=batch_size)
-    ds_test = prep_imagenet(ds_test, batch_size=batch_size)
-
-    return ds_train, ds_test
\ No newline at end of file
+def data_handler_imagenet(batch_size=128, data_dir=None):
+    return imagenet_datasets(batch_size, data_dir=data_dir)
@@ -5,6 +5,7 @@ from tensorflow.keras import layers
 
 from custom_layers import DenseExt
 from custom_layers import MaskedDense
+from custom_layers import benchmark_dense_vs_sparse
 
 
 class FCN(tf.keras.Model):
@@ -47,7 +48,7 @@ class FCN(tf.keras.Model):
         return x, layerwise_output
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.linear_in(inputs)
         x = self.activation(x)
@@ -68,7 +69,8 @@ class FCN_Mask(tf.keras.Model):
                 #  tanh_th=.5,
                  k=0.5,
                  activation_fcn="elu",
-                 masking_method="fixed"):
+                 masking_method="fixed",
+                 replicas=None):
 
         super(FCN_Mask,self).__init__()
 
@@ -77,21 +79,24 @@ class FCN_Mask(tf.keras.Model):
                                      dynamic_scaling=dynamic_scaling,
                                      k=k,
                                     #  tanh_th=tanh_th,
-                                     masking_method=masking_method)
+                                     masking_method=masking_method,
+                                     replicas=replicas)
 
         self.linear_h1 = MaskedDense(input_dim=300,
                                      units=100,
                                      dynamic_scaling=dynamic_scaling,
                                      k=k,
                                     #  tanh_th=tanh_th,
-                                     masking_method=masking_method)
+                                     masking_method=masking_method,
+                                     replicas=replicas)
 
         self.linear_out = MaskedDense(input_dim=100,
                                       units=10,
                                       dynamic_scaling=dynamic_scaling,
                                       k=k,
                                     #   tanh_th=tanh_th,
-                                      masking_method=masking_method)
+                                      masking_method=masking_method,
+                                      replicas=replicas)
 
 
         self.alpha = 1.0
@@ -124,7 +129,7 @@ class FCN_Mask(tf.keras.Model):
         return x, layerwise_output
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.linear_in(inputs)
         x = self.activation(x)
@@ -136,4 +141,33 @@ class FCN_Mask(tf.keras.Model):
         x = tf.nn.softmax(x)
 
 
-        return x
\ No newline at end of file
+        return x
+
+def benchmark_sparse_inference(batch_size=128,
+                               sparsity=.96,
+                               repetitions=20,
+                               compact=False):
+    """Compares the dense and the frozen sparse inference latency (see MaskedDense.freeze_sparse) of the signed
+    Supermask FCN on MNIST shaped inputs
+
+    Args:
+        batch_size (int, optional): batch size of the input. Defaults to 128.
+        sparsity (float, optional): ratio of pruned weights. Defaults to .96.
+        repetitions (int, optional): number of timed forward passes. Defaults to 20.
+        compact (bool, optional): if True, the sparse model uses compact signed constant layers and the multiply-free
+                                  ternary kernel (see MaskedDense.compact_weights). Defaults to False.
+
+    Returns:
+        dict: latencies and speedup of FCN
+    """
+    input_shape = (batch_size, 784)
+
+    results = {"FCN": benchmark_dense_vs_sparse(FCN_Mask,
+                                                input_shape=input_shape,
+                                                sparsity=sparsity,
+                                                repetitions=repetitions,
+                                                compact=compact)}
+
+    print(f"FCN: dense = {results['FCN']['dense']*1000:.3f}ms --- sparse = {results['FCN']['sparse']*1000:.3f}ms --- speedup = {results['FCN']['speedup']:.2f}")
+
+    return results
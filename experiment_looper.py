@@ -3,6 +3,12 @@ import numpy as np
 import tensorflow as tf
 
 import time
+import os
+import json
+import queue
+import socket
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import argparse
 from tensorflow_datasets.core import dataset_info
@@ -11,9 +17,11 @@ import yaml
 import pickle
 import pickletools
 
-from model_trainer import ModelTrainer
+from model_trainer import ModelTrainer, remove_checkpoint
 from weight_initializer import initializer
-from data_preprocessor import data_handler
+from data_preprocessor import data_handler, sharded_datasets, build_preprocessed_cache, base_dataset, CACHEABLE_DATASETS
+from mask_storage import save_packed_masks
+from results_store import RunStore, summarize_run, config_fingerprint
 
 from conv_networks import Conv2, Conv4, Conv6, Conv8
 from conv_networks import Conv2_Mask, Conv4_Mask, Conv6_Mask, Conv8_Mask #, VGG16_Mask, VGG19_Mask
@@ -39,21 +47,30 @@ def parse_config_file(path: str) -> dict:
             print(exc)
 
 
-def network_builder(config: dict) -> tf.keras.Model:
+def network_builder(config: dict, replicas=None) -> tf.keras.Model:
     """Given the config dictionary, this function builds the there defined tensorflow model accordingly.
     It is possible to select FCN, Conv2, Conv4, Conv6 and Conv8
 
     Args:
         config (dict): configuration in which the model is defined
+        replicas (int, optional): number of independent replicas stacked in one model (only signed Supermask FCN and
+                                  Conv2 - Conv8). Defaults to None.
 
     Returns:
         tf.keras.Model: model
     """
 
+    if "precision" not in config["model"]:
+        config["model"]["precision"] = "float32"
+
+    # float32, mixed_bfloat16 or mixed_float16 - applies to all layers built from here on. Masks and weights always
+    # remain float32, only the effective weights and activations are computed in the lower precision
+    tf.keras.mixed_precision.set_global_policy(config["model"]["precision"])
+
     #depending on the dataset the model is trained on, choose the appropriate input shape.
-    if config["data"] == "cifar":
+    if base_dataset(config["data"]) in ["cifar", "cifar100"]:
         input_shape = (128,32,32,3)
-    elif config["data"] == "mnist":
+    elif base_dataset(config["data"]) == "mnist":
         input_shape = (128,784)
 
     #go through necessary properties in config to build up the network step by step
@@ -93,7 +110,8 @@ def network_builder(config: dict) -> tf.keras.Model:
             model = FCN_Mask(masking_method=config["model"]["masking_method"],
                             #  tanh_th=config["model"]["tanh_th"],
                              k=config["model"]["k_dense"],
-                             dynamic_scaling=config["model"]["dynamic_scaling_dense"])
+                             dynamic_scaling=config["model"]["dynamic_scaling_dense"],
+                             replicas=replicas)
         elif config["model"]["type"] == "Conv2":
             model = Conv2_Mask(input_shape=input_shape,
                                 masking_method=config["model"]["masking_method"],
@@ -102,7 +120,8 @@ def network_builder(config: dict) -> tf.keras.Model:
                                 k_dense=config["model"]["k_dense"],
                                 dynamic_scaling_cnn=config["model"]["dynamic_scaling_cnn"],
                                 dynamic_scaling_dense=config["model"]["dynamic_scaling_dense"],
-                                width_multiplier=config["model"]["width_multiplier"])
+                                width_multiplier=config["model"]["width_multiplier"],
+                                replicas=replicas)
         elif config["model"]["type"] == "Conv4":
             model = Conv4_Mask(input_shape=input_shape,
                                 masking_method=config["model"]["masking_method"],
@@ -111,7 +130,8 @@ def network_builder(config: dict) -> tf.keras.Model:
                                 k_dense=config["model"]["k_dense"],
                                 dynamic_scaling_cnn=config["model"]["dynamic_scaling_cnn"],
                                 dynamic_scaling_dense=config["model"]["dynamic_scaling_dense"],
-                                width_multiplier=config["model"]["width_multiplier"])
+                                width_multiplier=config["model"]["width_multiplier"],
+                                replicas=replicas)
 
         elif config["model"]["type"] == "Conv6":
             model = Conv6_Mask(input_shape=input_shape,
@@ -121,7 +141,8 @@ def network_builder(config: dict) -> tf.keras.Model:
                                 k_dense=config["model"]["k_dense"],
                                 dynamic_scaling_cnn=config["model"]["dynamic_scaling_cnn"],
                                 dynamic_scaling_dense=config["model"]["dynamic_scaling_dense"],
-                                width_multiplier=config["model"]["width_multiplier"])
+                                width_multiplier=config["model"]["width_multiplier"],
+                                replicas=replicas)
 
         elif config["model"]["type"] == "Conv8":
             model = Conv8_Mask(input_shape=input_shape,
@@ -131,7 +152,8 @@ def network_builder(config: dict) -> tf.keras.Model:
                                 k_dense=config["model"]["k_dense"],
                                 dynamic_scaling_cnn=config["model"]["dynamic_scaling_cnn"],
                                 dynamic_scaling_dense=config["model"]["dynamic_scaling_dense"],
-                                width_multiplier=config["model"]["width_multiplier"])
+                                width_multiplier=config["model"]["width_multiplier"],
+                                replicas=replicas)
 
         elif config["model"]["type"] == "ResNet20":
             if "filter_size_multi" not in config["model"]:
@@ -179,6 +201,43 @@ def network_builder(config: dict) -> tf.keras.Model:
 
         return model
 
+def run_seed(run_number: int) -> int:
+    """Returns the seed of the initialization of a run"""
+    return 7531 + run_number
+
+def initialize_stacked_runs(model: tf.keras.Model,
+                            config: dict,
+                            run_numbers: list):
+    """Draws the weights and masks of several runs at once, with exactly the values that initialize_model sets for
+    each run if config["init"]["stateless"] is True (signed Supermask models only)
+
+    Args:
+        model (tf.keras.Model): (built, unreplicated) model that defines the layer shapes
+        config (dict): configuration of model and training
+        run_numbers (list): numbers of the runs
+
+    Returns:
+        Tuple[list, list]: weights and masks, one np.ndarray of shape (len(run_numbers), ...) per masked layer
+    """
+    init = initializer()
+    seeds = [run_seed(run_number) for run_number in run_numbers]
+
+    weights = init.initialize_runs(model,
+                                   seeds,
+                                   dist=config["init"]["weight"]["dist"],
+                                   method=config["init"]["weight"]["method"],
+                                   factor=np.sqrt(config["init"]["weight"]["factor"]),
+                                   set_mask=False)
+
+    masks = init.initialize_runs(model,
+                                 seeds,
+                                 dist=config["init"]["mask"]["dist"],
+                                 method=config["init"]["mask"]["method"],
+                                 factor=config["init"]["mask"]["factor"],
+                                 set_mask=True)
+
+    return weights, masks
+
 def initialize_model(model:tf.keras.Model,
                      config:dict,
                      run_number:int,
@@ -189,53 +248,60 @@ def initialize_model(model:tf.keras.Model,
         model (tf.keras.Model): model to be trained
         config (dict): configuration of model and training
         run_number (int): number of experiment (There are only 50 pre-defined weight and mask tensors)
+        on_the_fly (bool, optional): if True, the weights are drawn from the global random state instead of being loaded
+        from files (pickles per run, or banks if config["init"]["bank"] is True). Ignored if config["init"]["stateless"]
+        is True. Defaults to False.
 
     Returns:
         tf.keras.Model: model with initialized weight and mask values
     """
 
-    SEED = 7531 + run_number
+    SEED = run_seed(run_number)
 
     init = initializer(seed=SEED)
 
-    if on_the_fly == True:
+    if config["init"]["stateless"] == True:
+        # every layer is regenerated from (seed, layer index) alone, no weight files required
+        model = init.set_weights_stateless(model,
+                                           dist=config["init"]["weight"]["dist"],
+                                           method=config["init"]["weight"]["method"],
+                                           factor=np.sqrt(config["init"]["weight"]["factor"]),
+                                           set_mask=False)
 
         if config["baseline"] == False:
-            #weights
-            model, _ = init.set_weights_man(model,
-                                            dist=config["init"]["weight"]["dist"],
-                                            method=config["init"]["weight"]["method"],
-                                            factor=np.sqrt(config["init"]["weight"]["factor"]), # .57
-                                            single_value=False,
-                                            save_to="",
-                                            weight_as_constant=True,
-                                            set_mask=False)
-
-            #mask
-            model, _ = init.set_weights_man(model,
+            model = init.set_weights_stateless(model,
+                                               dist=config["init"]["mask"]["dist"],
+                                               method=config["init"]["mask"]["method"],
+                                               factor=config["init"]["mask"]["factor"],
+                                               set_mask=True)
+
+    elif on_the_fly == True:
+        # global random state, seeded with SEED by the initializer
+        model = init.set_weights_global(model,
+                                        dist=config["init"]["weight"]["dist"],
+                                        method=config["init"]["weight"]["method"],
+                                        factor=np.sqrt(config["init"]["weight"]["factor"]), # .57
+                                        set_mask=False)
+
+        if config["baseline"] == False:
+            model = init.set_weights_global(model,
                                             dist=config["init"]["mask"]["dist"],
                                             method=config["init"]["mask"]["method"],
-                                            factor= config["init"]["mask"]["factor"],
-                                            save_to="",
-                                            weight_as_constant=False,
+                                            factor=config["init"]["mask"]["factor"],
                                             set_mask=True)
-        else:
 
-            layer_shapes = []
-            for layer in iterate_layers(model):
-                if layer.type == "conv_normal" or layer.type == "fefo_normal":
-                    shape = layer.get_weights()[0].shape
-                    layer_shapes.append(shape)
-
-            model, _ = init.set_weights_man(model,
-                                            dist=config["init"]["weight"]["dist"],
-                                            method=config["init"]["weight"]["method"],
-                                            factor=np.sqrt(config["init"]["weight"]["factor"]), # .57
-                                            single_value=False,
-                                            save_to="",
-                                            weight_as_constant=False,
-                                            set_mask=False,
-                                            layer_shapes=layer_shapes)
+    elif config["init"]["bank"] == True:
+        # memory-mapped banks holding all runs, see weight_bank and init_example.py
+        model = init.set_bank_weights(model,
+                                      path=config["path_weights"] + config["model"]["type"] + "_weights",
+                                      run_number=run_number,
+                                      set_mask=False)
+
+        if config["baseline"] == False:
+            model = init.set_bank_weights(model,
+                                          path=config["path_masks"] + config["model"]["type"] + "_mask",
+                                          run_number=run_number,
+                                          set_mask=True)
 
     else:
 
@@ -259,124 +325,865 @@ def iterate_layers(m):
         else:
             yield l
 
-def repeat_experiment(config:dict) -> list:
-    """Loads the dataset and then loops through each experiment for in the config defined amount of runs.
-    After loading the data (which is always the same), the order is as follows:
-    Build model (network_builder) --> Initialize model (initialize_model) --> Initialize Modeltrainer -->
-    Train Model (mt.train) --> Append intermediate results to the "results"-array, which holds all results
+def set_training_defaults(config: dict):
+    """Sets default values for all optional training (and model) parameters that are not defined in the config
+
+    Args:
+        config (dict): config file
+    """
+    if "patience" not in config["training"]:
+        config["training"]["patience"] = 20
+
+    if "reductions" not in config["training"]:
+        config["training"]["reductions"] = 5
+
+    if "lr_reduce_factor" not in config["training"]:
+        config["training"]["lr_reduce_factor"] = .2
+
+    if "replicas" not in config["training"]:
+        config["training"]["replicas"] = 1
+
+    if "workers" not in config["training"]:
+        config["training"]["workers"] = 1
+
+    if "inter_op_threads" not in config["training"]:
+        config["training"]["inter_op_threads"] = 1
+
+    if "checkpoint_dir" not in config["training"]:
+        config["training"]["checkpoint_dir"] = None
+
+    if "checkpoint_interval" not in config["training"]:
+        config["training"]["checkpoint_interval"] = 5
+
+    if "mask_count_interval" not in config["training"]:
+        config["training"]["mask_count_interval"] = None
+
+    if "steps_per_execution" not in config["training"]:
+        config["training"]["steps_per_execution"] = 1
+
+    if "data_cache_dir" not in config["training"]:
+        config["training"]["data_cache_dir"] = None
+
+    if "data_cache_dtype" not in config["training"]:
+        config["training"]["data_cache_dtype"] = "float32"
+
+    if "in_memory_data" not in config["training"]:
+        config["training"]["in_memory_data"] = False
+
+    if "synthetic_examples" not in config["training"]:
+        config["training"]["synthetic_examples"] = None
+
+    if "imagenet_dir" not in config["training"]:
+        config["training"]["imagenet_dir"] = None
+
+    if "distributed_workers" not in config["training"]:
+        config["training"]["distributed_workers"] = 1
+
+    if "jit_compile" not in config["model"]:
+        config["model"]["jit_compile"] = False
+
+    if "compact_weights" not in config["model"]:
+        config["model"]["compact_weights"] = False
+
+    if "stateless" not in config["init"]:
+        config["init"]["stateless"] = False
+
+    if "bank" not in config["init"]:
+        config["init"]["bank"] = False
+
+def checkpoint_path(config: dict,
+                    run_numbers: list,
+                    fingerprint=None):
+    """Returns the path of the mid-run checkpoint of the given run(s), or None if checkpointing is disabled. The path
+    contains the fingerprint of the config (see results_store.config_fingerprint), hence a run is only resumed from a
+    checkpoint written with the same config.
 
     Args:
         config (dict): config file
+        run_numbers (list): numbers of the runs trained in the model (several if trained as replicas)
+        fingerprint (str, optional): fingerprint of the config, taken before the first run was trained (see
+                                     repeat_experiment). Defaults to None, i.e. the fingerprint of config.
 
     Returns:
-        [list]: basic list that holds the results of all runs for the given model
+        str: path of the checkpoint file
     """
+    if config["training"]["checkpoint_dir"] is None:
+        return None
+
+    os.makedirs(config["training"]["checkpoint_dir"], exist_ok=True)
 
-    print("Loading dataset...")
-    ds_train, ds_test = data_handler(config["data"])
-    print("Dataset loaded!")
+    if fingerprint is None:
+        fingerprint = config_fingerprint(config)
 
-    results = []
+    file_name = (config["model"]["type"] + "_run_" + "_".join(str(r) for r in run_numbers) + "_" + fingerprint
+                 + ".ckpt")
 
-    # steps_per_epoch = 390
+    return os.path.join(config["training"]["checkpoint_dir"], file_name)
 
-    for i in range(config["training"]["no_experiments"]):
+def update_tanh_th(model: tf.keras.Model,
+                   config: dict):
+    """Sets the threshold of every masked layer relative to its initial mask values (fixed threshold masking only)
 
+    Args:
+        model (tf.keras.Model): initialized model
+        config (dict): config file
+    """
+    if config["model"]["masking_method"] == "fixed" and config["baseline"] is False:
+        # or config["model"]["masking_method"] == "binary"):
+        print("Fixed Threshold...updating tanh_th")
+        for l in iterate_layers(model):
+            if l.type == "fefo" or l.type == "conv":
+                l.update_tanh_th(percentage=config["model"]["tanh_th"])
+        # for layer in model.layers:
+            # if layer.type == "fefo" or layer.type == "conv":
+                # layer.update_tanh_th(percentage=config["model"]["tanh_th"])
+
+def build_trainer(model: tf.keras.Model,
+                  config: dict,
+                  ds_train,
+                  ds_test,
+                  replicas=None,
+                  strategy=None) -> ModelTrainer:
+    """Sets up the ModelTrainer of an initialized model according to the config
+
+    Args:
+        model (tf.keras.Model): initialized model
+        config (dict): config file
+        ds_train (tf.data.Dataset): training dataset
+        ds_test (tf.data.Dataset): test dataset
+        replicas (int, optional): number of replicas stacked in model. Defaults to None.
+        strategy (tf.distribute.Strategy, optional): strategy the model was built with. Defaults to None.
+
+    Returns:
+        ModelTrainer: trainer of the model
+    """
+    train_w_binary_mask = True if config["model"]["masking_method"] == "binary" else False
+
+
+    dataset_info = {
+        "ds_size": ds_train.cardinality().numpy(),
+        "name": base_dataset(config["data"]),
+        "batch_size": 128,
+    }
+
+    mt = ModelTrainer(model,
+                      ds_train = ds_train,
+                      ds_test = ds_test,
+                      optimizer_args = config["optimizer"],
+                      dataset_info=dataset_info,
+                      binary_mask = train_w_binary_mask,
+                      replicas = replicas,
+                      jit_compile = config["model"]["jit_compile"],
+                      strategy = strategy)
+
+    return mt
+
+def compact_weights(model: tf.keras.Model,
+                    config: dict):
+    """Stores the signed constant weights of every masked layer as signs and a scalar (see MaskedDense.compact_weights)
+    if requested in the config
+
+    Args:
+        model (tf.keras.Model): initialized model
+        config (dict): config file
+    """
+    if config["model"]["compact_weights"] is True and config["baseline"] is False:
+        print("Compacting signed constant weights")
+        for l in iterate_layers(model):
+            if l.type == "fefo" or l.type == "conv":
+                l.compact_weights()
+
+def train_model(model: tf.keras.Model,
+                config: dict,
+                ds_train,
+                ds_test,
+                replicas=None,
+                checkpoint_path=None,
+                strategy=None):
+    """Initializes the ModelTrainer and trains the initialized model according to the config
+
+    Args:
+        model (tf.keras.Model): initialized model
+        config (dict): config file
+        ds_train (tf.data.Dataset): training dataset
+        ds_test (tf.data.Dataset): test dataset
+        replicas (int, optional): number of replicas stacked in model. Defaults to None.
+        checkpoint_path (str, optional): if set, training is checkpointed to this file and resumed from it if it
+                                         exists. The checkpoint is removed once training is finished. Defaults to None.
+        strategy (tf.distribute.Strategy, optional): strategy the model was built with. Defaults to None.
+
+    Returns:
+        Tuple[ModelTrainer, float]: trainer holding all histories and the time needed for training
+    """
+    mt = build_trainer(model, config, ds_train, ds_test, replicas=replicas, strategy=strategy)
+
+    time0 = time.time()
+    print("Start training...")
+
+    if config["baseline"] is False:
+
+        mt.calc_ones_ratio()
+
+        mt.train(epochs=config["training"]["epochs"],
+                 patience=config["training"]["patience"],
+                 reductions=config["training"]["reductions"],
+                 lr_reduce_factor=config["training"]["lr_reduce_factor"],
+                 logging_interval=20,
+                 supermask=True,
+                 checkpoint_path=checkpoint_path,
+                 checkpoint_interval=config["training"]["checkpoint_interval"],
+                 mask_count_interval=config["training"]["mask_count_interval"],
+                 steps_per_execution=config["training"]["steps_per_execution"])
+
+    else:
+        mt.train(epochs=config["training"]["epochs"],
+                 patience=config["training"]["patience"],
+                 reductions=config["training"]["reductions"],
+                 lr_reduce_factor=config["training"]["lr_reduce_factor"],
+                 logging_interval=20,
+                 supermask=False,
+                 checkpoint_path=checkpoint_path,
+                 checkpoint_interval=config["training"]["checkpoint_interval"],
+                 steps_per_execution=config["training"]["steps_per_execution"])
+
+    print("Training successful!")
+    time1 = time.time()
+
+    if checkpoint_path is not None:
+        remove_checkpoint(checkpoint_path)
+    print("Time needed for training: ", str(time1-time0))
+
+    return mt, time1 - time0
+
+def collect_results(mt: ModelTrainer,
+                    training_time: float,
+                    replica=None) -> dict:
+    """Collects the results of a trained model
+
+    Args:
+        mt (ModelTrainer): trainer of the model
+        training_time (float): time needed for training
+        replica (int, optional): if replicas were trained, the replica whose results are collected. Defaults to None.
+
+    Returns:
+        dict: results of a single run
+    """
+    select = (lambda history: list(history)) if replica is None else (lambda history: [h[replica] for h in history])
+
+    intermediate_results = {}
+
+    intermediate_results["train_loss"] = select(mt.train_loss_history)
+    intermediate_results["train_acc"] = select(mt.train_acc_history)
+
+    intermediate_results["test_loss"] = select(mt.test_loss_history)
+    intermediate_results["test_acc"] = select(mt.test_acc_history)
+
+    intermediate_results["one_ratio"] = select(mt.one_ratio_history)
+    intermediate_results["mask_counts"] = select(mt.mask_count_history)
+    intermediate_results["step_mask_counts"] = select(mt.step_mask_count_history)
+
+    intermediate_results["final_masks"] = select(mt.final_masks)
+
+    intermediate_results["training_time"] = training_time
+
+    # intermediate_results["test_acc"] = mt.current_test_acc
+    # intermediate_results["test_loss"] = mt.current_test_loss
+    # intermediate_results["ones_ratio"] = mt.current_one_ratio
+
+    return intermediate_results
+
+def benchmark_jit_compile(config: dict,
+                          ds_train,
+                          ds_test,
+                          repetitions=20) -> dict:
+    """Compares the time of a train step and of an evaluation step without and with XLA compilation
+    (see ModelTrainer, jit_compile) for the model specified in the config
+
+    Args:
+        config (dict): config file
+        ds_train (tf.data.Dataset): training dataset, the first batch is used
+        ds_test (tf.data.Dataset): test dataset, the first batch is used
+        repetitions (int, optional): number of timed steps. Defaults to 20.
+
+    Returns:
+        dict: mean time per train and evaluation step in seconds and speedup
+    """
+    set_training_defaults(config)
+
+    x_train, y_train = next(iter(ds_train))
+    x_test, y_test = next(iter(ds_test))
+
+    step_times = {}
+
+    for jit_compile in [False, True]:
         model = network_builder(config)
+        model = initialize_model(model,
+                                 config,
+                                 run_number=0,
+                                 on_the_fly=config["init"]["on_the_fly"])
+
+        update_tanh_th(model, config)
+
+        compact_weights(model, config)
+
+        mt = build_trainer(model, {**config, "model": {**config["model"], "jit_compile": jit_compile}}, ds_train, ds_test)
+
+        # warm-up, i.e. tracing and compilation
+        mt.train_step(x_train, y_train)[0].numpy()
+        mt.evaluate_step(x_test, y_test)[1].numpy()
+
+        time0 = time.time()
+        for _ in range(repetitions):
+            mt.train_step(x_train, y_train)[0].numpy()
+        time1 = time.time()
+        for _ in range(repetitions):
+            mt.evaluate_step(x_test, y_test)[1].numpy()
+        time2 = time.time()
+
+        step_times[jit_compile] = ((time1 - time0) / repetitions, (time2 - time1) / repetitions)
+
+    results = {}
+
+    for step, index in [("train", 0), ("evaluate", 1)]:
+        results[step] = {"default": step_times[False][index],
+                         "xla": step_times[True][index],
+                         "speedup": step_times[False][index] / step_times[True][index]}
+
+        print(f"{step} step: default = {results[step]['default']*1000:.3f}ms --- xla = {results[step]['xla']*1000:.3f}ms --- speedup = {results[step]['speedup']:.2f}")
+
+    return results
+
+def benchmark_precision(config: dict,
+                        ds_train,
+                        ds_test,
+                        precisions=("float32", "mixed_bfloat16")) -> dict:
+    """Trains the model specified in the config once per precision policy (see network_builder) and compares the
+    final test accuracy and the training throughput
+
+    Args:
+        config (dict): config file
+        ds_train (tf.data.Dataset): training dataset
+        ds_test (tf.data.Dataset): test dataset
+        precisions (tuple, optional): precision policies to compare. Defaults to ("float32", "mixed_bfloat16").
+
+    Returns:
+        dict: final test accuracy and mean time per epoch of each precision policy
+    """
+    set_training_defaults(config)
+
+    results = {}
+
+    for precision in precisions:
+        precision_config = {**config, "model": {**config["model"], "precision": precision}}
+
+        intermediate_results = run_experiment(precision_config, 0, ds_train, ds_test)
+
+        results[precision] = {"test_acc": intermediate_results["test_acc"][-1],
+                              "epoch_time": intermediate_results["training_time"] / len(intermediate_results["train_loss"])}
+
+    # later models are built with the default policy again
+    tf.keras.mixed_precision.set_global_policy("float32")
+
+    for precision in precisions:
+        print(f"{precision}: test accuracy = {results[precision]['test_acc']:.4f} --- time per epoch = {results[precision]['epoch_time']:.3f}s")
+
+    return results
+
+def run_experiment(config: dict,
+                   run_number: int,
+                   ds_train,
+                   ds_test,
+                   fingerprint=None) -> dict:
+    """Builds, initializes and trains the model of a single run
+
+    Args:
+        config (dict): config file
+        run_number (int): number of the run, determines the seed of the initialization
+        ds_train (tf.data.Dataset): training dataset
+        ds_test (tf.data.Dataset): test dataset
+        fingerprint (str, optional): fingerprint of the config that names the checkpoint (see checkpoint_path).
+                                     Defaults to None.
+
+    Returns:
+        dict: results of the run
+    """
+    model = network_builder(config)
+
+    print("-------------------------------------------------------")
+    print("Starting Experiment", run_number,"...")
+    print("-------------------------------------------------------")
 
-        print("-------------------------------------------------------")
-        print("Starting Experiment", i,"...")
-        print("-------------------------------------------------------")
+    model = initialize_model(model,
+                             config,
+                             run_number=run_number,
+                             on_the_fly=config["init"]["on_the_fly"])
 
-        intermediate_results = {}
+    update_tanh_th(model, config)
+
+    compact_weights(model, config)
+
+    print("Model initialized!")
+
+    mt, training_time = train_model(model, config, ds_train, ds_test,
+                                    checkpoint_path=checkpoint_path(config, [run_number], fingerprint))
+
+    return collect_results(mt, training_time)
+
+def run_batched_experiment(config: dict,
+                           run_numbers: list,
+                           ds_train,
+                           ds_test,
+                           fingerprint=None) -> list:
+    """Trains the models of several runs at once. Each run is initialized exactly as in run_experiment, then all runs
+    are stacked as replicas into a single model (see MaskedDense) and trained simultaneously on the same batches.
+    Only available for signed Supermask FCN and Conv2 - Conv8.
+
+    Args:
+        config (dict): config file
+        run_numbers (list): numbers of the runs to be trained together
+        ds_train (tf.data.Dataset): training dataset
+        ds_test (tf.data.Dataset): test dataset
+        fingerprint (str, optional): fingerprint of the config that names the checkpoint (see checkpoint_path).
+                                     Defaults to None.
+
+    Returns:
+        list: results of each run. As the runs are trained simultaneously, the training time is split evenly.
+    """
+    if config["baseline"] is True or config["model"]["type"] not in ["FCN", "Conv2", "Conv4", "Conv6", "Conv8"]:
+        raise ValueError("Batched training is only available for signed Supermask FCN and Conv2 - Conv8")
+
+    if config["optimizer"]["lr_scheduler"] != "exponential_decay":
+        # reduce_lr_on_plateau is active, it cannot treat the replicas independently
+        raise ValueError("Batched training is only available with the exponential_decay learning rate scheduler")
+
+    replicas = len(run_numbers)
+
+    print("-------------------------------------------------------")
+    print("Starting Experiments", run_numbers,"...")
+    print("-------------------------------------------------------")
+
+    template = network_builder(config)
+
+    if config["init"]["stateless"] == True:
+        # draw all runs at once
+        weights, masks = initialize_stacked_runs(template, config, run_numbers)
+
+    else:
+        # initialize every run separately with its own seed and stack the initial values afterwards
+        weights = []
+        masks = []
+
+        for run_number in run_numbers:
+            template = initialize_model(template,
+                                        config,
+                                        run_number=run_number,
+                                        on_the_fly=config["init"]["on_the_fly"])
+
+            weights.append([l.get_normal_weights().numpy() for l in iterate_layers(template) if l.type == "fefo" or l.type == "conv"])
+            masks.append([l.mask.numpy() for l in iterate_layers(template) if l.type == "fefo" or l.type == "conv"])
+
+        weights = [np.stack(layer_weights) for layer_weights in zip(*weights)]
+        masks = [np.stack(layer_masks) for layer_masks in zip(*masks)]
+
+    model = network_builder(config, replicas=replicas)
+
+    masked_layers = [l for l in iterate_layers(model) if l.type == "fefo" or l.type == "conv"]
+
+    for layer_number, layer in enumerate(masked_layers):
+        layer.set_normal_weights(weights[layer_number])
+        layer.set_mask(masks[layer_number])
+
+    update_tanh_th(model, config)
+
+    compact_weights(model, config)
+
+    print("Model initialized!")
+
+    mt, training_time = train_model(model, config, ds_train, ds_test, replicas=replicas,
+                                    checkpoint_path=checkpoint_path(config, run_numbers, fingerprint))
+
+    return [collect_results(mt, training_time / replicas, replica=r) for r in range(replicas)]
+
+def run_experiments(config: dict,
+                    run_numbers: list,
+                    ds_train,
+                    ds_test,
+                    fingerprint=None) -> list:
+    """Trains the given runs, either one after another or, if more than one run is passed, simultaneously as stacked
+    replicas (see run_batched_experiment)
+
+    Args:
+        config (dict): config file
+        run_numbers (list): numbers of the runs
+        ds_train (tf.data.Dataset): training dataset
+        ds_test (tf.data.Dataset): test dataset
+        fingerprint (str, optional): fingerprint of the config that names the checkpoints (see checkpoint_path).
+                                     Defaults to None.
+
+    Returns:
+        list: results of each run
+    """
+    if len(run_numbers) > 1:
+        return run_batched_experiment(config, run_numbers, ds_train, ds_test, fingerprint)
+
+    return [run_experiment(config, i, ds_train, ds_test, fingerprint) for i in run_numbers]
+
+def split_runs(config: dict, run_numbers: list) -> list:
+    """Splits the given runs into the chunks that are trained together
+
+    Args:
+        config (dict): config file
+        run_numbers (list): numbers of the runs to be trained
+
+    Returns:
+        list: list of lists of run numbers
+    """
+    replicas = config["training"]["replicas"]
+
+    return [run_numbers[i:i+replicas] for i in range(0, len(run_numbers), replicas)]
+
+def split_cores(workers: int) -> list:
+    """Splits the available CPU cores evenly among the given number of worker processes
+
+    Args:
+        workers (int): number of workers
+
+    Returns:
+        list: subset of CPU cores of every worker
+    """
+    if hasattr(os, "sched_getaffinity"):
+        available_cores = sorted(os.sched_getaffinity(0))
+    else:
+        available_cores = list(range(os.cpu_count()))
+
+    if workers <= len(available_cores):
+        return [list(map(int, cores)) for cores in np.array_split(available_cores, workers)]
+
+    # more workers than cores: workers share cores
+    return [[available_cores[i % len(available_cores)]] for i in range(workers)]
+
+def prepare_worker_cache(config: dict):
+    """Builds the preprocessed dataset cache (if enabled) before worker processes are spawned, hence the dataset is
+    decoded once instead of once per worker and the workers memory-map the cache"""
+    if config["training"]["data_cache_dir"] is not None and config["data"] in CACHEABLE_DATASETS:
+        build_preprocessed_cache(config["data"], config["training"]["data_cache_dir"],
+                                 dtype=config["training"]["data_cache_dtype"])
+
+def pin_worker(cores: list,
+               inter_op_threads: int):
+    """Pins the current process to the given CPU cores and sets the thread pools of tensorflow accordingly"""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    tf.config.threading.set_intra_op_parallelism_threads(len(cores))
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+    print("Worker", os.getpid(), "pinned to cores", cores)
+
+def worker_cores(core_queue) -> list:
+    """Takes the CPU cores of a new worker process from core_queue. The queue holds one subset per initial worker,
+    hence a worker that replaces a dead one finds it empty and shares all available cores instead of blocking.
+
+    Args:
+        core_queue (multiprocessing.Queue): queue holding one subset of CPU cores per worker
+
+    Returns:
+        list: CPU cores of the worker
+    """
+    try:
+        return core_queue.get(timeout=10)
+    except queue.Empty:
+        print("Worker", os.getpid(), "found no free subset of cores, using all of them")
+        return split_cores(1)[0]
+
+# state of a worker process of the parallel experiment runner
+worker_state = {}
+
+def init_worker(config: dict,
+                fingerprint: str,
+                core_queue,
+                inter_op_threads: int):
+    """Initializes a worker process of parallel_repeat_experiment: pins the process to its subset of CPU cores,
+    sets the thread pools of tensorflow accordingly and loads the dataset once for all runs of the worker
+
+    Args:
+        config (dict): config file
+        fingerprint (str): fingerprint of the config that names the checkpoints (see checkpoint_path)
+        core_queue (multiprocessing.Queue): queue holding one subset of CPU cores per worker
+        inter_op_threads (int): number of inter-op threads
+    """
+    pin_worker(worker_cores(core_queue), inter_op_threads)
+
+    ds_train, ds_test = data_handler(config["data"],
+                                     cache_dir=config["training"]["data_cache_dir"],
+                                     cache_dtype=config["training"]["data_cache_dtype"],
+                                     in_memory=config["training"]["in_memory_data"],
+                                     synthetic_examples=config["training"]["synthetic_examples"],
+                                     imagenet_dir=config["training"]["imagenet_dir"])
+
+    worker_state["config"] = config
+    worker_state["fingerprint"] = fingerprint
+    worker_state["ds_train"] = ds_train
+    worker_state["ds_test"] = ds_test
+
+def run_worker_experiments(run_numbers: list) -> list:
+    """Trains the given runs in a worker process (see init_worker)
+
+    Args:
+        run_numbers (list): numbers of the runs
+
+    Returns:
+        list: tuples of run number and results of the run
+    """
+    results = run_experiments(worker_state["config"],
+                              run_numbers,
+                              worker_state["ds_train"],
+                              worker_state["ds_test"],
+                              worker_state["fingerprint"])
+
+    return list(zip(run_numbers, results))
+
+def parallel_repeat_experiment(config: dict,
+                               run_numbers: list,
+                               finish_run,
+                               fingerprint=None):
+    """Distributes the runs of repeat_experiment over config["training"]["workers"] worker processes. The available
+    CPU cores are split evenly among the workers, each worker is pinned to its cores and uses them as intra-op
+    threads. Every run is still initialized with seed 7531 + run_number, i.e. it starts from the same initial values
+    as in the serial loop. The order of the shuffled training set depends on the random state of the process that
+    loaded the dataset, hence the results of a run only agree with the serial loop up to the variation between
+    shuffles. Results are passed to finish_run as soon as a run is finished.
+
+    Args:
+        config (dict): config file
+        run_numbers (list): numbers of the runs to be trained
+        finish_run (callable): called with the run number and the results of every finished run
+        fingerprint (str, optional): fingerprint of the config that names the checkpoints (see checkpoint_path).
+                                     Defaults to None, i.e. the fingerprint of config.
+    """
+    workers = config["training"]["workers"]
+
+    if fingerprint is None:
+        fingerprint = config_fingerprint(config)
+
+    core_subsets = split_cores(workers)
+
+    prepare_worker_cache(config)
+
+    # use fresh processes, as tensorflow's thread pools cannot be changed once tensorflow is initialized
+    context = multiprocessing.get_context("spawn")
+
+    core_queue = context.Queue()
+    for cores in core_subsets:
+        core_queue.put(cores)
+
+    # unlike multiprocessing.Pool, the executor does not silently replace a dead worker (whose runs would never be
+    # finished) but fails with BrokenProcessPool
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context,
+                             initializer=init_worker,
+                             initargs=(config, fingerprint, core_queue, config["training"]["inter_op_threads"])) as pool:
+
+        chunks = [pool.submit(run_worker_experiments, chunk) for chunk in split_runs(config, run_numbers)]
+
+        for chunk in as_completed(chunks):
+            for run_number, intermediate_results in chunk.result():
+                print("Experiment", run_number, "finished!")
+                finish_run(run_number, intermediate_results)
+
+def distributed_worker(config: dict,
+                       run_number: int,
+                       worker_index: int,
+                       addresses: list,
+                       cores: list,
+                       result_queue):
+    """Worker process of run_distributed_experiment: joins the local cluster of the MultiWorkerMirroredStrategy,
+    builds and initializes the model exactly as run_experiment does (every worker draws the same initial values) and
+    trains it on its shard of the training set. The first worker (chief) passes the results to result_queue.
+
+    Args:
+        config (dict): config file
+        run_number (int): number of the run
+        worker_index (int): index of this worker
+        addresses (list): "host:port" of every worker
+        cores (list): CPU cores of this worker
+        result_queue (multiprocessing.Queue): receives the results of the run
+    """
+    os.environ["TF_CONFIG"] = json.dumps({"cluster": {"worker": addresses},
+                                          "task": {"type": "worker", "index": worker_index}})
+
+    pin_worker(cores, config["training"]["inter_op_threads"])
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+
+    ds_train, ds_test = sharded_datasets(config["data"],
+                                         batch_size=128,
+                                         num_shards=len(addresses),
+                                         shard_index=worker_index,
+                                         seed=run_seed(run_number),
+                                         cache_dir=config["training"]["data_cache_dir"],
+                                         cache_dtype=config["training"]["data_cache_dtype"],
+                                         synthetic_examples=config["training"]["synthetic_examples"])
+
+    with strategy.scope():
+        model = network_builder(config)
 
         model = initialize_model(model,
                                  config,
-                                 run_number=i,
+                                 run_number=run_number,
                                  on_the_fly=config["init"]["on_the_fly"])
 
-        if config["model"]["masking_method"] == "fixed" and config["baseline"] is False:
-            # or config["model"]["masking_method"] == "binary"):
-            print("Fixed Threshold...updating tanh_th")
-            for l in iterate_layers(model):
-                if l.type == "fefo" or l.type == "conv":
-                    l.update_tanh_th(percentage=config["model"]["tanh_th"])
-            # for layer in model.layers:
-                # if layer.type == "fefo" or layer.type == "conv":
-                    # layer.update_tanh_th(percentage=config["model"]["tanh_th"])
+        update_tanh_th(model, config)
 
-        print("Model initialized!")
+        compact_weights(model, config)
 
-        train_w_binary_mask = True if config["model"]["masking_method"] == "binary" else False
+    mt, training_time = train_model(model, config, ds_train, ds_test, strategy=strategy)
 
+    if worker_index == 0:
+        result_queue.put(collect_results(mt, training_time))
 
-        dataset_info = {
-            "ds_size": ds_train.cardinality().numpy(),
-            "name": "cifar",
-            "batch_size": 128,
-        }
+def run_distributed_experiment(config: dict,
+                               run_number: int) -> dict:
+    """Trains a single run data-parallel on config["training"]["distributed_workers"] processes of this host, which
+    form a local (loopback) cluster of a MultiWorkerMirroredStrategy. The CPU cores are split evenly among the
+    workers, every worker trains on its shard of each global batch (see data_preprocessor.sharded_datasets) and the
+    gradients are summed over all workers. Checkpointing is not available for distributed runs.
 
-        mt = ModelTrainer(model,
-                          ds_train = ds_train,
-                          ds_test = ds_test,
-                          optimizer_args = config["optimizer"],
-                          dataset_info=dataset_info,
-                          binary_mask = train_w_binary_mask)
+    Args:
+        config (dict): config file
+        run_number (int): number of the run
 
-        time0 = time.time()
-        print("Start training...")
+    Returns:
+        dict: results of the run
+    """
+    workers = config["training"]["distributed_workers"]
 
-        if "patience" not in config["training"]:
-            config["training"]["patience"] = 20
+    print("-------------------------------------------------------")
+    print("Starting Experiment", run_number, "on", workers, "workers...")
+    print("-------------------------------------------------------")
 
-        if "reductions" not in config["training"]:
-            config["training"]["reductions"] = 5
+    # reserve a free local port for every worker
+    addresses = []
+    for _ in range(workers):
+        with socket.socket() as free_socket:
+            free_socket.bind(("localhost", 0))
+            addresses.append("localhost:" + str(free_socket.getsockname()[1]))
 
-        if "lr_reduce_factor" not in config["training"]:
-            config["training"]["lr_reduce_factor"] = .2
+    prepare_worker_cache(config)
 
-        if config["baseline"] is False:
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
 
-            mt.calc_ones_ratio()
+    processes = [context.Process(target=distributed_worker,
+                                 args=(config, run_number, worker_index, addresses, cores, result_queue))
+                 for worker_index, cores in enumerate(split_cores(workers))]
 
-            mt.train(epochs=config["training"]["epochs"],
-                     patience=config["training"]["patience"],
-                     reductions=config["training"]["reductions"],
-                     lr_reduce_factor=config["training"]["lr_reduce_factor"],
-                     logging_interval=20,
-                     supermask=True)
+    for process in processes:
+        process.start()
 
+    while True:
+        try:
+            intermediate_results = result_queue.get(timeout=10)
+            break
+        except queue.Empty:
+            # the other workers block in the collectives if a worker dies, hence they are terminated
+            if any(process.exitcode not in (None, 0) for process in processes):
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError(f"A worker of experiment {run_number} failed")
+
+    for process in processes:
+        process.join()
+
+    return intermediate_results
+
+def repeat_experiment(config:dict,
+                      store=None,
+                      resume=False,
+                      datasets=None) -> list:
+    """Loads the dataset and then loops through each experiment for in the config defined amount of runs.
+    After loading the data (which is always the same), the order is as follows:
+    Build model (network_builder) --> Initialize model (initialize_model) --> Initialize Modeltrainer -->
+    Train Model (mt.train) --> Append intermediate results to the "results"-array, which holds all results
+    If config["training"]["replicas"] > 1, runs are trained in batches of that many stacked replicas
+    (see run_batched_experiment). If config["training"]["workers"] > 1, runs are distributed over several worker
+    processes (see parallel_repeat_experiment). If config["training"]["distributed_workers"] > 1, every run is trained
+    data-parallel on that many processes instead (see run_distributed_experiment).
+    If a store is given, the results of each run are written to it as soon as the run is finished and only a summary
+    of the run (see results_store.summarize_run) is kept in memory, hence the memory needed does not grow with the
+    number of runs. The full results can then be read from the store. With resume=True, runs that are already
+    completed in the store are skipped, provided the store was written with the same config (see
+    RunStore.bind_config).
+
+    Args:
+        config (dict): config file
+        store (RunStore, optional): on-disk store for the results of each run. Defaults to None.
+        resume (bool, optional): skip runs that are already completed in store. Defaults to False.
+        datasets (tuple, optional): training and test set as returned by data_handler for this config, e.g. shared by
+                                    several sweep trials (see sweep.py). Defaults to None, i.e. the dataset is loaded.
+
+    Returns:
+        [list]: basic list that holds the results (the summaries if a store is given) of all runs for the given model
+    """
+
+    set_training_defaults(config)
+
+    results = {}
+
+    run_numbers = list(range(config["training"]["no_experiments"]))
+
+    # taken before any run is trained, the checkpoints of all runs are named by it (see checkpoint_path)
+    fingerprint = config_fingerprint(config)
+
+    if store is not None:
+        store.bind_config(config, resume=resume)
+
+    if store is not None and resume:
+        completed_runs = [i for i in store.completed_runs() if i in run_numbers]
+        print("Resuming...skipping completed experiments", completed_runs)
+
+        for i in completed_runs:
+            results[i] = store.summary(i)
+
+        run_numbers = [i for i in run_numbers if i not in results]
+
+    def finish_run(run_number, intermediate_results):
+        if store is None:
+            results[run_number] = intermediate_results
         else:
-            mt.train(epochs=config["training"]["epochs"],
-                     patience=config["training"]["patience"],
-                     reductions=config["training"]["reductions"],
-                     lr_reduce_factor=config["training"]["lr_reduce_factor"],
-                     logging_interval=20,
-                     supermask=False)
-
-        print("Training successful!")
-        time1 = time.time()
-        print("Time needed for training: ", str(time1-time0))
+            store.save(run_number, intermediate_results)
+            results[run_number] = summarize_run(intermediate_results)
 
-        intermediate_results["train_loss"] = mt.train_loss_history
-        intermediate_results["train_acc"] = mt.train_acc_history
+    if config["training"]["distributed_workers"] > 1:
+        for run_number in run_numbers:
+            finish_run(run_number, run_distributed_experiment(config, run_number))
 
-        intermediate_results["test_loss"] = mt.test_loss_history
-        intermediate_results["test_acc"] = mt.test_acc_history
+    elif config["training"]["workers"] > 1:
+        parallel_repeat_experiment(config, run_numbers, finish_run, fingerprint)
 
-        intermediate_results["one_ratio"] = mt.one_ratio_history
+    elif len(run_numbers) > 0:
 
-        intermediate_results["final_masks"] = mt.final_masks
+        if datasets is None:
+            print("Loading dataset...")
+            datasets = data_handler(config["data"],
+                                    cache_dir=config["training"]["data_cache_dir"],
+                                    cache_dtype=config["training"]["data_cache_dtype"],
+                                    in_memory=config["training"]["in_memory_data"],
+                                    synthetic_examples=config["training"]["synthetic_examples"],
+                                    imagenet_dir=config["training"]["imagenet_dir"])
+            print("Dataset loaded!")
 
-        intermediate_results["training_time"] = time1 - time0
+        ds_train, ds_test = datasets
 
-        # intermediate_results["test_acc"] = mt.current_test_acc
-        # intermediate_results["test_loss"] = mt.current_test_loss
-        # intermediate_results["ones_ratio"] = mt.current_one_ratio
+        # steps_per_epoch = 390
 
-        results.append(intermediate_results)
+        for chunk in split_runs(config, run_numbers):
+            chunk_results = run_experiments(config, chunk, ds_train, ds_test, fingerprint)
 
-    return results
+            for run_number, intermediate_results in zip(chunk, chunk_results):
+                finish_run(run_number, intermediate_results)
+
+    return [results[i] for i in range(config["training"]["no_experiments"])]
 
 def findnth(haystack, needle, n):
     parts= haystack.split(needle, n+1)
@@ -386,34 +1193,79 @@ def findnth(haystack, needle, n):
 
 def save_results(results: dict,
                  filename: str):
-    """This function saves the results obtrained from training a model
+    """This function saves the results obtrained from training a model. The final masks of all runs are stored
+    separately in the packed ternary format (see mask_storage) in "<filename>_masks.npz"; each run's entry
+    "final_masks" is replaced by "final_masks_file", the name of that file.
 
     Args:
         results (dict): results that are to be saved
         filename (str): name of the file that holds results
     """
 
+    masks_file_name = filename + "_masks.npz"
+
+    save_packed_masks("./results/"+masks_file_name,
+                      {run_number: run_results["final_masks"] for run_number, run_results in enumerate(results)
+                       if "final_masks" in run_results})
+
+    results = [{**{key: value for key, value in run_results.items() if key != "final_masks"},
+                "final_masks_file": masks_file_name} for run_results in results]
+
     with open("./results/"+filename+".pkl", 'wb') as handle:
         pickled = pickle.dumps(results)
         optimized_pickle = pickletools.optimize(pickled)
         handle.write(optimized_pickle)
 
-def main_pipeline(config_path: str):
-    """Pipeline that laods the config file, created and initializes the model, trains it and finally saves the results
+def export_results(store: RunStore,
+                   run_numbers: list,
+                   filename: str,
+                   config=None):
+    """Writes the same files as save_results, but reads the results of the runs one at a time from the store instead
+    of holding all of them in memory (see RunStore.export). If a config is given, the results are additionally saved
+    in the columnar format to "<filename>_table.npz" (see results_store.ResultsTable).
+
+    Args:
+        store (RunStore): store holding the results of the runs
+        run_numbers (list): numbers of the runs that are to be saved
+        filename (str): name of the file that holds results
+        config (dict, optional): config of the runs. Defaults to None.
+    """
+    store.export(results_path="./results/"+filename+".pkl",
+                 masks_path="./results/"+filename+"_masks.npz",
+                 run_numbers=run_numbers)
+
+    if config is not None:
+        store.export_table(path="./results/"+filename+"_table.npz",
+                           run_numbers=run_numbers,
+                           config=config)
+
+def main_pipeline(config_path: str, resume=False):
+    """Pipeline that laods the config file, created and initializes the model, trains it and finally saves the results.
+    The results of every run are written to "./results/<config name>/" as soon as the run is finished and finally
+    collected from there (see export_results).
 
     Args:
         config_path (str): path to config file
+        resume (bool, optional): if True, runs that are already completed in "./results/<config name>/" are skipped.
+                                 Defaults to False.
     """
     print("Load config...")
     config = parse_config_file(path = config_path)
     print("Config loaded!")
     print(" ")
 
-    results = repeat_experiment(config)
-
     config_name = config_path[findnth(config_path, "/", 1)+1:config_path.rfind(".")]
+
+    store = RunStore("./results/"+config_name)
+
+    repeat_experiment(config,
+                      store=store,
+                      resume=resume)
+
     print("Saving results...")
-    save_results(results=results,
-                 filename=config_name)
+    export_results(store=store,
+                   run_numbers=list(range(config["training"]["no_experiments"])),
+                   filename=config_name,
+                   config=config)
     print("Results saved!")
 
@@ -7,7 +7,7 @@ from conv_networks import Conv2_Mask, Conv4_Mask, Conv6_Mask, Conv8_Mask
 mask_distributions = {"uniform": ["xavier"]} #{"uniform": ["he", "xavier"], "normal": ["he", "xavier"]}
 weight_distributions = {"signed_constant": ["elu_scaled"]} #{"constant": ["he", "xavier"], "signed_constant": ["he", "xavier"], "uniform": ["he", "xavier"]}
 
-def create_weight_files(net_type, mask_dist, weight_dist, no_runs=5):
+def build_model(net_type):
     
     if net_type == "FCN":
         INPUT_SHAPE = (128, 784)
@@ -15,11 +15,7 @@ def create_weight_files(net_type, mask_dist, weight_dist, no_runs=5):
         INPUT_SHAPE = (128, 32, 32, 3)
     else:
         print("The network type you specified is not implemented...")
-        return 0
-    
-    #FACTOR = np.sqrt(3) # multiplier for ELUS
-    
-    init_create = w_init()
+        return None
     
     #FCN
     if net_type == "FCN":
@@ -36,60 +32,77 @@ def create_weight_files(net_type, mask_dist, weight_dist, no_runs=5):
     #CNN
     #model = Conv2_Mask(input_shape=INPUT_SHAPE, use_bias=False)
     
+    return model
+
+def create_weight_files(net_type, mask_dist, weight_dist, no_runs=5):
+    # Writes the weights and masks of each run as a pickle, to be read with init: bank: False. All runs are drawn from
+    # the global random state of the initializer (see initialize_runs), weights first, then masks.
+    
+    init_create = w_init()
+    
+    model = build_model(net_type)
+    if model is None:
+        return 0
+    
     model_str = net_type
     
-    for dist in weight_dist:
-        print(dist.upper())
-        for specific in weight_dist[dist]:
-            print("---",specific.upper())
-            FACTOR = 1.
-            if specific == "elu_scaled":
-                sigma = -8
-                FACTOR = np.sqrt(3)
-            elif specific == "he":
-                sigma = -8
-            elif specific == "xavier":
-                sigma = -7
-            
-            for i in range(no_runs):
-                print("--- ---weight run ",str(i))
-                model, _ = init_create.set_weights_man(model, 
-                                                       mode=dist, 
-                                                       constant=-2, 
-                                                       mu=0, 
-                                                       sigma=sigma, 
-                                                       factor=FACTOR,
-                                                       save_to="./example_weights/"+model_str+"/weight/"+dist+"/"+specific+"/"+model_str+"_weights", 
-                                                       save_suffix="_"+str(i), 
-                                                       weight_as_constant=True, 
-                                                       set_mask=False) 
-                                                                     
-    for dist in mask_dist:
-        print(dist.upper())
-        for specific in mask_dist[dist]:
-            print("---",specific.upper())
-            FACTOR = 1.
-            if specific == "elu_scaled":
-                sigma = -8
-                FACTOR = np.sqrt(3)
-            elif specific == "he":
-                sigma = -8
-            elif specific == "xavier":
-                sigma = -7
-            for i in range(no_runs):
-                print("--- ---mask run ",str(i))
-                model, _ = init_create.set_weights_man(model, 
-                                                       mode=dist, 
-                                                       constant=-2, 
-                                                       mu=0, 
-                                                       sigma=sigma, 
-                                                       factor=FACTOR, 
-                                                       save_to="./example_weights/"+model_str+"/mask/"+dist+"/"+specific+"/"+model_str+"_mask", 
-                                                       save_suffix="_"+str(i), 
-                                                       weight_as_constant=False, 
-                                                       set_mask=True)
+    for kind, distributions in [("weight", weight_dist), ("mask", mask_dist)]:
+        for dist in distributions:
+            print(kind.upper(), dist.upper())
+            for specific in distributions[dist]:
+                print("---",specific.upper())
+                FACTOR = 1.
+                method = specific
+                if specific == "elu_scaled":
+                    FACTOR = np.sqrt(3)
+                    method = "he"
+                
+                layers = init_create.initialize_runs(model, 
+                                                     [None] * no_runs, 
+                                                     dist=dist, 
+                                                     method=method, 
+                                                     factor=FACTOR, 
+                                                     set_mask=kind == "mask")
+                
+                init_create.save_weight_files(model, 
+                                              save_to="./example_weights/"+model_str+"/"+kind+"/"+dist+"/"+specific+"/"+model_str+"_"+("weights" if kind == "weight" else "mask"), 
+                                              layers=layers, 
+                                              run_numbers=list(range(no_runs)))
   
     print("Weight Initialization successful")
+
+def create_weight_banks(net_type, mask_dist, weight_dist, no_runs=50):
+    # Writes the weights and masks of all runs as memory-mapped banks (one file per layer holding all runs, see
+    # weight_bank), to be read with init: bank: True. Run i holds the same values as init: stateless: True with run i.
+    
+    model = build_model(net_type)
+    if model is None:
+        return 0
+    
+    init_create = w_init()
+    
+    model_str = net_type
+    
+    for kind, distributions in [("weight", weight_dist), ("mask", mask_dist)]:
+        for dist in distributions:
+            print(kind.upper(), dist.upper())
+            for specific in distributions[dist]:
+                print("---",specific.upper())
+                FACTOR = 1.
+                method = specific
+                if specific == "elu_scaled":
+                    FACTOR = np.sqrt(3)
+                    method = "he"
+                
+                init_create.create_weight_bank(model, 
+                                               path="./example_weights/"+model_str+"/"+kind+"/"+dist+"/"+specific+"/"+model_str+"_"+("weights" if kind == "weight" else "mask"), 
+                                               run_numbers=list(range(no_runs)), 
+                                               dist=dist, 
+                                               method=method, 
+                                               factor=FACTOR, 
+                                               set_mask=kind == "mask")
+    
+    print("Weight Initialization successful")
                                                                           
 # As we specify the weight files for both the masked and normal version of a given architecture, we drop the "_Mask" suffix
 # in this case to maintain clarity
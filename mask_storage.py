@@ -0,0 +1,142 @@
+import shutil
+import zipfile
+
+import numpy as np
+
+def pack_ternary(mask: np.ndarray):
+    """Packs a signed Supermask with values in {-1, 0, 1} into a bitmap of the non-zero entries and a sign bitmap
+    of the non-zero entries only. Hence, every entry needs at most 2 bits (1 bit + 1 bit per remaining weight).
+
+    Args:
+        mask (np.ndarray): signed Supermask
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: packed non-zero bitmap, packed sign bitmap and shape of mask
+    """
+    mask = np.asarray(mask)
+    shape = np.asarray(mask.shape, dtype=np.int64)
+
+    mask = mask.ravel()
+    nonzero = mask != 0
+
+    nonzero_bits = np.packbits(nonzero)
+    sign_bits = np.packbits(mask[nonzero] > 0)
+
+    return nonzero_bits, sign_bits, shape
+
+def unpack_ternary(nonzero_bits: np.ndarray,
+                   sign_bits: np.ndarray,
+                   shape) -> np.ndarray:
+    """Unpacks a signed Supermask that was packed with pack_ternary
+
+    Args:
+        nonzero_bits (np.ndarray): packed non-zero bitmap
+        sign_bits (np.ndarray): packed sign bitmap of the non-zero entries
+        shape (tuple): shape of the mask
+
+    Returns:
+        np.ndarray: signed Supermask (float32) with values in {-1, 0, 1}
+    """
+    size = int(np.prod(shape))
+
+    nonzero = np.unpackbits(nonzero_bits, count=size).astype(bool)
+    signs = np.unpackbits(sign_bits, count=int(np.sum(nonzero))).astype("float32")
+
+    mask = np.zeros(size, dtype="float32")
+    mask[nonzero] = 2 * signs - 1
+
+    return mask.reshape(tuple(int(dim) for dim in shape))
+
+def layer_key(run_number: int, layer_number: int) -> str:
+    """Returns the key prefix under which a layer's mask of a given run is stored"""
+    return "run" + str(run_number) + "_layer" + str(layer_number)
+
+def save_packed_masks(path: str,
+                      masks: dict):
+    """Saves the (final) signed Supermasks of several runs in the packed format. Each layer is stored as a separate
+    member of an uncompressed .npz archive, such that a single layer can be read without loading the whole file.
+
+    Args:
+        path (str): path of the .npz file
+        masks (dict): maps the run number to the list of masks (one np.ndarray per masked layer) of that run
+    """
+    arrays = {}
+
+    for run_number, run_masks in masks.items():
+        for layer_number, mask in enumerate(run_masks):
+            nonzero_bits, sign_bits, shape = pack_ternary(mask)
+            key = layer_key(run_number, layer_number)
+
+            arrays[key + "_nonzero"] = nonzero_bits
+            arrays[key + "_sign"] = sign_bits
+            arrays[key + "_shape"] = shape
+
+        arrays["run" + str(run_number) + "_layers"] = np.asarray(len(run_masks), dtype=np.int64)
+
+    np.savez(path, **arrays)
+
+def merge_packed_masks(path: str,
+                       paths: list):
+    """Merges files written with save_packed_masks (holding different runs) into a single file. The packed arrays are
+    copied member by member without being loaded, hence the memory needed is bounded by the largest packed layer.
+
+    Args:
+        path (str): path of the merged .npz file
+        paths (list): paths of the .npz files to be merged
+    """
+    with zipfile.ZipFile(path, "w", allowZip64=True) as merged:
+        for source_path in paths:
+            with zipfile.ZipFile(source_path, "r") as source:
+                for member in source.namelist():
+                    with source.open(member, "r") as source_member, merged.open(member, "w",
+                                                                                force_zip64=True) as merged_member:
+                        shutil.copyfileobj(source_member, merged_member)
+
+class PackedMaskReader:
+    """Lazily reads signed Supermasks stored with save_packed_masks. Layers are only read and unpacked on request.
+
+    Arguments:
+        path (str): path of the .npz file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.archive = np.load(path)
+
+    def runs(self) -> list:
+        """Returns the run numbers stored in the file"""
+        return sorted(int(key[len("run"):-len("_layers")]) for key in self.archive.files if key.endswith("_layers"))
+
+    def number_of_layers(self, run_number: int) -> int:
+        """Returns the number of masked layers stored for a given run"""
+        return int(self.archive["run" + str(run_number) + "_layers"])
+
+    def layer(self, run_number: int, layer_number: int) -> np.ndarray:
+        """Reads and unpacks the mask of a single layer
+
+        Args:
+            run_number (int): number of the run
+            layer_number (int): index of the masked layer
+
+        Returns:
+            np.ndarray: signed Supermask of the layer
+        """
+        key = layer_key(run_number, layer_number)
+
+        return unpack_ternary(self.archive[key + "_nonzero"],
+                              self.archive[key + "_sign"],
+                              self.archive[key + "_shape"])
+
+    def masks(self, run_number: int) -> list:
+        """Reads and unpacks all masks of a single run
+
+        Args:
+            run_number (int): number of the run
+
+        Returns:
+            list: signed Supermask of each masked layer
+        """
+        return [self.layer(run_number, l) for l in range(self.number_of_layers(run_number))]
+
+    def close(self):
+        self.archive.close()
@@ -2,4 +2,6 @@ import experiment_looper
 
 path_to_config = "./configs/fcn_sample_config.yaml"
 
-experiment_looper.main_pipeline(path_to_config)
\ No newline at end of file
+# the guard is required if runs are distributed over several worker processes (training: workers > 1)
+if __name__ == "__main__":
+    experiment_looper.main_pipeline(path_to_config)
\ No newline at end of file
@@ -1,8 +1,15 @@
+import glob
+import os
+import pickle
+import pickletools
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import tensorflow as tf
 import tensorflow_addons as tfa
 import time
 
+from data_preprocessor import TensorDataset
+
 class ModelTrainer():
     """Contains all functions necessary to train and evaluate signed Supermask and "normal" models
 
@@ -11,10 +18,36 @@ class ModelTrainer():
         ds_train (tf.data.Dataset): training dataset
         ds_test (tf.data.Dataset): test dataset
         optimizer_args (dict): specifies parameters for the optimizer used to train model
+        replicas (int): number of independent replicas stacked in model (see MaskedDense). If set, the model returns
+                        one prediction per replica and all losses, accuracies and remaining weight ratios are tracked
+                        per replica. Defaults to None.
+        jit_compile (bool): if True, the forward and backward pass of a train step and the forward pass of an
+                            evaluation step are compiled with XLA, i.e. mask construction, masking and matmul/conv
+                            are fused. The optimizer update is not compiled. Defaults to False.
+        strategy (tf.distribute.Strategy): if set, every worker of the strategy trains on its own shard ds_train (see
+                                           data_preprocessor.sharded_datasets) and the gradients are summed over all
+                                           workers. The model has to be built under strategy.scope(). Evaluation runs
+                                           locally on every worker. Not available for replicas. Defaults to None.
     """
 
-    def __init__(self, model, ds_train, ds_test, optimizer_args={}, binary_mask=False, dataset_info = {}):
+    def __init__(self, model, ds_train, ds_test, optimizer_args={}, binary_mask=False, dataset_info = {}, replicas=None,
+                 jit_compile=False, strategy=None):
+        # defaults and conversions below must not change the caller's config
+        optimizer_args = dict(optimizer_args)
+
         self.model = model
+        self.replicas = replicas
+
+        self.strategy = strategy
+
+        if strategy is not None and replicas is not None:
+            raise ValueError("Stacked replicas cannot be trained with a distribution strategy")
+
+        self.jit_compile = jit_compile
+
+        if jit_compile:
+            self.forward_backward = tf.function(self.forward_backward, jit_compile=True)
+            self.forward = tf.function(self.forward, jit_compile=True)
 
         if dataset_info:
             steps_per_epoch = dataset_info["ds_size"] #// dataset_info["batch_size"]
@@ -97,11 +130,25 @@ class ModelTrainer():
                                                          momentum=optimizer_args["momentum"],
                                                          centered=optimizer_args["centered"])
 
+        # float16 gradients may underflow, hence the loss is scaled (bfloat16 has the exponent range of float32)
+        self.loss_scaling = model.dtype_policy.name == "mixed_float16"
+
+        if self.loss_scaling:
+            self.optimizer = tf.keras.mixed_precision.LossScaleOptimizer(self.optimizer)
+
+        if self.strategy is not None:
+            # the loss is averaged over the global batch in forward_backward
+            self.train_loss_fn = type(self.train_loss_fn)(reduction=tf.keras.losses.Reduction.NONE)
+
         self.lr_exp_decay = optimizer_args["lr_scheduler"] == "exponential_decay"
 
         self.ds_train = ds_train
         self.ds_test = ds_test
 
+        if self.strategy is not None:
+            # ds_train already is the shard of this worker, batched with the per-worker batch size
+            self.distributed_ds_train = self.strategy.distribute_datasets_from_function(lambda input_context: ds_train)
+
         self.mask_history = []
         self.train_loss_history = []
         self.train_acc_history = []
@@ -111,16 +158,46 @@ class ModelTrainer():
 
         self.latest_train_loss = 0.
 
-        self.train_loss_metric = tf.keras.metrics.Mean()
-        self.test_loss_metric = tf.keras.metrics.Mean()
+        self.sparse_labels = dataset_info["name"] == "imagenet" or dataset_info["name"] == "cifar100"
 
-        if dataset_info["name"] != "imagenet" and dataset_info["name"] != "cifar100":
+        if self.strategy is not None:
+            # created under the scope, such that the results are aggregated over all workers
+            with self.strategy.scope():
+                self.train_loss_metric = tf.keras.metrics.Mean()
+
+                if self.sparse_labels:
+                    self.train_acc_metric = tf.keras.metrics.SparseCategoricalAccuracy()
+                else:
+                    self.train_acc_metric = tf.keras.metrics.CategoricalAccuracy()
+
+            self.test_loss_metric = tf.keras.metrics.Mean()
+
+            if self.sparse_labels:
+                self.test_acc_metric = tf.keras.metrics.SparseCategoricalAccuracy()
+            else:
+                self.test_acc_metric = tf.keras.metrics.CategoricalAccuracy()
+
+        elif self.replicas is not None:
+            # element-wise means, i.e. one value per replica
+            self.train_loss_metric = tf.keras.metrics.MeanTensor()
+            self.test_loss_metric = tf.keras.metrics.MeanTensor()
+
+            self.train_acc_metric = tf.keras.metrics.MeanTensor()
+            self.test_acc_metric = tf.keras.metrics.MeanTensor()
+
+        elif self.sparse_labels is False:
+
+            self.train_loss_metric = tf.keras.metrics.Mean()
+            self.test_loss_metric = tf.keras.metrics.Mean()
 
             self.train_acc_metric = tf.keras.metrics.CategoricalAccuracy()
             self.test_acc_metric = tf.keras.metrics.CategoricalAccuracy()
 
         else:
 
+            self.train_loss_metric = tf.keras.metrics.Mean()
+            self.test_loss_metric = tf.keras.metrics.Mean()
+
             self.train_acc_metric = tf.keras.metrics.SparseCategoricalAccuracy()
             self.test_acc_metric = tf.keras.metrics.SparseCategoricalAccuracy()
 
@@ -132,6 +209,8 @@ class ModelTrainer():
 
         self.current_one_ratio = 1.
         self.one_ratio_history = []
+        self.mask_count_history = []
+        self.step_mask_count_history = []
 
         self.final_masks = []
 
@@ -142,6 +221,24 @@ class ModelTrainer():
         self.reduction_counter = 0 #count how often lr was reduced
         self.current_best_loss = 0
 
+        self.epoch = 0 #number of completed epochs, continued from when resuming from a checkpoint
+        self.train_steps = 0
+
+        # variables of the model and the optimizer (iterations, slots, learning rate, loss scale), see save_checkpoint
+        self.checkpoint = tf.train.Checkpoint(model=self.model, optimizer=self.optimizer)
+
+        try:
+            # the variables are copied to host memory and written in the background
+            self.checkpoint_options = tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)
+            self.async_checkpoint = True
+        except TypeError:
+            # asynchronous checkpoints need TensorFlow >= 2.9
+            self.checkpoint_options = tf.train.CheckpointOptions()
+            self.async_checkpoint = False
+
+        self.checkpoint_writer = None
+        self.pending_checkpoint = None
+
     @tf.function
     def train_step(self, x_batch, y_batch):
         """Single train step
@@ -151,14 +248,22 @@ class ModelTrainer():
             y_batch (tf.dataset): labels
 
         Returns:
-            float: loss and prediction of the current train step
+            float: loss and prediction of the current train step (one loss per replica if replicas are trained)
         """
-        with tf.GradientTape(watch_accessed_variables=True) as tape:
+        return self.apply_train_step(x_batch, y_batch)
+
+    def apply_train_step(self, x_batch, y_batch):
+        """Body of train_step. Not compiled on its own, as the strategy cannot aggregate gradients inside a nested
+        tf.function (see distributed_train_step).
 
-            predicted = self.model(x_batch, training=True)
-            loss = self.train_loss_fn(y_batch, predicted)
+        Args:
+            x_batch (tf.Tensor): features
+            y_batch (tf.Tensor): labels
 
-            gradients = tape.gradient(loss, self.model.trainable_variables)
+        Returns:
+            Tuple[tf.Tensor, tf.Tensor]: loss and prediction of the current train step
+        """
+        loss, predicted, gradients = self.forward_backward(x_batch, y_batch)
 
         # print("Gradient mean: ", [tf.reduce_mean(g).numpy() for g in gradients])
         # print("Gradient norm: ", [tf.norm(g).numpy() for g in gradients])
@@ -167,6 +272,220 @@ class ModelTrainer():
 
         return loss, predicted
 
+    def forward_backward(self, x_batch, y_batch):
+        """Forward and backward pass of a train step. Compiled with XLA if the trainer was set up with jit_compile.
+
+        Args:
+            x_batch (tf.Tensor): features
+            y_batch (tf.Tensor): labels
+
+        Returns:
+            Tuple[tf.Tensor, tf.Tensor, list]: loss, prediction and gradients of the trainable variables
+        """
+        with tf.GradientTape(watch_accessed_variables=True) as tape:
+
+            # with a mixed precision policy, the loss is computed in float32
+            predicted = tf.cast(self.model(x_batch, training=True), tf.float32)
+
+            if self.strategy is not None:
+                # the gradients of all workers are summed, hence the loss is averaged over the global batch
+                per_example_loss = self.train_loss_fn(y_batch, predicted)
+                global_batch_size = tf.shape(per_example_loss)[0] * self.strategy.num_replicas_in_sync
+
+                loss = tf.reduce_mean(per_example_loss)
+                total_loss = tf.nn.compute_average_loss(per_example_loss, global_batch_size=global_batch_size)
+            elif self.replicas is None:
+                loss = self.train_loss_fn(y_batch, predicted)
+                total_loss = loss
+            else:
+                # replicas are independent, hence the gradient of the sum is the gradient of each replica's loss
+                loss = tf.stack([self.train_loss_fn(y_batch, predicted[r]) for r in range(self.replicas)])
+                total_loss = tf.reduce_sum(loss)
+
+            if self.loss_scaling:
+                total_loss = self.optimizer.get_scaled_loss(total_loss)
+
+        gradients = tape.gradient(total_loss, self.model.trainable_variables)
+
+        if self.loss_scaling:
+            gradients = self.optimizer.get_unscaled_gradients(gradients)
+
+        return loss, predicted, gradients
+
+    @tf.function
+    def distributed_train_step(self, x_batch, y_batch):
+        """Runs a train step, including the metric updates, on every worker of the strategy
+
+        Args:
+            x_batch (tf.distribute.DistributedValues): features of every worker
+            y_batch (tf.distribute.DistributedValues): labels of every worker
+        """
+        def replica_step(x_batch, y_batch):
+            loss, predicted = self.apply_train_step(x_batch, y_batch)
+
+            self.update_metrics(self.train_loss_metric, self.train_acc_metric, y_batch, loss, predicted)
+
+        self.strategy.run(replica_step, args=(x_batch, y_batch))
+
+    @tf.function
+    def train_multiple_steps(self, iterator, steps):
+        """Runs up to steps train steps, including the metric updates, inside a single graph. Stops early if the
+        iterator is exhausted.
+
+        Args:
+            iterator (tf.data.Iterator): iterator over the training dataset
+            steps (tf.Tensor): maximum number of train steps
+
+        Returns:
+            tf.Tensor: number of train steps that were run
+        """
+        executed_steps = tf.constant(0)
+
+        for _ in tf.range(steps):
+            next_batch = iterator.get_next_as_optional()
+
+            if not next_batch.has_value():
+                break
+
+            x_batch, y_batch = next_batch.get_value()
+
+            loss, predicted = self.apply_train_step(x_batch, y_batch)
+
+            self.update_metrics(self.train_loss_metric, self.train_acc_metric, y_batch, loss, predicted)
+
+            executed_steps += 1
+
+        return executed_steps
+
+    @tf.function
+    def train_tensor_steps(self, permutation, first_step, steps):
+        """Runs train steps first_step, ..., first_step + steps - 1 of an epoch over an in-memory training set (see
+        TensorDataset), including gathering the batches and the metric updates, inside a single graph.
+
+        Args:
+            permutation (tf.Tensor): order of the training examples in the epoch
+            first_step (tf.Tensor): index of the first batch
+            steps (tf.Tensor): number of train steps
+        """
+        for step in tf.range(first_step, first_step + steps):
+            x_batch, y_batch = self.ds_train.gather_batch(permutation, step)
+
+            loss, predicted = self.apply_train_step(x_batch, y_batch)
+
+            self.update_metrics(self.train_loss_metric, self.train_acc_metric, y_batch, loss, predicted)
+
+    def train_epoch(self,
+                    steps_per_execution=1,
+                    mask_count_interval=None):
+        """Trains the model for one epoch
+
+        Args:
+            steps_per_execution (int, optional): number of train steps per call of train_multiple_steps (or
+                                                 train_tensor_steps for an in-memory training set). If 1, every
+                                                 batch is dispatched from Python. If <= 0, the whole epoch runs in a
+                                                 single call. Ignored with a strategy. Defaults to 1.
+            mask_count_interval (int, optional): if set, the mask counts are recorded every mask_count_interval train
+                                                 steps (at most once per call of train_multiple_steps). Defaults to None.
+        """
+        step_counts = []
+
+        if self.strategy is not None:
+            # all workers run the same number of steps, see data_preprocessor.sharded_datasets
+            for (x_batch_train, y_batch_train) in self.distributed_ds_train:
+                self.distributed_train_step(x_batch_train, y_batch_train)
+
+                self.train_steps += 1
+
+                if mask_count_interval is not None and self.train_steps % mask_count_interval == 0:
+                    step_counts.append(self.mask_counts())
+
+        elif isinstance(self.ds_train, TensorDataset):
+            if steps_per_execution <= 0:
+                steps_per_execution = self.ds_train.num_batches
+
+            permutation = self.ds_train.permutation()
+
+            for first_step in range(0, self.ds_train.num_batches, steps_per_execution):
+                executed_steps = min(steps_per_execution, self.ds_train.num_batches - first_step)
+
+                self.train_tensor_steps(permutation, tf.constant(first_step), tf.constant(executed_steps))
+
+                previous_steps = self.train_steps
+                self.train_steps += executed_steps
+
+                if mask_count_interval is not None and \
+                        self.train_steps // mask_count_interval > previous_steps // mask_count_interval:
+                    step_counts.append(self.mask_counts())
+
+        elif steps_per_execution == 1:
+            for (x_batch_train, y_batch_train) in self.ds_train:
+                loss, predicted = self.train_step(x_batch_train, y_batch_train)
+
+                self.update_metrics(self.train_loss_metric, self.train_acc_metric, y_batch_train, loss, predicted)
+
+                self.train_steps += 1
+
+                if mask_count_interval is not None and self.train_steps % mask_count_interval == 0:
+                    # stays on the device until the end of the epoch
+                    step_counts.append(self.mask_counts())
+        else:
+            if steps_per_execution <= 0:
+                steps_per_execution = np.iinfo(np.int32).max
+
+            iterator = iter(self.ds_train)
+
+            while True:
+                executed_steps = int(self.train_multiple_steps(iterator, tf.constant(steps_per_execution)))
+
+                previous_steps = self.train_steps
+                self.train_steps += executed_steps
+
+                if mask_count_interval is not None and \
+                        self.train_steps // mask_count_interval > previous_steps // mask_count_interval:
+                    step_counts.append(self.mask_counts())
+
+                if executed_steps < steps_per_execution:
+                    break
+
+        self.step_mask_count_history.extend(counts.numpy() for counts in step_counts)
+
+    def replica_accuracy(self, y_batch, predicted):
+        """Calculates the accuracy of each replica on a batch
+
+        Args:
+            y_batch (tf.Tensor): labels (one-hot or sparse)
+            predicted (tf.Tensor): predictions of shape (replicas, batch, classes)
+
+        Returns:
+            tf.Tensor: accuracy per replica
+        """
+        labels = y_batch if self.sparse_labels else tf.math.argmax(y_batch, axis=-1)
+        labels = tf.cast(tf.reshape(labels, [-1]), tf.int64)
+
+        matches = tf.cast(tf.equal(tf.math.argmax(predicted, axis=-1), labels), tf.float32)
+
+        return tf.reduce_mean(matches, axis=-1)
+
+    def update_metrics(self, loss_metric, acc_metric, y_batch, loss, predicted):
+        """Updates the given loss and accuracy metric with the results of a batch
+
+        Args:
+            loss_metric (tf.keras.metrics.Metric): loss metric
+            acc_metric (tf.keras.metrics.Metric): accuracy metric
+            y_batch (tf.Tensor): labels
+            loss (tf.Tensor): loss of the batch
+            predicted (tf.Tensor): prediction of the batch
+        """
+        if self.replicas is None:
+            loss_metric(loss)
+            acc_metric(y_batch, predicted)
+        else:
+            accuracy = self.replica_accuracy(y_batch, predicted)
+            batch_size = tf.cast(tf.shape(predicted)[1], tf.float32)
+
+            loss_metric(loss)
+            acc_metric(accuracy, sample_weight=tf.fill(tf.shape(accuracy), batch_size))
+
     def iterator_layers(self, model):
         #print(m.layers)
         for l in model.layers:
@@ -176,22 +495,50 @@ class ModelTrainer():
             else:
                 yield l
 
+    def effective_mask(self, layer):
+        """Returns the effective (signed or binary) Supermask of a masked layer, i.e. without the straight through estimator"""
+        if self.binary_mask == False:
+            layer.signed_supermask()
+        else:
+            layer.binary_supermask()
+
+        return layer.bernoulli_mask
+
+    @tf.function
+    def mask_counts(self):
+        """Counts the non-zero, positive and negative entries of the effective mask of every masked layer. All layers
+        are counted in a single graph, hence only the small tensor of counts is copied to the host.
+
+        Returns:
+            tf.Tensor: counts of shape (layers, 3) or (replicas, layers, 3) if replicas are trained. The last axis holds
+                       the number of non-zero, positive and negative entries.
+        """
+        counts = []
+
+        for layer in self.iterator_layers(self.model):
+            if layer.type == "fefo" or layer.type == "conv":
+                mask = self.effective_mask(layer)
+                axis = None if self.replicas is None else list(range(1, len(mask.shape)))
+
+                counts.append(tf.stack([tf.math.count_nonzero(mask, axis=axis),
+                                        tf.math.count_nonzero(mask > 0, axis=axis),
+                                        tf.math.count_nonzero(mask < 0, axis=axis)], axis=-1))
+
+        return tf.stack(counts, axis=-2)
+
     def calc_ones_ratio(self):
         """
-        Calculates the ratio of remaining weights
+        Calculates the ratio of remaining weights (per replica if replicas are trained) and keeps the per layer
+        counts of mask_counts in mask_count_history
         """
-        if self.binary_mask == False:
-            # global_no_ones = np.sum([np.sum(np.abs(layer.signed_supermask())) for layer in self.model.layers
-            #                             if layer.type == "fefo" or layer.type == "conv"])
-            global_no_ones = np.sum([np.sum(np.abs(layer.signed_supermask())) for layer in self.iterator_layers(self.model)
-                                        if layer.type == "fefo" or layer.type == "conv"])
-        else:
-            global_no_ones = np.sum([np.sum(layer.binary_supermask()) for layer in self.model.layers
-                                        if layer.type == "fefo" or layer.type == "conv"])
+        counts = self.mask_counts().numpy()
+        self.mask_count_history.append(counts)
+
+        global_no_ones = np.sum(counts[..., 0], axis=-1)
 
         # global_size = np.sum([tf.size(layer.mask) for layer in self.model.layers
         #                       if layer.type == "fefo" or layer.type == "conv"])
-        global_size = np.sum([tf.size(layer.mask) for layer in self.iterator_layers(self.model)
+        global_size = np.sum([layer.size for layer in self.iterator_layers(self.model)
                               if layer.type == "fefo" or layer.type == "conv"])
 
         remaining_ones_ratio = (global_no_ones/global_size)*100
@@ -236,29 +583,44 @@ class ModelTrainer():
               reduce_lr_plateau=True,
               patience=10,
               reductions=5,
-              lr_reduce_factor=.5):
+              lr_reduce_factor=.5,
+              checkpoint_path=None,
+              checkpoint_interval=5,
+              mask_count_interval=None,
+              steps_per_execution=1):
         """Wrapper function for training and evaluating the model according to specification
 
         Args:
             epochs (int): Defines the number of epochs a model is to be trained
             supermask (bool, optional): States wether the model to be trained is a signed Supermask model or not. Defaults to True.
             logging_interval (int, optional): Interval for which you want a log. Defaults to 5.
+            checkpoint_path (str, optional): if set, a checkpoint is written to this file every checkpoint_interval epochs
+                                             and training is resumed from it if the file already exists. Defaults to None.
+            checkpoint_interval (int, optional): number of epochs between two checkpoints. Defaults to 5.
+            mask_count_interval (int, optional): if set, the mask counts (see mask_counts) are additionally recorded every
+                                                 mask_count_interval train steps in step_mask_count_history. Defaults to None.
+            steps_per_execution (int, optional): number of train steps run in a single call of a compiled loop (see
+                                                 train_multiple_steps). If <= 0, a whole epoch runs in a single call. Defaults to 1.
 
         """
 
         if self.lr_exp_decay:
             reduce_lr_plateau = False
 
-        if supermask is True:
+        if reduce_lr_plateau and self.replicas is not None:
+            # the learning rate, the plateau bookkeeping and the early stop would be shared by all replicas
+            raise ValueError("Stacked replicas cannot be trained with learning rate reduction on plateau")
 
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            self.restore_checkpoint(checkpoint_path)
+
+        if supermask is True:
 
-            for epoch in range(epochs):
 
-                for (x_batch_train, y_batch_train) in self.ds_train:
-                    loss, predicted = self.train_step(x_batch_train, y_batch_train)
+            for epoch in range(self.epoch, epochs):
 
-                    self.train_loss_metric(loss)
-                    self.train_acc_metric(y_batch_train,predicted)
+                self.train_epoch(steps_per_execution=steps_per_execution,
+                                 mask_count_interval=mask_count_interval)
 
                 self.train_loss_history.append(self.train_loss_metric.result().numpy())
                 self.train_acc_history.append(self.train_acc_metric.result().numpy())
@@ -267,58 +629,172 @@ class ModelTrainer():
                 self.calc_ones_ratio()
 
                 if epoch % logging_interval == 0:
-                    print(f"End of Epoch {epoch}. Accuracy = {self.train_acc_metric.result().numpy():.6f} --- Mean Loss = {self.train_loss_metric.result().numpy():.6f}")
+                    print(f"End of Epoch {epoch}. Accuracy = {np.mean(self.train_acc_metric.result().numpy()):.6f} --- Mean Loss = {np.mean(self.train_loss_metric.result().numpy()):.6f}")
                     print(f"One Ratio: {self.one_ratio_history[-1]}")
                 self.train_loss_metric.reset_states()
                 self.train_acc_metric.reset_states()
 
                 self.evaluate()
 
-                if self.lr_exp_decay != "exponential_decay":
-                    if epoch >= 10 and reduce_lr_plateau:
-                        self.reduce_lr_on_plateau(patience=patience,
-                                                factor=lr_reduce_factor)
+                if epoch >= 10 and reduce_lr_plateau:
+                    self.reduce_lr_on_plateau(patience=patience,
+                                              factor=lr_reduce_factor)
+
+                self.epoch = epoch + 1
 
-                    if self.reduction_counter == reductions:
-                        print("Stop learning - learning rate was reduced ",str(reductions)," times.")
-                        break
-                    else:
-                        continue
+                if reduce_lr_plateau and self.reduction_counter == reductions:
+                    print("Stop learning - learning rate was reduced ",str(reductions)," times.")
+                    self.epoch = epochs
+                    break
 
-            self.final_masks = [layer.bernoulli_mask.numpy() for layer in self.iterator_layers(self.model)
+                if checkpoint_path is not None and self.epoch % checkpoint_interval == 0:
+                    self.save_checkpoint(checkpoint_path)
+
+            if checkpoint_path is not None:
+                self.save_checkpoint(checkpoint_path)
+                self.wait_for_checkpoint()
+
+            self.final_masks = [self.effective_mask(layer).numpy() for layer in self.iterator_layers(self.model)
                                 if layer.type == "fefo" or layer.type == "conv"]
 
 
         else:
 
-            for epoch in range(epochs):
-                for (x_batch_train, y_batch_train) in self.ds_train: #enumerate(self.ds_train):
-                    loss, predicted = self.train_step(x_batch_train, y_batch_train)
-
-                    self.train_loss_metric(loss)
-                    self.train_acc_metric(y_batch_train,predicted)
+            for epoch in range(self.epoch, epochs):
+                self.train_epoch(steps_per_execution=steps_per_execution)
 
                 self.train_loss_history.append(self.train_loss_metric.result().numpy())
                 self.train_acc_history.append(self.train_acc_metric.result().numpy())
 
                 if epoch % logging_interval == 0:
-                    print(f"End of Epoch: {epoch}: Accuracy = {self.train_acc_metric.result().numpy():.6f} --- Mean Loss = {self.train_loss_metric.result().numpy():.6f}")
+                    print(f"End of Epoch: {epoch}: Accuracy = {np.mean(self.train_acc_metric.result().numpy()):.6f} --- Mean Loss = {np.mean(self.train_loss_metric.result().numpy()):.6f}")
 
                 self.train_loss_metric.reset_states()
                 self.train_acc_metric.reset_states()
 
                 self.evaluate()
 
-                if self.lr_exp_decay != "exponential_decay":
-                    if epoch >= 10 and reduce_lr_plateau:
-                        self.reduce_lr_on_plateau(patience=patience,
-                                                factor=lr_reduce_factor)
+                if epoch >= 10 and reduce_lr_plateau:
+                    self.reduce_lr_on_plateau(patience=patience,
+                                              factor=lr_reduce_factor)
 
-                    if self.reduction_counter == reductions:
-                        print("Stop learning - learning rate was reduced 5 times.")
-                        break
-                    else:
-                        continue
+                self.epoch = epoch + 1
+
+                if reduce_lr_plateau and self.reduction_counter == reductions:
+                    print("Stop learning - learning rate was reduced 5 times.")
+                    self.epoch = epochs
+                    break
+
+                if checkpoint_path is not None and self.epoch % checkpoint_interval == 0:
+                    self.save_checkpoint(checkpoint_path)
+
+            if checkpoint_path is not None:
+                self.save_checkpoint(checkpoint_path)
+                self.wait_for_checkpoint()
+
+    def checkpoint_state(self) -> dict:
+        """Copies the trainer's bookkeeping needed to continue training exactly where it stopped: the epoch counter,
+        the histories and the plateau/cooldown counters. The variables of the model and the optimizer are written by
+        self.checkpoint instead (see save_checkpoint).
+
+        Returns:
+            dict: state of the trainer
+        """
+        return {
+            "epoch": self.epoch,
+            "train_steps": self.train_steps,
+            "train_loss_history": list(self.train_loss_history),
+            "train_acc_history": list(self.train_acc_history),
+            "test_loss_history": list(self.test_loss_history),
+            "test_acc_history": list(self.test_acc_history),
+            "one_ratio_history": list(self.one_ratio_history),
+            "mask_count_history": list(self.mask_count_history),
+            "step_mask_count_history": list(self.step_mask_count_history),
+            "cooldown_counter": self.cooldown_counter,
+            "wait": self.wait,
+            "reduction_counter": self.reduction_counter,
+            "current_best_loss": self.current_best_loss,
+        }
+
+    def save_checkpoint(self, path: str):
+        """Writes a checkpoint: the variables of the model and the optimizer as a TensorFlow checkpoint
+        "<path>-<epoch>" and the trainer's bookkeeping (see checkpoint_state) pickled to path, which refers to the
+        variables. The variables are copied before this function returns and written in the background (if supported
+        by TensorFlow), the bookkeeping is written in a background thread, hence training can continue right away. At
+        most one checkpoint is pending at a time and path is replaced atomically once the variables are written, such
+        that an interruption never leaves a partially written checkpoint behind.
+
+        Args:
+            path (str): path of the checkpoint file
+        """
+        state = self.checkpoint_state()
+
+        self.wait_for_checkpoint()
+
+        state["variables"] = self.checkpoint.write(path + "-" + str(self.epoch), options=self.checkpoint_options)
+
+        if self.checkpoint_writer is None:
+            self.checkpoint_writer = ThreadPoolExecutor(max_workers=1)
+
+        self.pending_checkpoint = self.checkpoint_writer.submit(self.finish_checkpoint, path, state)
+
+    def finish_checkpoint(self,
+                          path: str,
+                          state: dict):
+        """Writes the bookkeeping of a checkpoint once its variables are written and removes the variables of earlier
+        checkpoints (see save_checkpoint)"""
+        if self.async_checkpoint:
+            self.checkpoint.sync()
+
+        write_checkpoint(path, state)
+
+        for file_name in glob.glob(path + "-*"):
+            if not file_name.startswith(state["variables"] + "."):
+                os.remove(file_name)
+
+    def wait_for_checkpoint(self):
+        """Blocks until the pending checkpoint (if any) is written"""
+        if self.pending_checkpoint is not None:
+            self.pending_checkpoint.result()
+            self.pending_checkpoint = None
+
+    def restore_checkpoint(self, path: str):
+        """Restores the state of a checkpoint written by save_checkpoint. The trainer has to be set up exactly like
+        the one that wrote the checkpoint (same model, optimizer and replicas), a checkpoint of a different model is
+        refused. Slot variables of the optimizer are only created on the first update and restored then.
+
+        Args:
+            path (str): path of the checkpoint file
+        """
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+
+        if not self.model.built:
+            # variables of keras layers are only created when the model is called for the first time
+            x_batch, _ = next(iter(self.ds_train))
+            self.model(x_batch, training=False)
+
+        # raises if the shape of a variable differs or a variable of the model is missing in the checkpoint, the save
+        # counter of the checkpoint is not restored
+        self.checkpoint.read(state["variables"]).assert_existing_objects_matched().expect_partial()
+
+        self.epoch = state["epoch"]
+        self.train_steps = state["train_steps"]
+
+        self.train_loss_history = state["train_loss_history"]
+        self.train_acc_history = state["train_acc_history"]
+        self.test_loss_history = state["test_loss_history"]
+        self.test_acc_history = state["test_acc_history"]
+        self.one_ratio_history = state["one_ratio_history"]
+        self.mask_count_history = state["mask_count_history"]
+        self.step_mask_count_history = state["step_mask_count_history"]
+
+        self.cooldown_counter = state["cooldown_counter"]
+        self.wait = state["wait"]
+        self.reduction_counter = state["reduction_counter"]
+        self.current_best_loss = state["current_best_loss"]
+
+        print("Resuming training from checkpoint after epoch", self.epoch)
 
     @tf.function
     def evaluate_step(self, x_batch, y_batch):
@@ -329,23 +805,60 @@ class ModelTrainer():
             y_batch (tf.dataset): labels of a batch of evaluation data
 
         Returns:
-            float: returns the test prediction and test loss
+            float: returns the test prediction and test loss (one loss per replica if replicas are trained)
         """
-        test_pred = self.model(x_batch, training=False)
-        test_loss = self.test_loss_fn(y_batch, test_pred)
+        return self.forward(x_batch, y_batch)
+
+    def forward(self, x_batch, y_batch):
+        """Forward pass of an evaluation step. Compiled with XLA if the trainer was set up with jit_compile.
+
+        Args:
+            x_batch (tf.Tensor): a batch of evaluation data
+            y_batch (tf.Tensor): labels of a batch of evaluation data
+
+        Returns:
+            Tuple[tf.Tensor, tf.Tensor]: test prediction and test loss
+        """
+        test_pred = tf.cast(self.model(x_batch, training=False), tf.float32)
+
+        if self.replicas is None:
+            test_loss = self.test_loss_fn(y_batch, test_pred)
+        else:
+            test_loss = tf.stack([self.test_loss_fn(y_batch, test_pred[r]) for r in range(self.replicas)])
 
         return test_pred, test_loss
 
 
+    @tf.function
+    def cache_weights(self):
+        """Materialises the effective weights of all masked layers (see MaskedDense.cache_weights)"""
+        for layer in self.iterator_layers(self.model):
+            if layer.type == "fefo" or layer.type == "conv":
+                layer.cache_weights()
+
+    @tf.function
+    def release_cache(self):
+        """Releases the effective weights cached by cache_weights"""
+        for layer in self.iterator_layers(self.model):
+            if layer.type == "fefo" or layer.type == "conv":
+                layer.release_cache()
+
     def evaluate(self):
-        """Evaluates the model on the evaluation dataset
+        """Evaluates the model on the evaluation dataset. The masks do not change during evaluation, hence the
+        effective weights are computed once and reused for all test batches.
         """
-        for x_batch_test, y_batch_test in self.ds_test:
+        self.cache_weights()
+
+        try:
+            for x_batch_test, y_batch_test in self.ds_test:
+
+                test_pred, test_loss = self.evaluate_step(x_batch_test, y_batch_test)
 
-            test_pred, test_loss = self.evaluate_step(x_batch_test, y_batch_test)
+                self.update_metrics(self.test_loss_metric, self.test_acc_metric, y_batch_test, test_loss, test_pred)
 
-            self.test_loss_metric(test_loss)
-            self.test_acc_metric(y_batch_test, test_pred)
+        finally:
+            # training has to compute the effective weights from the mask again, even if evaluation failed
+            self.release_cache()
 
 
         self.test_loss_history.append(self.test_loss_metric.result().numpy())
@@ -353,3 +866,30 @@ class ModelTrainer():
 
         self.test_loss_metric.reset_states()
         self.test_acc_metric.reset_states()
+
+def write_checkpoint(path: str,
+                     state: dict):
+    """Pickles a checkpoint state to a temporary file and moves it to path
+
+    Args:
+        path (str): path of the checkpoint file
+        state (dict): state as returned by ModelTrainer.checkpoint_state, with the prefix of its variables
+    """
+    temp_path = path + ".tmp"
+
+    with open(temp_path, 'wb') as handle:
+        pickled = pickle.dumps(state)
+        optimized_pickle = pickletools.optimize(pickled)
+        handle.write(optimized_pickle)
+
+    os.replace(temp_path, path)
+
+def remove_checkpoint(path: str):
+    """Removes a checkpoint written by ModelTrainer.save_checkpoint, including the files of its variables
+
+    Args:
+        path (str): path of the checkpoint file
+    """
+    for file_name in glob.glob(path + "-*") + [path]:
+        if os.path.exists(file_name):
+            os.remove(file_name)
@@ -533,7 +533,7 @@ class ResNet20_Mask(tf.keras.Model):
 
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv1(inputs)
         x = self.bn1(x)
@@ -834,7 +834,7 @@ class ResNet56_Mask(tf.keras.Model):
 
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv1(inputs)
         x = self.bn1(x)
@@ -1348,7 +1348,7 @@ class ResNet110_Mask(tf.keras.Model):
 
 
     @tf.function
-    def call(self, inputs):
+    def call(self, inputs, training=None):
 
         x = self.conv1(inputs)
         x = self.bn1(x)
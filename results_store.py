@@ -0,0 +1,397 @@
+import hashlib
+import json
+import os
+import pickle
+import pickletools
+
+import numpy as np
+
+from mask_storage import save_packed_masks, merge_packed_masks, PackedMaskReader
+
+# file of a RunStore holding the fingerprint of the config its runs were trained with
+FINGERPRINT_FILE = "config_fingerprint.txt"
+
+# histories of which the last value (and for test_acc also the best value) is kept by summarize_run
+SUMMARY_METRICS = ["train_loss", "train_acc", "test_loss", "test_acc", "one_ratio"]
+
+def summarize_run(intermediate_results: dict) -> dict:
+    """Reduces the results of a run to a few scalars: the last value of each history in SUMMARY_METRICS, the best test
+    accuracy, the number of epochs and the training time
+
+    Args:
+        intermediate_results (dict): results of the run as returned by experiment_looper.run_experiment
+
+    Returns:
+        dict: summary of the run
+    """
+    summary = {}
+
+    for key in SUMMARY_METRICS:
+        history = np.asarray(intermediate_results.get(key, []), dtype=np.float64)
+        summary[key] = history[-1].tolist() if len(history) > 0 else None
+
+    test_acc = np.asarray(intermediate_results.get("test_acc", []), dtype=np.float64)
+    summary["best_test_acc"] = test_acc.max(axis=0).tolist() if len(test_acc) > 0 else None
+
+    summary["epochs"] = len(intermediate_results.get("train_loss", []))
+    summary["training_time"] = float(intermediate_results.get("training_time", 0.))
+
+    return summary
+
+def config_fingerprint(config: dict) -> str:
+    """Returns the fingerprint of a config, equal configs (irrespective of the order of their keys) share it"""
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def pad_histories(histories: list):
+    """Stacks the histories of several runs into one array of shape (runs, epochs, ...). Shorter histories are padded
+    with NaN (floats) or -1 (integers).
+
+    Args:
+        histories (list): history (list of values) of each run
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: stacked histories and the length of each history
+    """
+    arrays = [np.asarray(history) for history in histories]
+    lengths = np.asarray([len(array) for array in arrays], dtype=np.int64)
+
+    filled = [array for array in arrays if len(array) > 0]
+
+    if len(filled) == 0:
+        return np.zeros((len(arrays), 0), dtype=np.float32), lengths
+
+    dtype = np.result_type(*filled)
+    fill_value = np.nan if np.issubdtype(dtype, np.floating) else -1
+
+    column = np.full((len(arrays), lengths.max()) + filled[0].shape[1:], fill_value, dtype=dtype)
+
+    for index, array in enumerate(arrays):
+        if len(array) > 0:
+            column[index, :len(array)] = array
+
+    return column, lengths
+
+def save_results_table(path: str,
+                       results,
+                       run_numbers: list,
+                       config: dict):
+    """Saves the results of a sweep in a columnar format read by ResultsTable: an uncompressed .npz archive holding one
+    array per history of shape (runs, epochs, ...) (see pad_histories) together with the length of each run's
+    history ("<name>_lengths"), one array per scalar result of shape (runs,), the run numbers, the config and its
+    fingerprint. Final masks are not stored. Runs that lack a result hold an empty history or NaN in its column.
+
+    Args:
+        path (str): path of the .npz file
+        results (iterable): results of each run, e.g. read one at a time from a RunStore
+        run_numbers (list): numbers of the runs, in the order of results
+        config (dict): config of the sweep
+    """
+    # maps each result to the values of the runs that have it, by position of the run
+    histories = {}
+    scalars = {}
+
+    for position, intermediate_results in enumerate(results):
+        for key, value in intermediate_results.items():
+            if key == "final_masks" or key == "final_masks_file":
+                continue
+
+            if np.ndim(value) == 0:
+                scalars.setdefault(key, {})[position] = value
+            else:
+                histories.setdefault(key, {})[position] = value
+
+    columns = {"runs": np.asarray(run_numbers, dtype=np.int64),
+               "config": np.asarray(json.dumps(config, sort_keys=True, default=str)),
+               "fingerprint": np.asarray(config_fingerprint(config))}
+
+    for key, values in histories.items():
+        columns[key], columns[key + "_lengths"] = pad_histories([values.get(position, [])
+                                                                 for position in range(len(run_numbers))])
+
+    for key, values in scalars.items():
+        if len(values) == len(run_numbers):
+            columns[key] = np.asarray([values[position] for position in range(len(run_numbers))])
+        else:
+            columns[key] = np.asarray([values.get(position, np.nan) for position in range(len(run_numbers))],
+                                      dtype=np.float64)
+
+    temp_path = path + ".tmp"
+
+    with open(temp_path, 'wb') as handle:
+        np.savez(handle, **columns)
+
+    os.replace(temp_path, path)
+
+class ResultsTable:
+    """Reads the results of a sweep saved with save_results_table. Columns are only read on request, hence queries
+    over many sweeps only read the needed metrics.
+
+    Arguments:
+        path (str): path of the .npz file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.archive = np.load(path)
+
+        self.fingerprint = str(self.archive["fingerprint"])
+        self.run_numbers = self.archive["runs"]
+
+    def config(self) -> dict:
+        """Returns the config of the sweep"""
+        return json.loads(str(self.archive["config"]))
+
+    def runs(self) -> np.ndarray:
+        """Returns the run numbers, in the order of the rows of every column"""
+        return self.run_numbers
+
+    def metrics(self) -> list:
+        """Returns the names of all stored results"""
+        return sorted(key[:-len(".npy")] for key in self.archive.zip.namelist()
+                      if key[:-len(".npy")] not in ["runs", "config", "fingerprint"]
+                      and not key.endswith("_lengths.npy"))
+
+    def column(self, metric: str) -> np.ndarray:
+        """Returns a stored result of all runs, of shape (runs, epochs, ...) for histories and (runs,) for scalars"""
+        return self.archive[metric]
+
+    def lengths(self, metric: str) -> np.ndarray:
+        """Returns the length of a history of every run"""
+        return self.archive[metric + "_lengths"]
+
+    def at_epoch(self,
+                 metric: str,
+                 epoch: int) -> np.ndarray:
+        """Returns the value of a history at the given (0-based, negative counts from the end) index for every run,
+        NaN or -1 for runs whose history is shorter
+
+        Args:
+            metric (str): name of the history
+            epoch (int): index into the history
+
+        Returns:
+            np.ndarray: value of every run
+        """
+        column = self.column(metric)
+        lengths = self.lengths(metric)
+
+        index = lengths + epoch if epoch < 0 else np.full_like(lengths, epoch)
+        valid = (index >= 0) & (index < lengths)
+
+        fill_value = np.nan if np.issubdtype(column.dtype, np.floating) else -1
+        values = np.full((len(column),) + column.shape[2:], fill_value, dtype=column.dtype)
+        values[valid] = column[np.flatnonzero(valid), index[valid]]
+
+        return values
+
+    def final(self, metric: str) -> np.ndarray:
+        """Returns the last value of a history for every run"""
+        return self.at_epoch(metric, -1)
+
+    def best(self,
+             metric="test_acc",
+             maximize=True) -> np.ndarray:
+        """Returns the best value of a history for every run, the maximum by default (e.g. of the test accuracy).
+        The padding of shorter histories is ignored, runs with an empty history get NaN or -1.
+
+        Args:
+            metric (str, optional): name of the history. Defaults to "test_acc".
+            maximize (bool, optional): if False, the minimum is returned (e.g. of a loss). Defaults to True.
+
+        Returns:
+            np.ndarray: best value of every run
+        """
+        column = self.column(metric)
+
+        if np.issubdtype(column.dtype, np.floating):
+            # padded with NaN, which is skipped
+            return np.nanmax(column, axis=1) if maximize else np.nanmin(column, axis=1)
+
+        # the padding (-1) of integer histories is masked by the length of each history
+        lengths = self.lengths(metric)
+        padding = np.arange(column.shape[1])[None, :] >= lengths[:, None]
+        padding = np.broadcast_to(padding.reshape(padding.shape + (1,) * (column.ndim - 2)), column.shape)
+
+        values = np.ma.masked_array(column, mask=padding)
+        best = values.max(axis=1) if maximize else values.min(axis=1)
+
+        return np.ma.filled(best, -1)
+
+    def close(self):
+        self.archive.close()
+
+def read_results_tables(directory: str) -> dict:
+    """Opens the results tables ("*_table.npz", see save_results_table) of all sweeps in a directory, e.g. to compare
+    them. No column is read yet.
+
+    Args:
+        directory (str): directory holding the results tables
+
+    Returns:
+        dict: maps the name of each sweep to its ResultsTable
+    """
+    return {file_name[:-len("_table.npz")]: ResultsTable(os.path.join(directory, file_name))
+            for file_name in sorted(os.listdir(directory)) if file_name.endswith("_table.npz")}
+
+class RunStore:
+    """On-disk store for the results of a sweep. The results of each run are written to separate files as soon as the
+    run is finished: every history as a column (np.ndarray) of one .npz file and the final masks in the packed ternary
+    format (see mask_storage). Hence an interrupted sweep can be resumed by skipping the completed runs, and a sweep
+    only needs to keep a summary of each run in memory.
+
+    Arguments:
+        directory (str): directory holding the results of the sweep
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def fingerprint_path(self) -> str:
+        """Returns the path of the file holding the fingerprint of the config of the store"""
+        return os.path.join(self.directory, FINGERPRINT_FILE)
+
+    def bind_config(self,
+                    config: dict,
+                    resume=False):
+        """Records the fingerprint (see config_fingerprint) of the config the runs of the store are trained with. With
+        resume=True, a store whose runs were trained with a different config is refused, as its completed runs would
+        otherwise be mixed into the results of this config.
+
+        Args:
+            config (dict): config of the runs
+            resume (bool, optional): if True, completed runs of the store will be kept. Defaults to False.
+
+        Raises:
+            ValueError: if resume is True and the store holds runs of a different config
+        """
+        fingerprint = config_fingerprint(config)
+
+        if resume and os.path.exists(self.fingerprint_path()):
+            with open(self.fingerprint_path()) as handle:
+                stored_fingerprint = handle.read().strip()
+
+            if stored_fingerprint != fingerprint:
+                raise ValueError(f"Cannot resume {self.directory}: its runs were trained with config "
+                                 f"{stored_fingerprint}, not {fingerprint}. Use a different results directory or "
+                                 f"start over without resume.")
+
+        elif resume and len(self.completed_runs()) > 0:
+            print("Warning:", self.directory, "holds no config fingerprint, its completed runs cannot be verified")
+
+        temp_path = self.fingerprint_path() + ".tmp"
+
+        with open(temp_path, "w") as handle:
+            handle.write(fingerprint)
+
+        os.replace(temp_path, self.fingerprint_path())
+
+    def run_path(self, run_number: int) -> str:
+        """Returns the path of the results file of a run"""
+        return os.path.join(self.directory, "run_" + str(run_number) + "_metrics.npz")
+
+    def masks_path(self, run_number: int) -> str:
+        """Returns the path of the final masks file of a run"""
+        return os.path.join(self.directory, "run_" + str(run_number) + "_masks.npz")
+
+    def save(self,
+             run_number: int,
+             intermediate_results: dict):
+        """Saves the results of a finished run. The results file is written last and atomically, hence a run only
+        counts as completed if all of its files were written.
+
+        Args:
+            run_number (int): number of the run
+            intermediate_results (dict): results of the run as returned by experiment_looper.run_experiment
+        """
+        if "final_masks" in intermediate_results:
+            save_packed_masks(self.masks_path(run_number), {run_number: intermediate_results["final_masks"]})
+
+        columns = {key: np.asarray(value) for key, value in intermediate_results.items() if key != "final_masks"}
+
+        temp_path = self.run_path(run_number) + ".tmp"
+
+        with open(temp_path, 'wb') as handle:
+            np.savez(handle, **columns)
+
+        os.replace(temp_path, self.run_path(run_number))
+
+    def completed_runs(self) -> list:
+        """Returns the numbers of all completed runs"""
+        completed_runs = set()
+
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith("run_") and file_name.endswith("_metrics.npz"):
+                completed_runs.add(int(file_name[len("run_"):-len("_metrics.npz")]))
+
+        return sorted(completed_runs)
+
+    def load(self,
+             run_number: int,
+             load_masks=True) -> dict:
+        """Loads the results of a completed run. Histories are returned as lists, as collected by
+        experiment_looper.collect_results.
+
+        Args:
+            run_number (int): number of the run
+            load_masks (bool, optional): if True, the final masks are loaded as well. Defaults to True.
+
+        Returns:
+            dict: results of the run
+        """
+        with np.load(self.run_path(run_number)) as columns:
+            intermediate_results = {key: list(columns[key]) if columns[key].ndim > 0 else columns[key].item()
+                                    for key in columns.files}
+
+        if load_masks and os.path.exists(self.masks_path(run_number)):
+            reader = PackedMaskReader(self.masks_path(run_number))
+            intermediate_results["final_masks"] = reader.masks(run_number)
+            reader.close()
+
+        return intermediate_results
+
+    def export_table(self,
+                     path: str,
+                     run_numbers: list,
+                     config: dict):
+        """Saves the results of the given runs in the columnar format (see save_results_table), the runs are read one
+        at a time and without their masks
+
+        Args:
+            path (str): path of the .npz file
+            run_numbers (list): numbers of the runs
+            config (dict): config of the sweep
+        """
+        save_results_table(path,
+                           (self.load(run_number, load_masks=False) for run_number in run_numbers),
+                           run_numbers,
+                           config)
+
+    def summary(self, run_number: int) -> dict:
+        """Returns the summary (see summarize_run) of a completed run, the final masks are not read"""
+        return summarize_run(self.load(run_number, load_masks=False))
+
+    def export(self,
+               results_path: str,
+               masks_path: str,
+               run_numbers: list):
+        """Writes the results of the given runs into a single pickled list (histories only, each run's entry
+        "final_masks_file" holds the file name of the masks) and their final masks into a single packed mask file,
+        i.e. the files written by experiment_looper.save_results. The runs are read one at a time and the packed
+        masks are copied without unpacking them, hence the memory needed does not depend on the size of the model.
+
+        Args:
+            results_path (str): path of the pickled results
+            masks_path (str): path of the packed masks
+            run_numbers (list): numbers of the runs, in the order in which they are stored
+        """
+        merge_packed_masks(masks_path, [self.masks_path(run_number) for run_number in run_numbers
+                                        if os.path.exists(self.masks_path(run_number))])
+
+        results = [{**self.load(run_number, load_masks=False), "final_masks_file": os.path.basename(masks_path)}
+                   for run_number in run_numbers]
+
+        with open(results_path, 'wb') as handle:
+            pickled = pickle.dumps(results)
+            optimized_pickle = pickletools.optimize(pickled)
+            handle.write(optimized_pickle)
@@ -0,0 +1,285 @@
+import argparse
+import copy
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from experiment_looper import parse_config_file, set_training_defaults, repeat_experiment
+from experiment_looper import split_cores, pin_worker, worker_cores, prepare_worker_cache
+from data_preprocessor import data_handler
+from results_store import RunStore, config_fingerprint
+
+# config sections whose parameters can be swept
+SWEEP_SECTIONS = ["model", "init", "optimizer", "training"]
+
+# training parameters that (together with "data") determine the dataset of a trial, trials that agree on them share it
+DATA_PARAMETERS = ["data_cache_dir", "data_cache_dtype", "in_memory_data", "synthetic_examples", "imagenet_dir"]
+
+def set_parameter(config: dict,
+                  name: str,
+                  value):
+    """Sets a parameter given by its dotted path (e.g. "optimizer.lr" or "init.weight.factor"). Only parameters that
+    exist in the config (or have a default, see set_training_defaults) can be set.
+
+    Args:
+        config (dict): config file
+        name (str): dotted path of the parameter
+        value: value of the parameter
+    """
+    keys = name.split(".")
+
+    if keys[0] not in SWEEP_SECTIONS:
+        raise ValueError(f"Cannot sweep {name}, only parameters of the sections {SWEEP_SECTIONS} can be swept")
+
+    section = config
+
+    for key in keys[:-1]:
+        if not isinstance(section.get(key), dict):
+            raise KeyError(f"{name} is not a parameter of the config")
+        section = section[key]
+
+    if keys[-1] not in section:
+        raise KeyError(f"{name} is not a parameter of the config")
+
+    section[keys[-1]] = value
+
+def sample_parameter(values,
+                     rng: np.random.Generator):
+    """Draws a random value of a parameter: one of a list of values or from a range {"min": .., "max": ..}, which is
+    sampled log-uniformly if "log" is True and rounded if "integer" is True"""
+    if isinstance(values, list):
+        return values[int(rng.integers(len(values)))]
+
+    if values.get("log", False):
+        value = float(np.exp(rng.uniform(np.log(values["min"]), np.log(values["max"]))))
+    else:
+        value = float(rng.uniform(values["min"], values["max"]))
+
+    return int(round(value)) if values.get("integer", False) else value
+
+def expand_sweep(sweep: dict) -> list:
+    """Expands a sweep into the parameters of its trials. A grid sweep ("method": "grid") has a trial for every
+    combination of the listed values, a random sweep ("method": "random") has sweep["trials"] trials whose values are
+    drawn with sample_parameter (seeded with sweep["seed"]).
+
+    Args:
+        sweep (dict): sweep file
+
+    Returns:
+        list: maps the dotted path of every swept parameter to its value, one dict per trial
+    """
+    parameters = sweep["parameters"]
+    method = sweep.get("method", "grid")
+
+    if method == "grid":
+        for name, values in parameters.items():
+            if not isinstance(values, list):
+                raise ValueError(f"A grid sweep needs a list of values for every parameter, got {values} for {name}")
+
+        names = list(parameters)
+
+        return [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+
+    if method == "random":
+        rng = np.random.default_rng(sweep.get("seed", 0))
+
+        return [{name: sample_parameter(values, rng) for name, values in parameters.items()}
+                for _ in range(sweep["trials"])]
+
+    raise ValueError(f"Unknown sweep method {method}, expected grid or random")
+
+def trial_configs(sweep: dict,
+                  base_config: dict) -> dict:
+    """Builds the config of every trial of a sweep. Trials are identified by the fingerprint of their complete config
+    (see results_store.config_fingerprint), hence trials with equal configs are only trained once. Trials always use
+    a single process, as the sweep distributes the trials itself.
+
+    Args:
+        sweep (dict): sweep file
+        base_config (dict): config the swept parameters are set in
+
+    Returns:
+        dict: maps the fingerprint of every trial to its parameters and config
+    """
+    trials = {}
+
+    for parameters in expand_sweep(sweep):
+        config = copy.deepcopy(base_config)
+        set_training_defaults(config)
+
+        for name, value in parameters.items():
+            set_parameter(config, name, value)
+
+        config["training"]["workers"] = 1
+        config["training"]["distributed_workers"] = 1
+
+        trials.setdefault(config_fingerprint(config), (parameters, config))
+
+    return trials
+
+def data_key(config: dict) -> str:
+    """Returns a key that is equal for all configs that are trained on the same dataset"""
+    return json.dumps([config["data"]] + [config["training"][parameter] for parameter in DATA_PARAMETERS])
+
+def table_path(directory: str, fingerprint: str) -> str:
+    """Returns the path of the results table of a trial, a trial is completed once its table exists"""
+    return os.path.join(directory, fingerprint + "_table.npz")
+
+# dataset of the last trial trained in this process, reused by the following trials with the same data_key
+shared_datasets = {}
+
+def trial_datasets(config: dict):
+    """Returns the training and test set of a trial. The dataset is only loaded if the previous trial of this process
+    was trained on a different one.
+
+    Args:
+        config (dict): config of the trial
+
+    Returns:
+        Tuple: training and test set
+    """
+    key = data_key(config)
+
+    if key not in shared_datasets:
+        shared_datasets.clear()
+
+        print("Loading dataset...")
+        shared_datasets[key] = data_handler(config["data"],
+                                            cache_dir=config["training"]["data_cache_dir"],
+                                            cache_dtype=config["training"]["data_cache_dtype"],
+                                            in_memory=config["training"]["in_memory_data"],
+                                            synthetic_examples=config["training"]["synthetic_examples"],
+                                            imagenet_dir=config["training"]["imagenet_dir"])
+        print("Dataset loaded!")
+
+    return shared_datasets[key]
+
+def run_trial(fingerprint: str,
+              config: dict,
+              directory: str) -> tuple:
+    """Trains all runs of a trial. The runs are stored in "<directory>/<fingerprint>/" (see RunStore), hence an
+    interrupted trial is resumed, and the results table of the trial is written once all runs are finished.
+
+    Args:
+        fingerprint (str): fingerprint of the trial
+        config (dict): config of the trial
+        directory (str): results directory of the sweep
+
+    Returns:
+        Tuple[str, list]: fingerprint and summaries of the runs of the trial
+    """
+    run_config = copy.deepcopy(config)
+
+    # trials train the same run numbers, hence their checkpoints are kept apart
+    if run_config["training"]["checkpoint_dir"] is not None:
+        run_config["training"]["checkpoint_dir"] = os.path.join(run_config["training"]["checkpoint_dir"], fingerprint)
+
+    store = RunStore(os.path.join(directory, fingerprint))
+
+    summaries = repeat_experiment(run_config,
+                                  store=store,
+                                  resume=True,
+                                  datasets=trial_datasets(run_config))
+
+    store.export_table(table_path(directory, fingerprint),
+                       run_numbers=list(range(config["training"]["no_experiments"])),
+                       config=config)
+
+    return fingerprint, summaries
+
+def init_sweep_worker(core_queue,
+                      inter_op_threads: int):
+    """Initializes a worker process of run_sweep, see experiment_looper.pin_worker"""
+    pin_worker(worker_cores(core_queue), inter_op_threads)
+
+def run_trial_task(task: tuple) -> tuple:
+    return run_trial(*task)
+
+def run_sweep(sweep: dict,
+              name: str) -> dict:
+    """Runs the trials of a sweep over a base config (see configs/conv_sample_sweep.yaml). Trials whose results table
+    already exists in the results directory, e.g. because an earlier sweep trained the same config, are skipped. The
+    remaining trials are ordered by their dataset and distributed over sweep["workers"] worker processes (each pinned
+    to an equal share of the CPU cores), consecutive trials of a worker share the loaded dataset (see trial_datasets).
+    An index of the trials is written to "<results_dir>/<name>_sweep.json".
+
+    Args:
+        sweep (dict): sweep file
+        name (str): name of the sweep
+
+    Returns:
+        dict: maps the fingerprint of every trial to its parameters and the path of its results table (see
+              results_store.ResultsTable)
+    """
+    base_config = parse_config_file(sweep["base"])
+    directory = sweep.get("results_dir", "./results/sweeps/")
+    workers = sweep.get("workers", 1)
+
+    os.makedirs(directory, exist_ok=True)
+
+    trials = trial_configs(sweep, base_config)
+
+    pending = sorted((fingerprint for fingerprint in trials if not os.path.exists(table_path(directory, fingerprint))),
+                     key=lambda fingerprint: data_key(trials[fingerprint][1]))
+
+    print(f"Sweep {name}: {len(trials)} trials, skipping {len(trials) - len(pending)} completed trials")
+
+    index = {fingerprint: {"parameters": parameters, "table": table_path(directory, fingerprint)}
+             for fingerprint, (parameters, _) in trials.items()}
+
+    with open(os.path.join(directory, name + "_sweep.json"), "w") as handle:
+        json.dump(index, handle, indent=1)
+
+    tasks = [(fingerprint, trials[fingerprint][1], directory) for fingerprint in pending]
+
+    if workers <= 1:
+        for task in tasks:
+            run_trial_task(task)
+            print("Trial", task[0], "finished!")
+
+        return index
+
+    # decode every dataset once here instead of once per worker
+    for config in {data_key(config): config for _, config, _ in tasks}.values():
+        prepare_worker_cache(config)
+
+    context = multiprocessing.get_context("spawn")
+
+    core_queue = context.Queue()
+    for cores in split_cores(workers):
+        core_queue.put(cores)
+
+    # fails with BrokenProcessPool if a worker dies, see experiment_looper.parallel_repeat_experiment
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context,
+                             initializer=init_sweep_worker,
+                             initargs=(core_queue, sweep.get("inter_op_threads", 1))) as pool:
+
+        for trial in as_completed([pool.submit(run_trial_task, task) for task in tasks]):
+            fingerprint, _ = trial.result()
+            print("Trial", fingerprint, "finished!")
+
+    return index
+
+def main_sweep(sweep_path: str) -> dict:
+    """Loads a sweep file and runs the sweep, named after the file (see run_sweep)
+
+    Args:
+        sweep_path (str): path to the sweep file
+
+    Returns:
+        dict: index of the trials
+    """
+    sweep = parse_config_file(path=sweep_path)
+
+    return run_sweep(sweep, name=os.path.splitext(os.path.basename(sweep_path))[0])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a hyperparameter sweep over a base config")
+    parser.add_argument("sweep_path", help="path to the sweep file, e.g. configs/conv_sample_sweep.yaml")
+
+    main_sweep(parser.parse_args().sweep_path)
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import experiment_looper
+from model_trainer import ModelTrainer
+from results_store import RunStore
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "conv_sample_config.yaml")
+
+class Interrupted(Exception):
+    pass
+
+def small_config(checkpoint_dir: str) -> dict:
+    """Two short FCN runs on synthetic MNIST, checkpointed after every epoch"""
+    config = experiment_looper.parse_config_file(CONFIG_PATH)
+
+    config["data"] = "synthetic-mnist"
+    config["model"]["type"] = "FCN"
+    config["training"]["epochs"] = 4
+    config["training"]["no_experiments"] = 2
+    config["training"]["synthetic_examples"] = [256, 128]
+    config["training"]["checkpoint_dir"] = checkpoint_dir
+    config["training"]["checkpoint_interval"] = 1
+
+    return config
+
+def test_interrupted_later_run_resumes_from_its_checkpoint(tmp_path, monkeypatch):
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    store = RunStore(str(tmp_path / "results"))
+
+    save_checkpoint = ModelTrainer.save_checkpoint
+
+    def interrupt_run_1(trainer, path):
+        save_checkpoint(trainer, path)
+
+        # run 0 has been trained in this process before, i.e. its trainer already saw the config
+        if "_run_1_" in os.path.basename(path) and trainer.epoch == 2:
+            trainer.wait_for_checkpoint()
+            raise Interrupted()
+
+    monkeypatch.setattr(ModelTrainer, "save_checkpoint", interrupt_run_1)
+
+    with pytest.raises(Interrupted):
+        experiment_looper.repeat_experiment(small_config(checkpoint_dir), store=store, resume=True)
+
+    assert store.completed_runs() == [0]
+
+    monkeypatch.setattr(ModelTrainer, "save_checkpoint", save_checkpoint)
+
+    restored_epochs = []
+    restore_checkpoint = ModelTrainer.restore_checkpoint
+
+    def record_restore(trainer, path):
+        restore_checkpoint(trainer, path)
+        restored_epochs.append(trainer.epoch)
+
+    monkeypatch.setattr(ModelTrainer, "restore_checkpoint", record_restore)
+
+    # a fresh config, as read by a new process
+    results = experiment_looper.repeat_experiment(small_config(checkpoint_dir), store=store, resume=True)
+
+    assert restored_epochs == [2]
+    assert store.completed_runs() == [0, 1]
+    assert [summary["epochs"] for summary in results] == [4, 4]
+    assert os.listdir(checkpoint_dir) == []
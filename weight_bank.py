@@ -0,0 +1,100 @@
+import json
+import os
+
+import numpy as np
+
+HEADER_FILE = "header.json"
+
+def layer_file(layer_number: int) -> str:
+    """Returns the file name under which a layer's values of all runs are stored"""
+    return "layer_" + str(layer_number) + ".npy"
+
+def save_weight_bank(directory: str,
+                     layers: list,
+                     run_numbers: list):
+    """Saves the weights (or masks) of several runs as a bank: one .npy file per layer holding the values of all runs
+    stacked along the first axis, plus a json header that maps the run numbers to their index. Each layer is written
+    with a single call, the header is written last and atomically, hence a bank only counts as complete if all of its
+    layers were written.
+
+    Args:
+        directory (str): directory of the bank
+        layers (list): one np.ndarray of shape (len(run_numbers), ...) per layer
+        run_numbers (list): run numbers in the order in which they are stacked
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    header = {"runs": [int(r) for r in run_numbers], "layers": []}
+
+    for layer_number, values in enumerate(layers):
+        if len(values) != len(run_numbers):
+            raise ValueError(f"Layer {layer_number} holds {len(values)} runs, expected {len(run_numbers)}")
+
+        np.save(os.path.join(directory, layer_file(layer_number)), np.ascontiguousarray(values))
+
+        header["layers"].append({"file": layer_file(layer_number),
+                                 "shape": list(values.shape[1:]),
+                                 "dtype": str(values.dtype)})
+
+    temp_path = os.path.join(directory, HEADER_FILE + ".tmp")
+
+    with open(temp_path, "w") as handle:
+        json.dump(header, handle)
+
+    os.replace(temp_path, os.path.join(directory, HEADER_FILE))
+
+class WeightBank:
+    """Reads a bank written with save_weight_bank. The layer files are memory-mapped (read only), hence reading the
+    values of a run is a zero-copy slice and concurrent processes reading the same bank share the pages via the OS
+    cache.
+
+    Arguments:
+        directory (str): directory of the bank
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+        with open(os.path.join(directory, HEADER_FILE), "r") as handle:
+            self.header = json.load(handle)
+
+        self.run_index = {run_number: index for index, run_number in enumerate(self.header["runs"])}
+        self.layers = [np.load(os.path.join(directory, layer["file"]), mmap_mode="r")
+                       for layer in self.header["layers"]]
+
+    def runs(self) -> list:
+        """Returns the run numbers stored in the bank"""
+        return list(self.header["runs"])
+
+    def number_of_layers(self) -> int:
+        """Returns the number of layers stored in the bank"""
+        return len(self.layers)
+
+    def layer(self, run_number: int, layer_number: int) -> np.ndarray:
+        """Returns the values of a single layer of a run as a read-only view into the memory-mapped file
+
+        Args:
+            run_number (int): number of the run
+            layer_number (int): index of the layer
+
+        Returns:
+            np.ndarray: values of the layer
+        """
+        if run_number not in self.run_index:
+            raise KeyError(f"Run {run_number} is not stored in the bank {self.directory}")
+
+        return self.layers[layer_number][self.run_index[run_number]]
+
+    def weights(self, run_number: int) -> list:
+        """Returns the values of all layers of a run
+
+        Args:
+            run_number (int): number of the run
+
+        Returns:
+            list: values of each layer
+        """
+        return [self.layer(run_number, l) for l in range(self.number_of_layers())]
+
+    def close(self):
+        self.layers = []
@@ -1,9 +1,28 @@
+import os
 import pickle
 import pickletools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 import numpy as np
 import tensorflow as tf
 
+from mask_storage import PackedMaskReader
+from weight_bank import save_weight_bank, WeightBank
+
+# streams of the stateless initialization, such that weights and masks of the same layer are drawn independently
+WEIGHT_STREAM = 0
+MASK_STREAM = 1
+
+INITIALIZED_LAYERS = ["fefo", "conv", "fefo_normal", "conv_normal"]
+
+def stateless_rng(seed: int,
+                  stream: int,
+                  layer_index: int) -> np.random.Generator:
+    """Returns a counter-based (Philox) random generator keyed on (seed, stream, layer index)"""
+    key = (seed << 64) | (stream << 32) | layer_index
+
+    return np.random.Generator(np.random.Philox(key=key))
+
 class initializer:
     """Use this class to initialize weights of some tensorflow/keras model
     """
@@ -44,13 +63,29 @@ class initializer:
             fan_out *= float(dim)
         return fan_in, fan_out
 
+    def layer_rng(self,
+                  stream: int,
+                  layer_index: int) -> np.random.Generator:
+        """Returns a counter-based (Philox) random generator keyed on (seed, stream, layer index). The values drawn for
+        a layer only depend on this key, hence any layer can be regenerated on demand, independent of the other layers
+        and of the global random state.
+
+        Args:
+            stream (int): WEIGHT_STREAM or MASK_STREAM
+            layer_index (int): index of the layer among the layers to be initialized
+
+        Returns:
+            np.random.Generator: generator for the given layer
+        """
+        return stateless_rng(self.seed, stream, layer_index)
 
     def initialize_weights(self,
                            dist: str,
                            shape: tuple,
                            method: str,
                            single_value = False,
-                           factor=1.) -> np.ndarray:
+                           factor=1.,
+                           rng=None) -> np.ndarray:
         """Initializes weights for a given shape
 
         Args:
@@ -59,13 +94,21 @@ class initializer:
             method (str): either xavier or he. if elus/scaled elus is required, use he in combination with factor
             factor ([type], optional): constant by which initialized weights are multiplied with. Defaults to 1..
             single_value (bool): Use if you wish to initialize only a single weight
+            rng (np.random.Generator, optional): generator to draw the values from (see layer_rng). Defaults to None,
+            i.e. the global numpy random state.
 
 
         Returns:
             np.ndarray: initialized weights in given shape
         """
+        if rng is None:
+            rng = np.random
+
+        # the global random state keeps its original draws, such that existing runs are reproduced
+        stateless = isinstance(rng, np.random.Generator)
+
         if dist == "std_normal":
-            return np.random.randn(*shape)
+            return rng.standard_normal(shape)
 
         if dist == "uniform":
 
@@ -89,7 +132,10 @@ class initializer:
             # print("fan in, fan out", fan_in, fan_out)
             # print("uniform bound:", bound)
 
-            return np.random.uniform(-bound, bound, shape)
+            if stateless:
+                return bound * (2 * rng.random(shape, dtype=np.float32) - 1)
+
+            return rng.uniform(-bound, bound, shape)
 
         if dist == "normal":
 
@@ -102,7 +148,7 @@ class initializer:
 
             sigma *= factor
 
-            return  sigma*np.random.randn(*shape) # always assume mu = 0
+            return  sigma*rng.standard_normal(shape) # always assume mu = 0
         if dist == "zeros":
             return np.zeros(shape)
         if dist == "ones":
@@ -141,10 +187,13 @@ class initializer:
 
             if single_value:
                 norm = c
+            elif stateless:
+                # only the sign is random, hence a single random bit per weight suffices
+                size = int(np.prod(shape))
+                bits = np.unpackbits(np.frombuffer(rng.bytes((size + 7) // 8), dtype=np.uint8), count=size)
+                norm = np.where(bits.reshape(shape) == 1, np.float32(c), np.float32(-c))
             else:
-                norm = c*np.random.randn(*shape)
-                norm[norm >= 0] = c
-                norm[norm < 0] = -c
+                norm = np.where(rng.standard_normal(shape) >= 0, c, -c)
 
             return norm
 
@@ -333,6 +382,227 @@ class initializer:
 
         return model, initial_weights
 
+    def layer_shape(self, layer) -> list:
+        """Returns the shape of the weights of a single (unreplicated) layer"""
+        if layer.type == "fefo":
+            return [layer.input_dim, layer.units]
+        if layer.type == "conv":
+            return list(layer.weight_shape)
+
+        return list(layer.get_weights()[0].shape)
+
+    def set_weights_stateless(self,
+                              model: tf.keras.Model,
+                              dist="normal",
+                              method="xavier",
+                              factor=1.,
+                              set_mask=False) -> tf.keras.Model:
+        """Sets the weights (or masks) of a given tf model from the stateless generator of each layer (see layer_rng),
+        such that no weight files need to be stored or shared between processes. The layers are enumerated in the
+        order of iterate_layers, masked layers (fefo/conv) and normal layers (fefo_normal/conv_normal) alike.
+
+        Args:
+            model (tf.keras.Model): model for which weights need to be set
+            dist (str, optional): distribution of weight initialization. Defaults to "normal".
+            method (str, optional): see initialize_weights. Defaults to "xavier".
+            factor (float, optional): constant initialized weights get multiplied with. Defaults to 1..
+            set_mask (bool, optional): if True, the masks of the masked layers are set, otherwise their frozen weights.
+            Defaults to False.
+
+        Returns:
+            tf.keras.Model: model with newly initialized weights
+        """
+        return self.set_run_values(model, self.seed, dist=dist, method=method, factor=factor, set_mask=set_mask)
+
+    def set_weights_global(self,
+                           model: tf.keras.Model,
+                           dist="normal",
+                           method="xavier",
+                           factor=1.,
+                           set_mask=False) -> tf.keras.Model:
+        """Sets the weights (or masks) of a given tf model from the global random state, layer by layer in the order of
+        iterate_layers. The values are those of set_weights_man, i.e. they depend on the seed of the initializer and on
+        all values drawn before.
+
+        Args:
+            model (tf.keras.Model): model for which weights need to be set
+            dist (str, optional): distribution of weight initialization. Defaults to "normal".
+            method (str, optional): see initialize_weights. Defaults to "xavier".
+            factor (float, optional): constant initialized weights get multiplied with. Defaults to 1..
+            set_mask (bool, optional): if True, the masks of the masked layers are set, otherwise their frozen weights.
+            Defaults to False.
+
+        Returns:
+            tf.keras.Model: model with newly initialized weights
+        """
+        return self.set_run_values(model, None, dist=dist, method=method, factor=factor, set_mask=set_mask)
+
+    def set_run_values(self,
+                       model: tf.keras.Model,
+                       seed,
+                       dist="normal",
+                       method="xavier",
+                       factor=1.,
+                       set_mask=False) -> tf.keras.Model:
+        """Draws the weights (or masks) of a single run (see initialize_runs) and sets them in the model"""
+        values = self.initialize_runs(model, [seed], dist=dist, method=method, factor=factor, set_mask=set_mask)
+
+        for layer, W in zip((l for l in self.iterate_layers(model) if l.type in INITIALIZED_LAYERS), values):
+            self.set_layer_values(layer, W[0], set_mask)
+
+        return model
+
+    def initialize_runs(self,
+                        model: tf.keras.Model,
+                        seeds: list,
+                        dist="normal",
+                        method="xavier",
+                        factor=1.,
+                        set_mask=False,
+                        threads=None) -> list:
+        """Draws the weights (or masks) of all layers of a model for several runs at once, each run from the stateless
+        generators of its seed (see stateless_rng). The values are drawn into preallocated float32 arrays, one thread
+        per layer (numpy releases the GIL while drawing). Runs whose seed is None are drawn from the global random
+        state instead, run by run and layer by layer as set_weights_man draws them, hence without threads.
+
+        Args:
+            model (tf.keras.Model): (built) model that defines the layer shapes
+            seeds (list): seed of each run, None for the global random state
+            dist (str, optional): distribution of weight initialization. Defaults to "normal".
+            method (str, optional): see initialize_weights. Defaults to "xavier".
+            factor (float, optional): constant initialized weights get multiplied with. Defaults to 1..
+            set_mask (bool, optional): if True, masks are drawn, otherwise weights. Defaults to False.
+            threads (int, optional): number of threads. Defaults to None, i.e. one per layer up to the number of CPUs.
+
+        Returns:
+            list: one np.ndarray of shape (len(seeds), ...) per layer
+        """
+        stream = MASK_STREAM if set_mask else WEIGHT_STREAM
+
+        shapes = [self.layer_shape(l) for l in self.iterate_layers(model) if l.type in INITIALIZED_LAYERS]
+        values = [np.empty([len(seeds)] + shape, dtype="float32") for shape in shapes]
+
+        def initialize_value(layer_index, run_index):
+            seed = seeds[run_index]
+            rng = None if seed is None else stateless_rng(seed, stream, layer_index)
+
+            values[layer_index][run_index] = self.initialize_weights(dist=dist,
+                                                                     method=method,
+                                                                     shape=shapes[layer_index],
+                                                                     factor=factor,
+                                                                     rng=rng)
+
+        if any(seed is None for seed in seeds):
+            # the order of the draws from the global random state determines the values
+            for run_index in range(len(seeds)):
+                for layer_index in range(len(shapes)):
+                    initialize_value(layer_index, run_index)
+
+            return values
+
+        def initialize_layer(layer_index):
+            for run_index in range(len(seeds)):
+                initialize_value(layer_index, run_index)
+
+        if threads is None:
+            threads = max(1, min(len(shapes), os.cpu_count()))
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(initialize_layer, range(len(shapes))))
+
+        return values
+
+    def set_layer_values(self, layer, values: np.ndarray, set_mask: bool):
+        """Sets either the mask or the weights of a single masked or normal layer"""
+        if layer.type in ["fefo_normal", "conv_normal"]:
+            layer.set_weights([values])
+        elif set_mask:
+            layer.set_mask(values)
+        else:
+            layer.set_normal_weights(values)
+
+    def create_weight_bank(self,
+                           model: tf.keras.Model,
+                           path: str,
+                           run_numbers: list,
+                           dist="normal",
+                           method="xavier",
+                           factor=1.,
+                           set_mask=False):
+        """Draws the weights (or masks) of several runs and saves them as a memory-mapped bank (see weight_bank).
+        Run r is drawn from the stateless generators of seed self.seed + r, i.e. it holds exactly the values that
+        set_weights_stateless sets for run r in experiment_looper.initialize_model. All runs are drawn at once (see
+        initialize_runs) and each layer is written with a single call.
+
+        Args:
+            model (tf.keras.Model): (built) model that defines the layer shapes
+            path (str): directory of the bank
+            run_numbers (list): runs to be stored in the bank
+            dist (str, optional): distribution of weight initialization. Defaults to "normal".
+            method (str, optional): see initialize_weights. Defaults to "xavier".
+            factor (float, optional): constant initialized weights get multiplied with. Defaults to 1..
+            set_mask (bool, optional): if True, masks are drawn, otherwise weights. Defaults to False.
+        """
+        layers = self.initialize_runs(model,
+                                      [self.seed + run_number for run_number in run_numbers],
+                                      dist=dist,
+                                      method=method,
+                                      factor=factor,
+                                      set_mask=set_mask)
+
+        save_weight_bank(path, layers, run_numbers)
+
+    def save_weight_files(self,
+                          model: tf.keras.Model,
+                          save_to: str,
+                          layers: list,
+                          run_numbers: list):
+        """Saves the weights (or masks) of several runs drawn by initialize_runs as one pickle per run, named
+        save_to + "_<run number>.pkl", in the layout read by set_loaded_weights
+
+        Args:
+            model (tf.keras.Model): (built) model that defines the layer types
+            save_to (str): file path without run suffix
+            layers (list): one np.ndarray of shape (len(run_numbers), ...) per layer, see initialize_runs
+            run_numbers (list): run number of each entry
+        """
+        layer_types = [l.type for l in self.iterate_layers(model) if l.type in INITIALIZED_LAYERS]
+
+        for run_index, run_number in enumerate(run_numbers):
+            initial_weights = [W[run_index] if layer_type in ["fefo_normal", "conv_normal"] else [W[run_index]]
+                               for layer_type, W in zip(layer_types, layers)]
+
+            with open(save_to+"_"+str(run_number)+".pkl", 'wb') as handle:
+                pickled = pickle.dumps(initial_weights)
+                optimized_pickle = pickletools.optimize(pickled)
+                handle.write(optimized_pickle)
+
+    def set_bank_weights(self,
+                         model: tf.keras.Model,
+                         path: str,
+                         run_number: int,
+                         set_mask=False) -> tf.keras.Model:
+        """Sets the weights (or masks) of a specified model from a memory-mapped bank (see weight_bank). Only the
+        values of the requested run are read.
+
+        Args:
+            model (tf.keras.Model): model for which the weights need to be specified
+            path (str): directory of the bank
+            run_number (int): run whose values are to be set
+            set_mask (bool, optional): if True, the bank holds masks, otherwise weights. Defaults to False.
+
+        Returns:
+            tf.keras.Model: model with set weights
+        """
+        bank = WeightBank(path)
+
+        for layer_index, layer in enumerate(l for l in self.iterate_layers(model) if l.type in INITIALIZED_LAYERS):
+            self.set_layer_values(layer, bank.layer(run_number, layer_index), set_mask)
+
+        bank.close()
+
+        return model
+
     def set_loaded_weights(self,
                            model: tf.keras.Model,
                            path:str) -> tf.keras.Model:
@@ -369,3 +639,32 @@ class initializer:
                 layer_counter += 1
 
         return model
+
+    def set_packed_masks(self,
+                         model: tf.keras.Model,
+                         path: str,
+                         run_number: int) -> tf.keras.Model:
+        """Sets the masks of a specified model from a file in the packed ternary format (see mask_storage).
+        Only the masks of the requested run are read.
+
+        Args:
+            model (tf.keras.Model): model for which the masks need to be specified
+            path (str): path to the .npz file which holds the packed masks
+            run_number (int): run whose masks are to be set
+
+        Returns:
+            tf.keras.Model: model with set masks
+        """
+
+        reader = PackedMaskReader(path)
+
+        layer_counter = 0
+
+        for layer in self.iterate_layers(model):
+            if layer.type in ["fefo", "conv"]:
+                layer.set_mask(reader.layer(run_number, layer_counter))
+                layer_counter += 1
+
+        reader.close()
+
+        return model